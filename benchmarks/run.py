@@ -0,0 +1,305 @@
+"""
+Benchmarks of the artifact generation.
+
+Times the individual stages (issuing root and node certificates, creating
+the truststore and an entitystore) and complete runs of the
+`exhibitor-tls-artifacts` command for growing numbers of nodes. Results are
+written as `JSON` and can be compared against the results of an earlier run
+to make regressions visible:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json
+"""
+import datetime
+import json
+import math
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import click
+import click.testing
+
+from exhibitor_tls_artifacts.gen_artifacts import app
+from exhibitor_tls_artifacts.gen_certificates import (KEY_TYPES,
+                                                      CertificateGenerator)
+from exhibitor_tls_artifacts.gen_stores import BACKENDS, KeystoreGenerator
+
+RESULTS_VERSION = 1
+DEFAULT_NODE_COUNTS = '1,3,7,25,100'
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples, percent):
+    """ Nearest-rank percentile of `samples`. """
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """ Summary statistics of the `samples` in seconds. """
+    summary = {
+        'runs': len(samples),
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'max': max(samples),
+    }
+    for percent in PERCENTILES:
+        summary['p{}'.format(percent)] = percentile(samples, percent)
+    return summary
+
+
+def measure(func, repeat, setup=None):
+    """
+    Calls `func` `repeat` times. `setup` is called before every run and its
+    result is passed to `func`, it is not timed.
+
+    Returns:
+        List of the run times in seconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(argument)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def stage_benchmarks(key_type, store_backend, repeat):
+    """
+    Times the generation stages in a temporary directory.
+
+    Returns:
+        Dictionary mapping the stage names to their samples.
+    """
+    samples = {}
+    with tempfile.TemporaryDirectory() as temp:
+        counter = iter(range(sys.maxsize))
+
+        def new_dir():
+            path = Path(temp) / str(next(counter))
+            path.mkdir()
+            return path
+
+        def generators(directory):
+            return (CertificateGenerator(str(directory) + '/',
+                                         key_type=key_type),
+                    KeystoreGenerator(str(directory) + '/', store_backend,
+                                      key_type))
+
+        root_dir = new_dir()
+        cert_gen, store_gen = generators(root_dir)
+        root_cert, root_key = cert_gen.get_cert(cert_name='root')
+        issuer = (root_cert, root_key)
+
+        samples['get_cert.root'] = measure(
+            lambda directory: generators(directory)[0].get_cert(
+                cert_name='root'), repeat, new_dir)
+
+        samples['get_cert.issued'] = measure(
+            lambda directory: generators(directory)[0].get_cert(
+                cert_name='server',
+                sa_names=['localhost', 'exhibitor', '127.0.0.1', '10.0.0.1'],
+                issuer=issuer), repeat, new_dir)
+
+        samples['create_truststore'] = measure(
+            lambda directory: generators(directory)[1].create_truststore(
+                [root_cert]), repeat, new_dir)
+
+        client_cert, client_key = cert_gen.get_cert(
+            cert_name='client',
+            sa_names=['localhost', 'exhibitor', '127.0.0.1', '10.0.0.1'],
+            issuer=issuer)
+        samples['create_entitystore'] = measure(
+            lambda directory: generators(directory)[1].create_entitystore(
+                client_cert, client_key, store_name='clientstore'), repeat,
+            new_dir)
+
+    return samples
+
+
+def app_benchmarks(node_counts, key_type, store_backend, jobs, repeat):
+    """
+    Times complete runs of `exhibitor-tls-artifacts` for every number of
+    nodes in `node_counts`.
+
+    Returns:
+        Dictionary mapping the stage names to their samples.
+    """
+    runner = click.testing.CliRunner()
+    samples = {}
+    with tempfile.TemporaryDirectory() as temp:
+        counter = iter(range(sys.maxsize))
+
+        for count in node_counts:
+            nodes = ['10.0.{}.{}'.format(i // 250, i % 250 + 1)
+                     for i in range(count)]
+            args = ['--key-type', key_type, '--store-backend', store_backend]
+            if jobs is not None:
+                args += ['--jobs', str(jobs)]
+
+            def run(_):
+                output_dir = Path(temp) / str(next(counter))
+                result = runner.invoke(app,
+                                       args=args + ['-d', str(output_dir)] +
+                                       nodes)
+                if result.exit_code != 0:
+                    raise click.ClickException(
+                        'Generating artifacts for {} nodes failed: {}'.format(
+                            count, result.output))
+
+            samples['app.nodes-{}'.format(count)] = measure(run, repeat)
+
+    return samples
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the medians of `results` against `baseline`.
+
+    Returns:
+        List of (stage, baseline median, median, ratio, regressed) tuples
+        for the stages found in both.
+    """
+    comparison = []
+    for stage, summary in sorted(results['stages'].items()):
+        if stage not in baseline['stages']:
+            continue
+        before = baseline['stages'][stage]['median']
+        after = summary['median']
+        ratio = after / before if before else float('inf')
+        comparison.append(
+            (stage, before, after, ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def parse_node_counts(ctx, param, value):
+    assert ctx or param  # For linting
+    try:
+        counts = [int(count) for count in value.split(',') if count.strip()]
+    except ValueError:
+        counts = []
+    if not counts or min(counts) < 1:
+        raise click.BadParameter(
+            message="'{}' is not a comma separated list of node "
+            "counts.".format(value))
+    return counts
+
+
+@click.command()
+@click.option('--repeat',
+              help='Number of runs of every stage. Default: 10.',
+              type=click.IntRange(min=1),
+              default=10)
+@click.option('--app-repeat',
+              help='Number of complete runs per node count. Default: 3.',
+              type=click.IntRange(min=1),
+              default=3)
+@click.option('--nodes',
+              help='Comma separated node counts of the complete runs. '
+              'Default: {}.'.format(DEFAULT_NODE_COUNTS),
+              default=DEFAULT_NODE_COUNTS,
+              callback=parse_node_counts)
+@click.option('--key-type',
+              help='Type of the keys. Default: rsa.',
+              type=click.Choice(KEY_TYPES),
+              default='rsa')
+@click.option('--store-backend',
+              help='How to create the jks keystores. Default: native.',
+              type=click.Choice(BACKENDS),
+              default='native')
+@click.option('-j',
+              '--jobs',
+              help='Number of parallel jobs of the complete runs. Defaults '
+              'to the default of the command.',
+              type=click.IntRange(min=1))
+@click.option('--skip-stages',
+              help='Only time complete runs.',
+              is_flag=True)
+@click.option('--skip-app', help='Only time the stages.', is_flag=True)
+@click.option('-o',
+              '--output',
+              help='File to write the results to. Default: '
+              'benchmark-results.json.',
+              default='benchmark-results.json',
+              type=click.Path(dir_okay=False))
+@click.option('--baseline',
+              help='Results of an earlier run to compare against.',
+              type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold',
+              help='Relative slowdown of a median that counts as '
+              'regression. Default: 0.1.',
+              type=click.FloatRange(min=0),
+              default=0.1)
+def main(repeat, app_repeat, nodes, key_type, store_backend, jobs,
+         skip_stages, skip_app, output, baseline, threshold):
+    """
+    Benchmarks the artifact generation. Exits with status 1 if a stage
+    regressed compared to --baseline.
+    """
+    samples = {}
+    if not skip_stages:
+        samples.update(stage_benchmarks(key_type, store_backend, repeat))
+    if not skip_app:
+        samples.update(
+            app_benchmarks(nodes, key_type, store_backend, jobs, app_repeat))
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.datetime.utcnow().strftime(
+            '%Y-%m-%dT%H:%M:%SZ'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'key_type': key_type,
+            'store_backend': store_backend,
+            'jobs': jobs,
+        },
+        'stages': {
+            stage: dict(summarize(stage_samples), samples=stage_samples)
+            for stage, stage_samples in samples.items()
+        },
+    }
+
+    click.echo('{:<24} {:>5} {:>10} {:>10} {:>10}'.format(
+        'stage', 'runs', 'median', 'p90', 'p99'))
+    for stage, summary in results['stages'].items():
+        click.echo('{:<24} {:>5} {:>9.4f}s {:>9.4f}s {:>9.4f}s'.format(
+            stage, summary['runs'], summary['median'], summary['p90'],
+            summary['p99']))
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    click.echo('Results written to {}.'.format(output))
+
+    if baseline is None:
+        return
+
+    with open(baseline) as f:
+        comparison = compare(results, json.load(f), threshold)
+
+    click.echo()
+    click.echo('{:<24} {:>10} {:>10} {:>8}'.format('stage', 'baseline',
+                                                   'median', 'change'))
+    for stage, before, after, ratio, regressed in comparison:
+        click.echo('{:<24} {:>9.4f}s {:>9.4f}s {:>+7.1%}{}'.format(
+            stage, before, after, ratio - 1,
+            '  REGRESSION' if regressed else ''))
+
+    regressions = [stage for stage, *_, regressed in comparison if regressed]
+    if regressions:
+        raise click.ClickException('{} stages regressed by more than '
+                                   '{:.0%}: {}'.format(len(regressions),
+                                                       threshold,
+                                                       ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,44 @@
 """
 Script that generates `TLS` artifacts needed for DC/OS Exhibitor.
+
+The artifacts can also be generated in memory, see `generate_ensemble` and
+`iter_ensemble`.
 """
+import importlib
+import sys
+import types
+
+# The library API is imported on first use, so that the command line
+# interface, which imports this package first, starts quickly.
+_EXPORTS = {
+    'DuplicateNodeError': 'ensemble',
+    'Ensemble': 'ensemble',
+    'NodeBundle': 'ensemble',
+    'create_root': 'ensemble',
+    'create_intermediate': 'ensemble',
+    'load_ca': 'ensemble',
+    'generate_ensemble': 'ensemble',
+    'iter_ensemble': 'ensemble',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+class _LazyModule(types.ModuleType):
+    # Module level `__getattr__` needs Python 3.7, replacing the class of
+    # the module works with Python 3.6.
+
+    def __getattr__(self, name):
+        if name not in _EXPORTS:
+            raise AttributeError("module '{}' has no attribute '{}'".format(
+                __name__, name))
+        module = importlib.import_module('.' + _EXPORTS[name], __name__)
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(__all__))
+
+
+sys.modules[__name__].__class__ = _LazyModule
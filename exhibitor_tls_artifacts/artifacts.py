@@ -0,0 +1,274 @@
+"""
+In-memory representation of the generated artifacts.
+
+Certificates, keys and keystores are built in memory and only written once
+all of them exist, each file exactly once and with its final mode, either
+to a directory tree or streamed into `tar` archives.
+
+Artifacts with the same content and mode, the root certificate and the
+truststore of every node, can be written once and linked to the other paths.
+"""
+import contextlib
+import fcntl
+import io
+import os
+import tarfile
+import time
+
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+from .gen_certificates import cert_pem, key_pem
+from .staging import fsync_path, staged_file
+from .timings import span
+
+CERT_MODE = 0o644
+KEY_MODE = 0o600
+STORE_MODE = 0o600
+DIR_MODE = 0o755
+
+ROOT_CERT_FILE = 'root-cert.pem'
+ROOT_KEY_FILE = 'root-key.pem'
+# Written with `--intermediate`, the certificate is followed by the root.
+INTERMEDIATE_CERT_FILE = 'intermediate-cert.pem'
+INTERMEDIATE_KEY_FILE = 'intermediate-key.pem'
+TRUSTSTORE_FILE = 'truststore.jks'
+
+# `tarfile` stream modes and file extensions of the archive formats.
+ARCHIVE_FORMATS = {'tar': ('w|', '.tar'), 'tgz': ('w|gz', '.tgz')}
+ARCHIVE_MODE = 0o600
+
+# How artifacts with the same content and mode are written: as separate
+# files, as hard links or as copy-on-write clones of the first file.
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+
+# `ioctl` cloning a file on Linux file systems supporting reflinks.
+FICLONE = 0x40049409
+
+Artifact = namedtuple('Artifact', ['path', 'data', 'mode'])
+Artifact.__doc__ = """
+A file to be written. `path` is relative to the output directory.
+"""
+
+
+def cert_artifact(path, cert, intermediates=()):
+    """
+    `pem` file of a certificate, followed by the intermediate certificates
+    linking it to the root.
+    """
+    with span('pem', os.path.basename(str(path))):
+        return Artifact(
+            str(path),
+            b''.join(cert_pem(c) for c in [cert] + list(intermediates)),
+            CERT_MODE)
+
+
+def key_artifact(path, key):
+    with span('pem', os.path.basename(str(path))):
+        return Artifact(str(path), key_pem(key), KEY_MODE)
+
+
+def store_artifact(path, data):
+    return Artifact(str(path), data, STORE_MODE)
+
+
+class DirectoryWriter:
+    """
+    Writes artifacts below `output_directory` one at a time. Files get
+    exactly the mode of their artifact, independent of the umask.
+
+    Unless `overwrite` is set, files must not exist yet. Overwritten files
+    are synced to disk and replaced atomically, readers see either the old
+    or the new file, also after a crash.
+
+    With `link_shared` set to `hardlink` or `reflink` artifacts with the
+    same content and mode as an artifact written before at the top of the
+    output directory are linked to its file, see `LINK_MODES`. Only those
+    are remembered, so any number of node artifacts can be written.
+    """
+
+    def __init__(self, output_directory, overwrite=False, link_shared='copy'):
+        self.output_directory = Path(output_directory)
+        self.overwrite = overwrite
+        self.link_shared = link_shared
+        self.link_sources = {}
+
+    def add(self, artifact):
+        path = self.output_directory / artifact.path
+        path.parent.mkdir(mode=DIR_MODE, parents=True, exist_ok=True)
+        target = path.with_name('.' + path.name + '.tmp') \
+            if self.overwrite else path
+
+        source = self.link_sources.get((artifact.data, artifact.mode))
+        if source is None:
+            _write_file(target, artifact)
+        else:
+            _link_file(source, target, artifact, self.link_shared)
+
+        if self.overwrite:
+            fsync_path(target)
+            os.replace(str(target), str(path))
+            fsync_path(path.parent)
+        if self.link_shared != 'copy' and '/' not in artifact.path:
+            self.link_sources.setdefault((artifact.data, artifact.mode),
+                                         path)
+
+
+def write_artifacts(output_directory, artifacts, overwrite=False,
+                    link_shared='copy'):
+    """
+    Writes artifacts below `output_directory`, see `DirectoryWriter`.
+    """
+    writer = DirectoryWriter(output_directory, overwrite, link_shared)
+    for artifact in artifacts:
+        writer.add(artifact)
+
+
+def _write_file(path, artifact):
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                 artifact.mode)
+    with os.fdopen(fd, 'wb') as f:
+        os.fchmod(f.fileno(), artifact.mode)
+        f.write(artifact.data)
+
+
+def _link_file(source, path, artifact, link_shared):
+    if link_shared == 'hardlink':
+        os.link(str(source), str(path))
+        return
+
+    # Clones share the data blocks of `source` until either file changes.
+    # File systems without reflinks get a copy.
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                 artifact.mode)
+    with os.fdopen(fd, 'wb') as f, open(str(source), 'rb') as source_file:
+        os.fchmod(f.fileno(), artifact.mode)
+        try:
+            fcntl.ioctl(f.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            f.write(artifact.data)
+
+
+class ArchiveWriter:
+    """
+    Streams artifacts into a `tar` archive written to `fileobj`, which does
+    not need to be seekable. Members get exactly the mode of their artifact,
+    directories are added with `DIR_MODE` before their first file.
+
+    With `link_shared` set to `hardlink` artifacts with the same content and
+    mode as an earlier member at the top of the archive are added as hard
+    links to it. Archives have no reflinks, `reflink` adds copies.
+    """
+
+    def __init__(self, fileobj, archive_format='tar', link_shared='copy'):
+        self.archive = tarfile.open(fileobj=fileobj,
+                                    mode=ARCHIVE_FORMATS[archive_format][0])
+        self.link_shared = link_shared
+        self.mtime = int(time.time())
+        self.directories = set()
+        self.link_sources = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.archive.close()
+
+    def _member(self, path, mode):
+        parts = path.split('/')[:-1]
+        for depth in range(1, len(parts) + 1):
+            directory = '/'.join(parts[:depth])
+            if directory not in self.directories:
+                self.directories.add(directory)
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = DIR_MODE
+                info.mtime = self.mtime
+                self.archive.addfile(info)
+
+        info = tarfile.TarInfo(path)
+        info.mode = mode
+        info.mtime = self.mtime
+        return info
+
+    def add(self, artifact):
+        info = self._member(artifact.path, artifact.mode)
+
+        source = self.link_sources.get((artifact.data, artifact.mode))
+        if source is not None:
+            info.type = tarfile.LNKTYPE
+            info.linkname = source
+            self.archive.addfile(info)
+            return
+
+        info.size = len(artifact.data)
+        self.archive.addfile(info, io.BytesIO(artifact.data))
+        if self.link_shared == 'hardlink' and '/' not in artifact.path:
+            self.link_sources[(artifact.data, artifact.mode)] = artifact.path
+
+    def add_file(self, path, fileobj, size, mode):
+        """ Adds `size` bytes read from `fileobj` as member `path`. """
+        info = self._member(path, mode)
+        info.size = size
+        self.archive.addfile(info, fileobj)
+
+
+def write_archive(fileobj, artifacts, archive_format='tar',
+                  link_shared='copy'):
+    """
+    Streams artifacts into a `tar` archive, see `ArchiveWriter`.
+    """
+    with ArchiveWriter(fileobj, archive_format, link_shared) as writer:
+        for artifact in artifacts:
+            writer.add(artifact)
+
+
+def write_archive_file(path, artifacts, archive_format='tar',
+                       link_shared='copy'):
+    """
+    Writes artifacts into a new archive file, only readable by its owner as
+    it contains private keys. The file must not exist yet. It is written to
+    a staging file which is only moved into place once it is complete and
+    synced to disk, see `staging.staged_file`.
+    """
+    with open_archive_file(path) as f:
+        write_archive(f, artifacts, archive_format, link_shared)
+
+
+@contextlib.contextmanager
+def open_archive_file(path):
+    """
+    Opens a new archive file for writing, see `write_archive_file`.
+    """
+    with staged_file(path, ARCHIVE_MODE) as f:
+        yield f
+
+
+def group_by_node(artifacts):
+    """
+    Splits artifacts into those at the top of the output directory and
+    those of every node directory.
+
+    Returns:
+        (shared artifacts, `OrderedDict` mapping nodes to their artifacts)
+    """
+    shared = []
+    nodes = OrderedDict()
+    for artifact in artifacts:
+        if '/' in artifact.path:
+            node = artifact.path.split('/', 1)[0]
+            nodes.setdefault(node, []).append(artifact)
+        else:
+            shared.append(artifact)
+    return shared, nodes
+
+
+def node_directories(output_directory):
+    """
+    Names of the node directories of an artifact directory.
+    """
+    return sorted(path.name for path in Path(output_directory).iterdir()
+                  if (path / 'client-cert.pem').is_file())
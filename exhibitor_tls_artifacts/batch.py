@@ -0,0 +1,365 @@
+"""
+Generation of the artifacts of many clusters from one spec file.
+
+The spec is a YAML file listing the clusters:
+
+    defaults:
+      key_type: ecdsa
+      subject:
+        organization: Example Inc.
+    clusters:
+      - name: prod-us
+        output: prod-us/
+        sans: [exhibitor.prod-us.example.com]
+        subject:
+          country: US
+          state: CA
+          locality: San Francisco
+        keep_root_key: true
+        masters:
+          - 10.0.0.1
+          - address: 10.0.0.2
+            sans: [master2.prod-us.example.com]
+
+`output` defaults to the name of the cluster and relative paths are relative
+to the directory of the spec file. `sans` of a cluster are added to the
+certificates of all its masters. Settings in `defaults` apply to every
+cluster which does not set them, subject fields are merged.
+
+The roots and nodes of all clusters are generated by one pool of worker
+processes. A cluster is written through a staging directory once all of its
+nodes are done, so a failing cluster leaves no output behind and does not
+stop the other clusters.
+"""
+import concurrent.futures
+import os
+import time
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .artifacts import ROOT_KEY_FILE, key_artifact, write_artifacts
+from .ensemble import create_root, generate_node_artifacts, root_artifacts
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, cert_pem, key_pem,
+                               key_spec, load_certified_key)
+from .manifest import build_manifest, manifest_artifact
+from .revocation import record_issued
+from .staging import staged_directory
+
+SUBJECT_FIELDS = ('country', 'state', 'locality', 'organization')
+SETTINGS = ('sans', 'subject', 'key_type', 'key_size', 'validity_days',
+            'keep_root_key')
+CLUSTER_KEYS = ('name', 'output', 'masters') + SETTINGS
+REPORT_FORMATS = ('table', 'json')
+
+Cluster = namedtuple('Cluster', [
+    'name', 'output_directory', 'masters', 'subject', 'key_type', 'key_size',
+    'validity_days', 'keep_root_key'
+])
+Cluster.__doc__ = """
+A cluster of a spec. `masters` is a list of (node, extra SANs) pairs and
+`subject` a dictionary of `CertificateGenerator` subject fields.
+"""
+
+ClusterReport = namedtuple(
+    'ClusterReport', ['name', 'output_directory', 'nodes', 'seconds', 'error'])
+ClusterReport.__doc__ = """
+Outcome of a cluster: `seconds` from the start of the batch until the cluster
+was written or failed and `error` the message of the failure, `None` if the
+cluster succeeded.
+"""
+
+
+class SpecError(ValueError):
+    """ The spec file is invalid. """
+
+
+def load_spec(path):
+    """
+    Loads and validates a spec file, see `parse_spec`.
+    """
+    import yaml
+
+    with open(str(path)) as f:
+        try:
+            spec = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise SpecError('{} is not valid YAML: {}'.format(path, e))
+    return parse_spec(spec, Path(path).parent)
+
+
+def _string_list(value, where):
+    if not isinstance(value, list) or not all(
+            isinstance(item, str) for item in value):
+        raise SpecError('{} must be a list of strings.'.format(where))
+    return tuple(value)
+
+
+def _subject(value, where):
+    if not isinstance(value, dict):
+        raise SpecError('{} must be a mapping.'.format(where))
+    unknown = sorted(set(value) - set(SUBJECT_FIELDS))
+    if unknown:
+        raise SpecError('{} has unknown fields: {}. Known fields are {}.'
+                        .format(where, ', '.join(unknown),
+                                ', '.join(SUBJECT_FIELDS)))
+    for field, field_value in value.items():
+        if not isinstance(field_value, str) or not field_value:
+            raise SpecError('{}.{} must be a non-empty string.'.format(
+                where, field))
+    if len(value.get('country', 'US')) != 2:
+        raise SpecError('{}.country must be a two letter country code.'
+                        .format(where))
+    return value
+
+
+def _masters(value, sans, where):
+    if not isinstance(value, list) or not value:
+        raise SpecError('{} must be a non-empty list.'.format(where))
+
+    masters = []
+    for index, master in enumerate(value):
+        master_where = '{}[{}]'.format(where, index)
+        if isinstance(master, str):
+            masters.append((master, sans))
+            continue
+        if not isinstance(master, dict) or not isinstance(
+                master.get('address'), str):
+            raise SpecError(
+                '{} must be an address or a mapping with an address and '
+                'optional sans.'.format(master_where))
+        unknown = sorted(set(master) - {'address', 'sans'})
+        if unknown:
+            raise SpecError('{} has unknown keys: {}'.format(
+                master_where, ', '.join(unknown)))
+        masters.append(
+            (master['address'], sans + _string_list(
+                master.get('sans', []), master_where + '.sans')))
+
+    nodes = [node for node, _ in masters]
+    duplicates = sorted({node for node in nodes if nodes.count(node) > 1})
+    if duplicates:
+        raise SpecError('{} lists masters more than once: {}'.format(
+            where, ', '.join(duplicates)))
+    return masters
+
+
+def _cluster(entry, defaults, base_directory, where):
+    if not isinstance(entry, dict):
+        raise SpecError('{} must be a mapping.'.format(where))
+    unknown = sorted(set(entry) - set(CLUSTER_KEYS))
+    if unknown:
+        raise SpecError('{} has unknown keys: {}'.format(
+            where, ', '.join(unknown)))
+    name = entry.get('name')
+    if not isinstance(name, str) or not name:
+        raise SpecError('{} needs a name.'.format(where))
+    where = "cluster '{}'".format(name)
+
+    settings = dict(defaults, **entry)
+    subject = _subject(dict(defaults.get('subject', {}),
+                            **entry.get('subject', {})), where + '.subject')
+    sans = _string_list(settings.get('sans', []), where + '.sans')
+    try:
+        key_type, key_size = key_spec(settings.get('key_type', 'rsa'),
+                                      settings.get('key_size'))
+    except ValueError as e:
+        raise SpecError('{}: {}'.format(where, e))
+    validity_days = settings.get('validity_days', DEFAULT_VALIDITY_DAYS)
+    if not isinstance(validity_days, int) or validity_days < 1:
+        raise SpecError('{}.validity_days must be a positive integer.'.format(
+            where))
+    keep_root_key = settings.get('keep_root_key', False)
+    if not isinstance(keep_root_key, bool):
+        raise SpecError('{}.keep_root_key must be true or false.'.format(
+            where))
+    output = entry.get('output', name)
+    if not isinstance(output, str) or not output:
+        raise SpecError('{}.output must be a path.'.format(where))
+
+    return Cluster(name, Path(base_directory) / output,
+                   _masters(entry.get('masters'), sans, where + '.masters'),
+                   subject, key_type, key_size, validity_days, keep_root_key)
+
+
+def parse_spec(spec, base_directory='.'):
+    """
+    Validates a loaded spec. Output directories must not exist yet.
+
+    Returns:
+        List of `Cluster`, in the order of the spec.
+
+    Raises:
+        SpecError: The spec is invalid.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('clusters'),
+                                                    list):
+        raise SpecError('The spec must have a list of clusters.')
+    unknown = sorted(set(spec) - {'defaults', 'clusters'})
+    if unknown:
+        raise SpecError('The spec has unknown keys: {}'.format(
+            ', '.join(unknown)))
+    defaults = spec.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        raise SpecError('defaults must be a mapping.')
+    unknown = sorted(set(defaults) - set(SETTINGS))
+    if unknown:
+        raise SpecError('defaults has unknown keys: {}'.format(
+            ', '.join(unknown)))
+    if not spec['clusters']:
+        raise SpecError('The spec does not list any clusters.')
+
+    clusters = [
+        _cluster(entry, defaults, base_directory, 'clusters[{}]'.format(i))
+        for i, entry in enumerate(spec['clusters'])
+    ]
+    for field, what in (('name', 'names'), ('output_directory', 'outputs')):
+        values = [str(getattr(cluster, field)) for cluster in clusters]
+        duplicates = sorted({v for v in values if values.count(v) > 1})
+        if duplicates:
+            raise SpecError('Clusters have the same {}: {}'.format(
+                what, ', '.join(duplicates)))
+    for cluster in clusters:
+        if os.path.lexists(str(cluster.output_directory)):
+            raise SpecError("Output '{}' of cluster '{}' already exists."
+                            .format(cluster.output_directory, cluster.name))
+    return clusters
+
+
+def issue_root(key_type, key_size, validity_days, subject, store_backend):
+    """
+    Creates the root of a cluster in a worker process.
+
+    Returns:
+        (certificate `pem`, key `pem`, truststore) tuple.
+    """
+    root, truststore = create_root(key_type, key_size, validity_days,
+                                   store_backend, subject=subject)
+    return cert_pem(root.cert), key_pem(root.key), truststore
+
+
+def write_cluster(cluster, root_pems, results):
+    """
+    Writes the artifacts of a cluster through a staging directory.
+
+    Args:
+        root_pems: Result of `issue_root`.
+        results: Dictionary mapping the masters to their `NodeResult`.
+    """
+    cert_data, key_data, truststore = root_pems
+    root = load_certified_key('root', cert_data, key_data)
+    artifacts = root_artifacts(root, truststore)
+    if cluster.keep_root_key:
+        artifacts.append(key_artifact(ROOT_KEY_FILE, root.key))
+    for node, _ in cluster.masters:
+        artifacts.extend(results[node].artifacts)
+    artifacts.append(manifest_artifact(build_manifest(artifacts)))
+
+    os.makedirs(str(cluster.output_directory.parent), exist_ok=True)
+    with staged_directory(cluster.output_directory) as staging:
+        write_artifacts(staging, artifacts)
+        record_issued(staging, artifacts)
+
+
+class InlineExecutor(concurrent.futures.Executor):
+    """
+    Executor running every call when it is submitted, used for one job.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def generate_batch(clusters, jobs=1, store_backend='native'):
+    """
+    Generates and writes the artifacts of `clusters` using up to `jobs`
+    worker processes shared by all clusters. The nodes of a cluster are
+    started as soon as its root is ready. If a root, node or write fails,
+    the remaining nodes of its cluster are cancelled.
+
+    Returns:
+        Iterator of `ClusterReport`, in the order clusters finish.
+    """
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 \
+        else InlineExecutor()
+    roots = {}
+    results = {cluster.name: {} for cluster in clusters}
+    failed = set()
+
+    def report(cluster, error=None):
+        return ClusterReport(cluster.name, cluster.output_directory,
+                             len(cluster.masters),
+                             time.perf_counter() - start, error)
+
+    with executor:
+        pending = {
+            executor.submit(issue_root, cluster.key_type, cluster.key_size,
+                            cluster.validity_days, cluster.subject,
+                            store_backend): (cluster, None)
+            for cluster in clusters
+        }
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                cluster, node = pending.pop(future)
+                if cluster.name in failed:
+                    continue
+
+                try:
+                    value = future.result()
+                    if node is None:
+                        roots[cluster.name] = value
+                        for master, extra_sans in cluster.masters:
+                            pending[executor.submit(
+                                generate_node_artifacts, master, value[0],
+                                value[1], value[2], store_backend, None,
+                                cluster.key_type, cluster.key_size,
+                                cluster.validity_days, extra_sans,
+                                subject=cluster.subject)] = (cluster, master)
+                        continue
+
+                    results[cluster.name][node] = value
+                    if len(results[cluster.name]) < len(cluster.masters):
+                        continue
+                    write_cluster(cluster, roots.pop(cluster.name),
+                                  results.pop(cluster.name))
+                except Exception as e:
+                    failed.add(cluster.name)
+                    for other, (other_cluster, _) in pending.items():
+                        if other_cluster is cluster:
+                            other.cancel()
+                    results.pop(cluster.name, None)
+                    roots.pop(cluster.name, None)
+                    yield report(cluster, str(e) or type(e).__name__)
+                    continue
+                yield report(cluster)
+
+
+def format_reports(reports, output_format='table'):
+    """ Formats `ClusterReport` as `table` or `json`, see `REPORT_FORMATS`. """
+    if output_format == 'json':
+        import json
+
+        return json.dumps([
+            dict(report._asdict(),
+                 output_directory=str(report.output_directory))
+            for report in reports
+        ], indent=2)
+
+    lines = ['{:<20} {:>6} {:>9}  {:<7} {}'.format('cluster', 'nodes',
+                                                   'seconds', 'status',
+                                                   'output')]
+    for report in reports:
+        lines.append('{:<20} {:>6} {:>8.3f}s  {:<7} {}'.format(
+            report.name, report.nodes, report.seconds,
+            'failed' if report.error else 'ok',
+            report.error or report.output_directory))
+    return '\n'.join(lines)
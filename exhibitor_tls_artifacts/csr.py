@@ -0,0 +1,321 @@
+"""
+Certificate signing requests, so that the masters generate their own keys.
+
+Generating the keys takes most of the time to generate the artifacts of an
+ensemble. With signing requests every master generates its own keys in
+parallel and the root only signs:
+
+1. `create_requests` runs on every master and creates the keys and the
+   requests of its client and server certificates in `<node>/`.
+2. The node directories with the requests of all masters are collected in
+   one directory. `load_requests` validates all of them and `sign_requests`
+   then issues the certificates with the root in one pass.
+3. `build_stores` runs on every master and builds the keystores from its
+   keys and the signed certificates, which completes the node directory.
+
+The private keys never leave the masters.
+"""
+import ipaddress
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509.oid import NameOID
+
+from .artifacts import (CERT_MODE, INTERMEDIATE_CERT_FILE, ROOT_CERT_FILE,
+                        Artifact, cert_artifact, key_artifact, store_artifact,
+                        write_artifacts)
+from .ensemble import SANS, load_root, root_artifacts
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, CertificateGenerator,
+                               chain_pem, generate_private_key, key_pem,
+                               key_spec, key_spec_of, load_certified_key,
+                               presented_chain, public_key_der,
+                               signature_hash, store_chain,
+                               subject_alternative_names, subject_fields,
+                               verify_chain)
+from .gen_stores import KeystoreGenerator
+from .staging import fsync_path
+from .timings import span
+
+# Certificates requested by every node, the server key and certificate are
+# only part of `serverstore.jks` once the stores are built.
+CERT_NAMES = ('client', 'server')
+
+NodeRequests = namedtuple('NodeRequests', ['node', 'requests'])
+NodeRequests.__doc__ = """
+Validated signing requests of a node. `requests` maps the names of
+`CERT_NAMES` to the requests in `pem` format.
+"""
+
+
+class RequestError(Exception):
+    """ Raised when the stores of a node cannot be built. """
+
+
+def request_file(name):
+    return name + '.csr'
+
+
+def build_request(name, key, sa_names):
+    """
+    Creates a certificate signing request for `key`, signed by it.
+
+    Args:
+        name: Name of the certificate, used as its common name.
+        key: Private key to certify.
+        sa_names: Subject alternative names to request.
+    """
+    converted_names = []
+    for san in sa_names:
+        try:
+            converted_names.append(x509.IPAddress(ipaddress.ip_address(san)))
+        except ValueError:
+            converted_names.append(x509.DNSName(san))
+
+    builder = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)
+                   ])).add_extension(
+                       x509.SubjectAlternativeName(converted_names),
+                       critical=True)
+    with span('sign', name + '.csr'):
+        return builder.sign(key, signature_hash(key), default_backend())
+
+
+def create_requests(node, key_type='rsa', key_size=None, extra_sans=()):
+    """
+    Generates the keys of a node and the signing requests of its
+    certificates. `extra_sans` are requested in addition to the default
+    subject alternative names and the node.
+
+    Returns:
+        List of `Artifact` below the node directory.
+    """
+    key_type, key_size = key_spec(key_type, key_size)
+    sa_names = SANS + [node] + list(extra_sans)
+    artifacts = []
+    for name in CERT_NAMES:
+        with span('keygen', name):
+            key = generate_private_key(key_size, key_type)
+        request = build_request(name, key, sa_names)
+        artifacts.append(
+            key_artifact(os.path.join(node, name + '-key.pem'), key))
+        artifacts.append(
+            Artifact(os.path.join(node, request_file(name)),
+                     request.public_bytes(serialization.Encoding.PEM),
+                     CERT_MODE))
+    return artifacts
+
+
+def request_directories(directory):
+    """
+    Names of the node directories with a client signing request.
+    """
+    return sorted(path.name for path in Path(directory).iterdir()
+                  if (path / request_file(CERT_NAMES[0])).is_file())
+
+
+def check_request(node, name, request):
+    """
+    Checks a parsed signing request of a node: its signature, its key and
+    that it requests exactly the default subject alternative names, the
+    node and optional extra DNS names.
+
+    Returns:
+        List of problems found.
+    """
+    prefix = '{}: {} request'.format(node, name)
+    if not request.is_signature_valid:
+        return ['{} has an invalid signature'.format(prefix)]
+
+    problems = []
+    try:
+        key_spec(*key_spec_of(request.public_key()))
+    except ValueError as e:
+        problems.append('{} has an unsupported key: {}'.format(prefix, e))
+
+    sans = subject_alternative_names(request)
+    if not sans:
+        return problems + [
+            '{} has no subject alternative names'.format(prefix)
+        ]
+
+    requested = set()
+    for san in sans:
+        try:
+            address = ipaddress.ip_address(san)
+        except ValueError:
+            requested.add(san)
+            continue
+        requested.add(str(address))
+        if str(address) not in SANS + [node]:
+            problems.append('{} requests the IP address {} which is not the '
+                            'node'.format(prefix, san))
+
+    missing = [san for san in SANS + [node] if san not in requested]
+    if missing:
+        problems.append('{} is missing the SANs {}'.format(
+            prefix, ', '.join(missing)))
+    return problems
+
+
+def load_requests(directory):
+    """
+    Loads and validates the signing requests of all nodes in `directory`.
+    All requests are checked, nothing is signed.
+
+    Returns:
+        (list of `NodeRequests`, problems) tuple.
+    """
+    directory = Path(directory)
+    node_requests = []
+    problems = []
+    for node in request_directories(directory):
+        requests = {}
+        for name in CERT_NAMES:
+            path = directory / node / request_file(name)
+            if not path.is_file():
+                problems.append('{}/{} is missing'.format(
+                    node, request_file(name)))
+                continue
+            data = path.read_bytes()
+            try:
+                request = x509.load_pem_x509_csr(data, default_backend())
+            except ValueError:
+                problems.append('{}/{} is not a signing request'.format(
+                    node, request_file(name)))
+                continue
+            problems.extend(check_request(node, name, request))
+            requests[name] = data
+        node_requests.append(NodeRequests(node, requests))
+    return node_requests, problems
+
+
+def sign_node(node, requests, root_cert_data, root_key_data, validity_days):
+    """
+    Issues the certificates of a node from its validated signing requests.
+    This is a module level function so that it can be run in a worker
+    process.
+
+    Returns:
+        List of `Artifact` below the node directory.
+    """
+    issuer = load_root(root_cert_data, root_key_data)
+    cert_generator = CertificateGenerator(validity_days=validity_days,
+                                          **subject_fields(issuer.cert))
+    artifacts = []
+    for name in CERT_NAMES:
+        request = x509.load_pem_x509_csr(requests[name], default_backend())
+        cert = cert_generator.certify(name, request.public_key(),
+                                      subject_alternative_names(request),
+                                      issuer=issuer)
+        chain = (issuer.cert, ) + tuple(issuer.chain)
+        artifacts.append(
+            cert_artifact(os.path.join(node, name + '-cert.pem'), cert,
+                          chain[:-1]))
+    return artifacts
+
+
+def sign_requests(node_requests, root, truststore,
+                  validity_days=DEFAULT_VALIDITY_DAYS, jobs=1):
+    """
+    Issues the certificates of all `node_requests` with `root`, the
+    `CertifiedKey` of the root or of an intermediate CA, using up to `jobs`
+    worker processes. The root certificate and truststore are added
+    to the top and to every node directory, the certificate of an
+    intermediate CA to the top.
+
+    Returns:
+        List of `Artifact`.
+    """
+    root_cert_data = chain_pem(root)
+    root_key_data = key_pem(root.key)
+    args = [[node_request.node for node_request in node_requests],
+            [node_request.requests for node_request in node_requests]]
+    args += [[value] * len(node_requests)
+             for value in (root_cert_data, root_key_data, validity_days)]
+
+    if jobs == 1 or len(node_requests) <= 1:
+        results = list(map(sign_node, *args))
+    else:
+        workers = min(jobs, len(node_requests))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(sign_node, *args))
+
+    artifacts = root_artifacts(root, truststore)
+    if root.chain:
+        artifacts.append(
+            cert_artifact(INTERMEDIATE_CERT_FILE, root.cert, root.chain))
+    for node_request, certs in zip(node_requests, results):
+        artifacts.extend(certs)
+        artifacts.extend(root_artifacts(root, truststore, node_request.node))
+    return artifacts
+
+
+def _load_certified_key(node_path, name, root_cert):
+    cert_path = node_path / (name + '-cert.pem')
+    key_path = node_path / (name + '-key.pem')
+    for path in (cert_path, key_path):
+        if not path.is_file():
+            raise RequestError('{} is missing'.format(path))
+    certified_key = load_certified_key(name, cert_path.read_bytes(),
+                                       key_path.read_bytes())
+    return certified_key._replace(chain=certified_key.chain + (root_cert, ))
+
+
+def build_stores(node_directory, store_backend='native'):
+    """
+    Builds `clientstore.jks` and `serverstore.jks` of a node directory from
+    the keys created by `create_requests` and the certificates issued by
+    `sign_requests`. Afterwards the server key and certificate and the
+    signing requests are removed, which leaves a regular node directory.
+
+    Raises:
+        RequestError: A certificate or key is missing, or a certificate does
+        not belong to its key or does not chain to the root.
+    """
+    node_path = Path(node_directory)
+    root_cert_path = node_path / ROOT_CERT_FILE
+    if not root_cert_path.is_file():
+        raise RequestError('{} is missing'.format(root_cert_path))
+    root_cert = x509.load_pem_x509_certificate(root_cert_path.read_bytes(),
+                                               default_backend())
+
+    certified_keys = []
+    for name in CERT_NAMES:
+        certified_key = _load_certified_key(node_path, name, root_cert)
+        if public_key_der(certified_key.key) != public_key_der(
+                certified_key.cert.public_key()):
+            raise RequestError('{}-cert.pem does not match {}-key.pem'.format(
+                name, name))
+        try:
+            verify_chain(presented_chain(certified_key), root_cert)
+        except InvalidSignature:
+            raise RequestError(
+                '{}-cert.pem does not chain to the root'.format(name))
+        certified_keys.append(certified_key)
+
+    store_generator = KeystoreGenerator(
+        backend=store_backend,
+        key_type=key_spec_of(certified_keys[0].key)[0])
+    artifacts = [
+        store_artifact(
+            '{}store.jks'.format(certified_key.name),
+            store_generator.build_entitystore(certified_key.name + '-cert',
+                                              certified_key.key,
+                                              store_chain(certified_key)))
+        for certified_key in certified_keys
+    ]
+    write_artifacts(node_path, artifacts, overwrite=True)
+
+    for name in ('server-key.pem', 'server-cert.pem') + tuple(
+            request_file(name) for name in CERT_NAMES):
+        path = node_path / name
+        if path.is_file():
+            path.unlink()
+    fsync_path(node_path)
@@ -0,0 +1,667 @@
+"""
+Generation of the artifacts of an Exhibitor ensemble, without touching the
+file system.
+
+Programs can use the package as library instead of running the command and
+reading the files back:
+
+    from exhibitor_tls_artifacts import generate_ensemble
+
+    ensemble = generate_ensemble(['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+    for bundle in ensemble.nodes:
+        upload(bundle.node, bundle.files['serverstore.jks'])
+
+`iter_ensemble` yields the bundles one node at a time for large ensembles.
+The `exhibitor-tls-artifacts` command is a thin wrapper writing the same
+artifacts to disk.
+"""
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import os
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from . import timings
+from .artifacts import (INTERMEDIATE_CERT_FILE, INTERMEDIATE_KEY_FILE,
+                        cert_artifact, key_artifact, store_artifact)
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, CertificateGenerator,
+                               chain_pem, cert_pem, key_pem, key_spec,
+                               key_spec_of, load_certified_key,
+                               not_valid_after, not_valid_before,
+                               public_key_der, root_cert_of, store_chain,
+                               subject_fields, verify_chain)
+from .gen_stores import KeystoreGenerator
+from .keypool import KeyPool
+from .pipeline import run_pipeline
+
+# Admin Router is configured to use the URI ` http://exhibitor/` to reach
+# the local Exhibitor. To make hostname verification pass `exhibitor`
+# needs to be present as a subject alternative name (of type `DNSname`).
+# Also see https://trac.nginx.org/nginx/ticket/1307
+SANS = ['localhost', 'exhibitor', '127.0.0.1']
+
+NodeResult = namedtuple(
+    'NodeResult', ['node', 'artifacts', 'pool_hits', 'pool_misses', 'spans'])
+
+IssuedNode = namedtuple(
+    'IssuedNode',
+    ['node', 'client', 'server', 'pool_hits', 'pool_misses', 'spans'])
+IssuedNode.__doc__ = """
+Client and server certificates of a node issued in a worker process, as
+(certificate `pem`, key `pem`) pairs.
+"""
+
+
+def root_artifacts(root, truststore, directory=''):
+    """
+    Artifacts shared by all nodes: the root certificate and the truststore.
+    `root` may also be an intermediate CA, the root of its chain is used.
+    """
+    return [
+        cert_artifact(os.path.join(directory, 'root-cert.pem'),
+                      root_cert_of(root)),
+        store_artifact(os.path.join(directory, 'truststore.jks'), truststore),
+    ]
+
+
+def build_node_artifacts(node, root, truststore, cert_generator,
+                         store_generator, extra_sans=()):
+    """
+    Builds the client/server certificates and keystores of a single node in
+    memory. The server key and certificate are only part of `serverstore.jks`.
+    `extra_sans` are added to the subject alternative names of both
+    certificates. `root` is the `CertifiedKey` of the root or of an
+    intermediate CA issuing the certificates.
+
+    Returns:
+        List of `Artifact` below the node directory.
+    """
+    client, server = issue_node_certs(node, root, cert_generator, extra_sans)
+
+    client_store = store_generator.build_entitystore('client-cert',
+                                                     client.key,
+                                                     store_chain(client))
+    server_store = store_generator.build_entitystore('server-cert',
+                                                     server.key,
+                                                     store_chain(server))
+
+    return node_artifacts(node, root, truststore, client, server,
+                          client_store, server_store)
+
+
+def issue_node_certs(node, root, cert_generator, extra_sans=()):
+    """
+    Returns:
+        (client, server) `CertifiedKey` pair of a node.
+    """
+    sa_names = SANS + [node] + list(extra_sans)
+    client = cert_generator.issue(cert_name='client',
+                                  sa_names=sa_names,
+                                  issuer=root)
+    server = cert_generator.issue(cert_name='server',
+                                  sa_names=sa_names,
+                                  issuer=root)
+    return client, server
+
+
+def node_artifacts(node, root, truststore, client, server, client_store,
+                   server_store):
+    """
+    Returns:
+        List of `Artifact` below the node directory.
+    """
+    node_dir = str(node)
+    return [
+        cert_artifact(os.path.join(node_dir, 'client-cert.pem'), client.cert,
+                      client.chain[:-1]),
+        key_artifact(os.path.join(node_dir, 'client-key.pem'), client.key),
+        store_artifact(os.path.join(node_dir, 'clientstore.jks'),
+                       client_store),
+        store_artifact(os.path.join(node_dir, 'serverstore.jks'),
+                       server_store),
+    ] + root_artifacts(root, truststore, node_dir)
+
+
+@functools.lru_cache(maxsize=4)
+def load_root(cert_data, key_data):
+    """
+    Parses the certificate, with its chain, and key of the root or of an
+    intermediate CA once per process.
+    """
+    return load_certified_key('root', cert_data, key_data)
+
+
+def generate_node_artifacts(node, root_cert_data, root_key_data, truststore,
+                            store_backend, key_pool_dir=None, key_type='rsa',
+                            key_size=None,
+                            validity_days=DEFAULT_VALIDITY_DAYS,
+                            extra_sans=(),
+                            record_timings=False,
+                            subject=None):
+    """
+    Builds the artifacts of a single node. This is a module level function
+    taking the issuing root or intermediate CA as `pem`, the certificate
+    followed by its chain, so that it can be run in a worker process.
+    `subject` holds `CertificateGenerator` subject fields, e.g.
+    `organization`.
+
+    With `record_timings` the spans of the node are recorded and returned
+    instead of being passed to the listeners of the process.
+
+    Returns:
+        `NodeResult` of the node.
+    """
+    if record_timings:
+        with timings.recording() as recorder:
+            result = generate_node_artifacts(node, root_cert_data,
+                                             root_key_data, truststore,
+                                             store_backend, key_pool_dir,
+                                             key_type, key_size,
+                                             validity_days, extra_sans,
+                                             subject=subject)
+        return result._replace(spans=recorder.spans)
+
+    cert_generator = node_cert_generator(key_pool_dir, key_type, key_size,
+                                         validity_days, subject)
+    key_pool = cert_generator.key_pool
+    store_generator = KeystoreGenerator(backend=store_backend,
+                                        key_type=key_type)
+
+    root = load_root(root_cert_data, root_key_data)
+    with timings.node_label(node), timings.span('node'):
+        artifacts = build_node_artifacts(node, root, truststore,
+                                         cert_generator, store_generator,
+                                         extra_sans)
+    return NodeResult(node, artifacts, key_pool.hits if key_pool else 0,
+                      key_pool.misses if key_pool else 0, [])
+
+
+def node_cert_generator(key_pool_dir, key_type, key_size, validity_days,
+                        subject=None):
+    """
+    `CertificateGenerator` of a worker process, with its own `KeyPool`.
+    """
+    key_pool = None
+    if key_pool_dir is not None:
+        key_pool = KeyPool(key_pool_dir, key_size, key_type)
+    return CertificateGenerator(key_pool=key_pool,
+                                key_type=key_type,
+                                key_size=key_size,
+                                validity_days=validity_days,
+                                **(subject or {}))
+
+
+def issue_node(node, root_cert_data, root_key_data, key_pool_dir=None,
+               key_type='rsa', key_size=None,
+               validity_days=DEFAULT_VALIDITY_DAYS, record_timings=False):
+    """
+    Issues the certificates of a node, the CPU bound stage of
+    `generate_nodes_pipelined`. Keys and certificates are returned as `pem`
+    as they cannot be pickled.
+
+    Returns:
+        `IssuedNode` of the node.
+    """
+    if record_timings:
+        with timings.recording() as recorder:
+            issued = issue_node(node, root_cert_data, root_key_data,
+                                key_pool_dir, key_type, key_size,
+                                validity_days)
+        return issued._replace(spans=recorder.spans)
+
+    cert_generator = node_cert_generator(key_pool_dir, key_type, key_size,
+                                         validity_days)
+    root = load_root(root_cert_data, root_key_data)
+    with timings.node_label(node), timings.span('node'):
+        client, server = issue_node_certs(node, root, cert_generator)
+
+    key_pool = cert_generator.key_pool
+    return IssuedNode(node, (chain_pem(client), key_pem(client.key)),
+                      (chain_pem(server), key_pem(server.key)),
+                      key_pool.hits if key_pool else 0,
+                      key_pool.misses if key_pool else 0, [])
+
+
+async def build_node_stores(issued, root, truststore, store_generator):
+    """
+    Builds the keystores of an `IssuedNode`, the I/O bound stage of
+    `generate_nodes_pipelined`. Both keystores are built at the same time.
+
+    Returns:
+        `NodeResult` of the node.
+    """
+    for span in issued.spans:
+        timings.emit(span)
+
+    client = load_certified_key('client', *issued.client)
+    server = load_certified_key('server', *issued.server)
+    client_store, server_store = await asyncio.gather(
+        store_generator.build_entitystore_async('client-cert',
+                                                client.key,
+                                                store_chain(client),
+                                                node=issued.node),
+        store_generator.build_entitystore_async('server-cert',
+                                                server.key,
+                                                store_chain(server),
+                                                node=issued.node))
+
+    with timings.node_label(issued.node):
+        artifacts = node_artifacts(issued.node, root, truststore, client,
+                                   server, client_store, server_store)
+    return NodeResult(issued.node, artifacts, issued.pool_hits,
+                      issued.pool_misses, [])
+
+
+def generate_nodes_pipelined(nodes, jobs, store_jobs, root, truststore,
+                             store_backend, key_pool_dir=None,
+                             key_type='rsa', key_size=None,
+                             validity_days=DEFAULT_VALIDITY_DAYS):
+    """
+    Generates the artifacts of every node in a pipeline: up to `jobs` worker
+    processes issue certificates while up to `store_jobs` nodes have their
+    keystores built by `openssl` and `keytool` subprocesses. Keys of the
+    next nodes are generated while the keystores of earlier nodes are built.
+
+    Returns:
+        List of `NodeResult` in the order of `nodes`.
+    """
+    cpu_stage = functools.partial(issue_node,
+                                  root_cert_data=chain_pem(root),
+                                  root_key_data=key_pem(root.key),
+                                  key_pool_dir=key_pool_dir,
+                                  key_type=key_type,
+                                  key_size=key_size,
+                                  validity_days=validity_days,
+                                  record_timings=timings.enabled())
+    io_stage = functools.partial(build_node_stores,
+                                 root=root,
+                                 truststore=truststore,
+                                 store_generator=KeystoreGenerator(
+                                     backend=store_backend,
+                                     key_type=key_type))
+    return run_pipeline(nodes, cpu_stage, io_stage, min(jobs, len(nodes)),
+                        store_jobs)
+
+
+def generate_nodes(nodes, jobs, root, truststore, store_backend,
+                   key_pool_dir=None, key_type='rsa', key_size=None,
+                   validity_days=DEFAULT_VALIDITY_DAYS, store_jobs=None):
+    """
+    Runs `generate_node_artifacts` for every node using up to `jobs` worker
+    processes. Every node has its own directory, so the layout does not
+    depend on the number of jobs.
+
+    The `keytool` backend spends most of its time waiting for `openssl` and
+    `keytool`, its nodes are generated by `generate_nodes_pipelined` with up
+    to `store_jobs` nodes building keystores at the same time.
+
+    If a node fails, the nodes which have not been started yet are cancelled
+    and the error is raised once the running workers have finished.
+
+    Spans recorded in the workers are passed to the listeners of this
+    process when their node is done.
+
+    Returns:
+        List of `NodeResult` in the order of `nodes`.
+    """
+    if store_backend == 'keytool':
+        return generate_nodes_pipelined(nodes, jobs, store_jobs or jobs, root,
+                                        truststore, store_backend,
+                                        key_pool_dir, key_type, key_size,
+                                        validity_days)
+
+    args = (chain_pem(root), key_pem(root.key), truststore, store_backend,
+            key_pool_dir, key_type, key_size, validity_days)
+
+    if jobs == 1 or len(nodes) == 1:
+        return [generate_node_artifacts(node, *args) for node in nodes]
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(nodes))) as executor:
+        futures = [
+            executor.submit(generate_node_artifacts, node, *args,
+                            record_timings=timings.enabled())
+            for node in nodes
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    for result in results:
+        for span in result.spans:
+            timings.emit(span)
+    return results
+
+
+def read_nodes(lines):
+    """
+    Parses node lines lazily: a node followed by optional extra subject
+    alternative names, separated by whitespace. Empty lines and lines
+    starting with `#` are skipped.
+
+    Returns:
+        Iterator of (node, extra SANs) pairs.
+    """
+    for line in lines:
+        fields = line.split()
+        if fields and not fields[0].startswith('#'):
+            yield fields[0], tuple(fields[1:])
+
+
+def stream_nodes(node_specs, jobs, root, truststore, store_backend,
+                 key_pool_dir=None, key_type='rsa', key_size=None,
+                 validity_days=DEFAULT_VALIDITY_DAYS):
+    """
+    Generates the artifacts of the (node, extra SANs) pairs of the iterable
+    `node_specs`, which is consumed lazily, using up to `jobs` worker
+    processes. At most two nodes per job are in flight, so memory use does
+    not depend on the number of nodes.
+
+    If a node fails, the nodes in flight are cancelled and the error is
+    raised.
+
+    Returns:
+        Iterator of `NodeResult` in the order nodes finish.
+    """
+    args = (chain_pem(root), key_pem(root.key), truststore, store_backend,
+            key_pool_dir, key_type, key_size, validity_days)
+
+    if jobs == 1:
+        for node, extra_sans in node_specs:
+            yield generate_node_artifacts(node, *args, extra_sans=extra_sans)
+        return
+
+    node_specs = iter(node_specs)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        try:
+            while True:
+                for node, extra_sans in itertools.islice(
+                        node_specs, 2 * jobs - len(pending)):
+                    pending.add(
+                        executor.submit(generate_node_artifacts, node, *args,
+                                        extra_sans=extra_sans,
+                                        record_timings=timings.enabled()))
+                if not pending:
+                    return
+
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    for span in result.spans:
+                        timings.emit(span)
+                    yield result._replace(spans=[])
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+Ensemble = namedtuple('Ensemble',
+                      ['root_cert', 'root_key', 'truststore', 'nodes'])
+Ensemble.__doc__ = """
+Artifacts of an ensemble: the root certificate and key as `pem` and the
+truststore as `jks` `bytes`, and the `NodeBundle` of every node in the order
+the nodes were given.
+"""
+
+NodeBundle = namedtuple('NodeBundle', ['node', 'files'])
+NodeBundle.__doc__ = """
+Artifacts of a node: `files` maps the file names of the node directory, e.g.
+`client-cert.pem` or `serverstore.jks`, to their contents as `bytes`.
+"""
+
+
+class DuplicateNodeError(ValueError):
+    """
+    A node has been given more than once.
+    """
+
+
+def unique_nodes(node_specs):
+    """
+    Passes the (node, extra SANs) pairs through, raising
+    `DuplicateNodeError` on the first node seen twice. Only the node names
+    are kept.
+    """
+    seen = set()
+    for node, extra_sans in node_specs:
+        if node in seen:
+            raise DuplicateNodeError(
+                "Duplicate node '{}' has been provided.".format(node))
+        seen.add(node)
+        yield node, extra_sans
+
+
+def create_root(key_type='rsa', key_size=None,
+                validity_days=DEFAULT_VALIDITY_DAYS, store_backend='native',
+                key_pool=None, subject=None):
+    """
+    Issues a new root certificate and builds the truststore trusting it.
+
+    Args:
+        key_pool: Optional `KeyPool` to take the root key from.
+        subject: Optional dictionary of `CertificateGenerator` subject
+        fields: `country`, `state`, `locality` and `organization`.
+
+    Returns:
+        (root `CertifiedKey`, truststore `bytes`) pair.
+    """
+    cert_generator = CertificateGenerator(key_pool=key_pool,
+                                          key_type=key_type,
+                                          key_size=key_size,
+                                          validity_days=validity_days,
+                                          **(subject or {}))
+    with timings.span('root'):
+        root = cert_generator.issue(cert_name='root')
+    store_generator = KeystoreGenerator(backend=store_backend,
+                                        key_type=key_type)
+    truststore = store_generator.build_truststore([('root-cert', root.cert)])
+    return root, truststore
+
+
+def load_ca(cert_data, key_data, password=None, store_backend='native',
+            now=None):
+    """
+    Loads an existing root CA to issue the certificates with instead of
+    creating a new root, and builds the truststore trusting it. The pair is
+    validated once: the certificate must be a self-signed CA certificate
+    valid at `now`, and the key must be a supported key matching it.
+
+    Args:
+        cert_data: The CA certificate as `pem`.
+        key_data: Its private key as `pem`, encrypted with `password` if it
+        is given.
+
+    Returns:
+        (root `CertifiedKey`, truststore `bytes`) pair, see `create_root`.
+
+    Raises:
+        ValueError: The certificate or key cannot be loaded or do not form
+        a usable CA.
+    """
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+
+    with timings.span('root'):
+        try:
+            root = load_certified_key('root', cert_data, key_data, password)
+        except TypeError as e:
+            # Raised for encrypted keys without password and vice versa.
+            raise ValueError(str(e))
+
+        if root.chain:
+            raise ValueError('The CA certificate file must only contain the '
+                             'CA certificate.')
+        if public_key_der(root.key) != public_key_der(root.cert.public_key()):
+            raise ValueError('The CA key does not match the CA certificate.')
+        key_spec(*key_spec_of(root.key))
+
+        try:
+            constraints = root.cert.extensions.get_extension_for_class(
+                x509.BasicConstraints).value
+        except x509.ExtensionNotFound:
+            constraints = None
+        if constraints is None or not constraints.ca:
+            raise ValueError('The certificate is not a CA certificate.')
+
+        try:
+            verify_chain([root.cert], root.cert)
+        except InvalidSignature:
+            raise ValueError('The CA certificate is not self-signed.')
+
+        now = now or datetime.datetime.utcnow()
+        if not not_valid_before(root.cert) <= now < not_valid_after(
+                root.cert):
+            raise ValueError(
+                'The CA certificate is only valid from {} to {}.'.format(
+                    not_valid_before(root.cert).isoformat(),
+                    not_valid_after(root.cert).isoformat()))
+
+    key_type, _ = key_spec_of(root.key)
+    store_generator = KeystoreGenerator(backend=store_backend,
+                                        key_type=key_type)
+    truststore = store_generator.build_truststore([('root-cert', root.cert)])
+    return root, truststore
+
+
+def create_intermediate(root, key_type='rsa', key_size=None,
+                        validity_days=DEFAULT_VALIDITY_DAYS, key_pool=None):
+    """
+    Issues an intermediate CA certificate with `root`. The intermediate CA
+    issues the node certificates, so that the root key can be kept offline.
+    Its subject has the fields of the root.
+
+    Args:
+        root: `CertifiedKey` of the root, e.g. from `create_root`.
+        key_pool: Optional `KeyPool` to take the intermediate key from.
+
+    Returns:
+        `CertifiedKey` of the intermediate CA, its chain holds the root
+        certificate.
+    """
+    cert_generator = CertificateGenerator(key_pool=key_pool,
+                                          key_type=key_type,
+                                          key_size=key_size,
+                                          validity_days=validity_days,
+                                          **subject_fields(root.cert))
+    with timings.span('intermediate'):
+        return cert_generator.issue(cert_name='intermediate',
+                                    issuer=root,
+                                    ca=True)
+
+
+def intermediate_artifacts(intermediate):
+    """
+    Artifacts of an intermediate CA at the top of the output directory: its
+    certificate followed by the root certificate, and its key.
+    """
+    return [
+        cert_artifact(INTERMEDIATE_CERT_FILE, intermediate.cert,
+                      intermediate.chain),
+        key_artifact(INTERMEDIATE_KEY_FILE, intermediate.key),
+    ]
+
+
+def node_bundle(result):
+    """ `NodeBundle` of a `NodeResult`. """
+    return NodeBundle(
+        result.node,
+        OrderedDict((os.path.basename(artifact.path), artifact.data)
+                    for artifact in result.artifacts))
+
+
+def _node_specs(nodes):
+    for node in nodes:
+        if isinstance(node, str):
+            yield node, ()
+        else:
+            node, extra_sans = node
+            yield node, tuple(extra_sans)
+
+
+def iter_ensemble(nodes, root=None, truststore=None, jobs=1, key_type='rsa',
+                  key_size=None, validity_days=DEFAULT_VALIDITY_DAYS,
+                  store_backend='native', key_pool_dir=None):
+    """
+    Generates the artifacts of `nodes` one node at a time. `nodes` is
+    consumed lazily, so it may be a generator over any number of nodes.
+
+    Args:
+        nodes: Iterable of node addresses or of (node, extra subject
+        alternative names) pairs.
+        root: `CertifiedKey` of the root, e.g. from `create_root`, or of an
+        intermediate CA from `create_intermediate`, to issue the
+        certificates with. A new root is created if it is not given.
+        truststore: Truststore of the root. Built if it is not given.
+        jobs: Number of worker processes. Default: 1, which generates all
+        nodes in the calling process.
+        store_backend: `native` builds keystores in memory, `keytool` runs
+        `openssl` and `keytool` in temporary directories.
+        key_pool_dir: Optional directory of a key pool filled by
+        `exhibitor-tls-artifacts keypool fill`.
+
+    Returns:
+        Iterator of `NodeBundle`, in the order nodes finish when `jobs` is
+        greater than one.
+
+    Raises:
+        ValueError: The key options are invalid.
+        DuplicateNodeError: A node is given twice, raised when it is reached.
+    """
+    key_type, key_size = key_spec(key_type, key_size)
+    if root is None:
+        root, truststore = create_root(key_type, key_size, validity_days,
+                                       store_backend)
+    elif truststore is None:
+        truststore = KeystoreGenerator(
+            backend=store_backend,
+            key_type=key_type).build_truststore([('root-cert',
+                                                  root_cert_of(root))])
+
+    results = stream_nodes(unique_nodes(_node_specs(nodes)), jobs, root,
+                           truststore, store_backend, key_pool_dir, key_type,
+                           key_size, validity_days)
+    for result in results:
+        yield node_bundle(result)
+
+
+def generate_ensemble(nodes, jobs=1, key_type='rsa', key_size=None,
+                      validity_days=DEFAULT_VALIDITY_DAYS,
+                      store_backend='native', key_pool_dir=None):
+    """
+    Generates a new root and the artifacts of every node in memory. See
+    `iter_ensemble` for the arguments.
+
+    Returns:
+        `Ensemble` of the nodes.
+
+    Raises:
+        ValueError: No nodes are given or the key options are invalid.
+        DuplicateNodeError: A node is given twice.
+    """
+    node_specs = list(unique_nodes(_node_specs(nodes)))
+    if not node_specs:
+        raise ValueError('No nodes have been provided.')
+
+    key_type, key_size = key_spec(key_type, key_size)
+    key_pool = None
+    if key_pool_dir is not None:
+        key_pool = KeyPool(key_pool_dir, key_size, key_type)
+    root, truststore = create_root(key_type, key_size, validity_days,
+                                   store_backend, key_pool)
+
+    bundles = {
+        bundle.node: bundle
+        for bundle in iter_ensemble(node_specs, root, truststore, jobs,
+                                    key_type, key_size, validity_days,
+                                    store_backend, key_pool_dir)
+    }
+    return Ensemble(cert_pem(root.cert), key_pem(root.key), truststore,
+                    [bundles[node] for node, _ in node_specs])
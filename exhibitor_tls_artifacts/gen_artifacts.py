@@ -1,10 +1,455 @@
+"""
+Script that generates `TLS` artifacts needed for DC/OS Exhibitor.
+"""
 import click
+import contextlib
+import ipaddress
+import itertools
 import os
-import shutil
 
-from .gen_certificates import CertificateGenerator
-from .gen_stores import KeystoreGenerator
-from .validators import validate_dir_missing
+from pathlib import Path
+
+# Only modules needed to parse the arguments are imported here. The commands
+# import the modules doing the work, which load `cryptography` and `asyncio`,
+# so that `--help` and usage errors return quickly.
+from . import timings
+from .artifacts import (ARCHIVE_FORMATS, INTERMEDIATE_CERT_FILE,
+                        INTERMEDIATE_KEY_FILE, KEY_MODE, LINK_MODES,
+                        ROOT_CERT_FILE, ROOT_KEY_FILE, TRUSTSTORE_FILE,
+                        ArchiveWriter, Artifact, DirectoryWriter,
+                        group_by_node, key_artifact, node_directories,
+                        open_archive_file, write_archive, write_archive_file,
+                        write_artifacts)
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, KEY_TYPES, key_spec,
+                               load_certified_key, root_cert_of)
+from .gen_stores import BACKENDS, KeystoreGenerator
+from .staging import (find_stale, remove_staging, staged_directory,
+                      staged_entries)
+from .validators import (validate_artifact_dir, validate_dir_missing,
+                         validate_duration, validate_serials)
+
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+
+def key_options(f):
+    """ Adds the `--key-type` and `--key-size` options to a command. """
+    f = click.option(
+        '--key-size',
+        help='Size of the keys. The RSA modulus size in bits (at least 2048, '
+        'default 4096) or the ECDSA curve size (256 for P-256, the default, '
+        'or 384 for P-384). Not used for Ed25519.',
+        type=int)(f)
+    f = click.option('--key-type',
+                     help='Type of the keys. Default: rsa.',
+                     type=click.Choice(KEY_TYPES),
+                     default='rsa')(f)
+    return f
+
+
+def validity_option(f):
+    return click.option(
+        '--validity-days',
+        help='Number of days the issued certificates are valid. Default: '
+        '{}.'.format(DEFAULT_VALIDITY_DAYS),
+        type=click.IntRange(min=1),
+        default=DEFAULT_VALIDITY_DAYS)(f)
+
+
+@contextlib.contextmanager
+def timings_report(output_format):
+    """
+    Records the spans of the enclosed block and prints them as
+    `output_format` report. Nothing is recorded if it is `None`.
+    """
+    if output_format is None:
+        yield
+        return
+
+    with timings.recording() as recorder:
+        yield
+    click.echo(timings.format_report(recorder.spans, output_format), err=True)
+
+
+def link_shared_option(f):
+    return click.option(
+        '--link-shared',
+        help='How to write artifacts which are the same for every node, like '
+        '`root-cert.pem` and `truststore.jks`: as separate copies, as hard '
+        'links or as copy-on-write clones of a single file where the file '
+        'system supports them. Default: copy.',
+        type=click.Choice(LINK_MODES),
+        default='copy')(f)
+
+
+def generation_options(f):
+    """ Adds the options shared by all commands issuing node artifacts. """
+    f = click.option(
+        '--timings',
+        'timings_format',
+        help='Print how long every stage took, aggregated as `table` or as '
+        '`json` including every span.',
+        type=click.Choice(timings.FORMATS))(f)
+    f = validity_option(f)
+    f = key_options(f)
+    f = click.option(
+        '--key-pool',
+        help='Key pool directory filled by `keypool fill` to take private '
+        'keys from. Keys are generated when the pool is empty.',
+        type=click.Path(file_okay=False))(f)
+    f = click.option(
+        '--store-backend',
+        help='How to create the jks keystores. `native` writes them '
+        'directly, `keytool` uses the openssl and keytool binaries. Default: '
+        'native.',
+        type=click.Choice(BACKENDS),
+        default='native')(f)
+    f = click.option(
+        '--store-jobs',
+        help='Number of nodes whose keystores are built by openssl and '
+        'keytool at the same time with the `keytool` backend, while the next '
+        'nodes are generated. Defaults to the number of jobs.',
+        type=click.IntRange(min=1))(f)
+    f = click.option(
+        '-j',
+        '--jobs',
+        help='Number of nodes to generate artifacts for in parallel. '
+        'Defaults to the number of CPUs.',
+        type=click.IntRange(min=1),
+        default=default_jobs)(f)
+    return f
+
+
+def validate_key_options(key_type, key_size):
+    try:
+        return key_spec(key_type, key_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--key-size')
+
+
+def validate_nodes(nodes):
+    if not nodes:
+        raise click.BadArgumentUsage('No nodes have been provided.')
+
+    duplicates = sorted({node for node in nodes if nodes.count(node) > 1})
+    if duplicates:
+        raise click.BadArgumentUsage('Duplicate nodes have been provided: '
+                                     '{}'.format(' '.join(duplicates)))
+
+
+def open_key_pool(key_pool, key_type, key_size):
+    from .keypool import KeyPool, KeyPoolError
+
+    if key_pool is None:
+        return None
+
+    pool = KeyPool(key_pool, key_size, key_type)
+    try:
+        pool.check()
+    except KeyPoolError as e:
+        raise click.BadParameter(str(e), param_hint='--key-pool')
+    return pool
+
+
+def check_root_key(directory, param_hint, purpose):
+    root_key_path = directory / ROOT_KEY_FILE
+    if not root_key_path.is_file() and \
+            not (directory / INTERMEDIATE_KEY_FILE).is_file():
+        raise click.BadParameter(
+            "Root key '{}' does not exist. Artifacts must be generated with "
+            "--keep-root-key or --intermediate to {}.".format(
+                root_key_path, purpose),
+            param_hint=param_hint)
+
+
+def load_root_directory(directory, store_backend):
+    """
+    Loads the certificate and key issuing the node certificates of an
+    artifact directory, the intermediate CA if there is one and the root
+    otherwise, and the truststore, which is built if it is missing.
+
+    Returns:
+        (issuer `CertifiedKey`, truststore `bytes`) pair.
+    """
+    if (directory / INTERMEDIATE_KEY_FILE).is_file():
+        issuer = load_certified_key(
+            'intermediate', (directory / INTERMEDIATE_CERT_FILE).read_bytes(),
+            (directory / INTERMEDIATE_KEY_FILE).read_bytes())
+    else:
+        issuer = load_certified_key('root',
+                                    (directory / ROOT_CERT_FILE).read_bytes(),
+                                    (directory / ROOT_KEY_FILE).read_bytes())
+    truststore_path = directory / TRUSTSTORE_FILE
+    if truststore_path.is_file():
+        truststore = truststore_path.read_bytes()
+    else:
+        truststore = KeystoreGenerator(backend=store_backend).build_truststore(
+            [('root-cert', root_cert_of(issuer))])
+    return issuer, truststore
+
+
+def load_ca_options(ca_cert, ca_key, ca_key_password_file, keep_root_key,
+                    store_backend):
+    """
+    Loads and validates the existing CA given with --ca-cert and --ca-key.
+
+    Returns:
+        (root `CertifiedKey`, truststore `bytes`) pair, or `None` without
+        --ca-cert.
+    """
+    if ca_cert is None and ca_key is None:
+        if ca_key_password_file is not None:
+            raise click.BadOptionUsage(
+                '--ca-key-password-file',
+                '--ca-key-password-file requires --ca-key.')
+        return None
+    if ca_cert is None or ca_key is None:
+        raise click.BadOptionUsage(
+            '--ca-cert', '--ca-cert and --ca-key must be used together.')
+    if keep_root_key:
+        raise click.BadOptionUsage(
+            '--keep-root-key',
+            '--keep-root-key cannot be used with --ca-key, the CA key is not '
+            'copied to the output directory. Use --intermediate to add nodes '
+            'later.')
+
+    from .ensemble import load_ca
+
+    password = None
+    if ca_key_password_file is not None:
+        password = ca_key_password_file.read().rstrip(b'\r\n')
+    try:
+        with open(ca_cert, 'rb') as f:
+            cert_data = f.read()
+        with open(ca_key, 'rb') as f:
+            key_data = f.read()
+        return load_ca(cert_data, key_data, password, store_backend)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--ca-cert/--ca-key')
+
+
+def create_issuer(key_type, key_size, validity_days, store_backend, pool,
+                  keep_root_key, intermediate, ca=None):
+    """
+    Creates the root and, with `intermediate`, an intermediate CA issuing
+    the node certificates. An existing root given as `ca`, the pair returned
+    by `load_ca`, is used instead of creating one.
+
+    Returns:
+        (issuer `CertifiedKey`, truststore `bytes`, list of the `Artifact` at
+        the top of the output directory) tuple.
+    """
+    from .ensemble import (create_intermediate, create_root,
+                           intermediate_artifacts, root_artifacts)
+
+    if ca is not None:
+        root, truststore = ca
+    else:
+        root, truststore = create_root(key_type, key_size, validity_days,
+                                       store_backend, pool)
+    shared = root_artifacts(root, truststore)
+    if keep_root_key:
+        shared.append(key_artifact(ROOT_KEY_FILE, root.key))
+    if not intermediate:
+        return root, truststore, shared
+
+    issuer = create_intermediate(root, key_type, key_size, validity_days,
+                                 pool)
+    return issuer, truststore, shared + intermediate_artifacts(issuer)
+
+
+def archive_path(output_directory, output_format):
+    """
+    Path of the archive written for `-d output_directory`. The extension of
+    the format is appended unless the path already has it.
+    """
+    path = str(output_directory).rstrip('/')
+    extension = ARCHIVE_FORMATS[output_format][1]
+    if output_format == 'tgz' and path.endswith('.tar.gz'):
+        return path
+    return path if path.endswith(extension) else path + extension
+
+
+def validate_output(output_directory, output_format, archive_per_node):
+    """
+    Checks the output options before anything is generated.
+    """
+    if output_format == 'directory':
+        if archive_per_node:
+            raise click.BadOptionUsage(
+                '--archive-per-node',
+                '--archive-per-node requires --output-format tar or tgz.')
+        if str(output_directory) == '-':
+            raise click.BadParameter(
+                'Writing to stdout requires --output-format tar or tgz.',
+                param_hint='--output-directory')
+        return
+
+    if str(output_directory) == '-':
+        if archive_per_node:
+            raise click.BadOptionUsage(
+                '--archive-per-node',
+                '--archive-per-node cannot be written to stdout.')
+        return
+
+    if not archive_per_node and os.path.lexists(
+            archive_path(output_directory, output_format)):
+        raise click.BadParameter(
+            "Archive '{}' already exists.".format(
+                archive_path(output_directory, output_format)),
+            param_hint='--output-directory')
+
+
+def write_output(output_directory, artifacts, output_format,
+                 archive_per_node, link_shared='copy'):
+    """
+    Writes the artifacts as directory tree, as a single archive or, with
+    `archive_per_node`, as one archive per node next to the shared files.
+    Output directories get the issuance database of the node certificates.
+    """
+    from .revocation import record_issued
+
+    if output_format == 'directory':
+        with staged_directory(output_directory) as staging:
+            write_artifacts(staging, artifacts, link_shared=link_shared)
+            with timings.span('record'):
+                record_issued(staging, artifacts)
+    elif str(output_directory) == '-':
+        stdout = click.get_binary_stream('stdout')
+        write_archive(stdout, artifacts, output_format, link_shared)
+        stdout.flush()
+    elif archive_per_node:
+        shared, nodes = group_by_node(artifacts)
+        extension = ARCHIVE_FORMATS[output_format][1]
+        with staged_directory(output_directory) as staging:
+            write_artifacts(staging, shared, link_shared=link_shared)
+            for node, node_artifacts in nodes.items():
+                write_archive_file(staging / (node + extension),
+                                   node_artifacts, output_format, link_shared)
+            with timings.span('record'):
+                record_issued(staging, artifacts)
+    else:
+        write_archive_file(archive_path(output_directory, output_format),
+                           artifacts, output_format, link_shared)
+
+
+def write_streamed_output(output_directory, shared, results, output_format,
+                          archive_per_node, link_shared='copy'):
+    """
+    Like `write_output`, but writes the artifacts of every `NodeResult` of
+    the iterable `results` as soon as it arrives and builds the manifest
+    entry by entry, so memory use does not depend on the number of nodes.
+    If writing fails, the partial output is removed.
+
+    Returns:
+        Iterator of the `NodeResult` once they are written.
+    """
+    import tempfile
+
+    from .manifest import MANIFEST_FILE, MANIFEST_MODE, ManifestWriter
+    from .revocation import ISSUED_DB_FILE, IssuanceDB, issued_certs
+
+    if output_format != 'directory' and not archive_per_node:
+        with contextlib.ExitStack() as stack:
+            if str(output_directory) == '-':
+                f = click.get_binary_stream('stdout')
+            else:
+                f = stack.enter_context(
+                    open_archive_file(
+                        archive_path(output_directory, output_format)))
+            manifest_file = stack.enter_context(tempfile.TemporaryFile())
+            writer = stack.enter_context(
+                ArchiveWriter(f, output_format, link_shared))
+
+            manifest = ManifestWriter(manifest_file)
+            for artifact in shared:
+                writer.add(artifact)
+                manifest.add(artifact)
+            for result in results:
+                for artifact in result.artifacts:
+                    writer.add(artifact)
+                    manifest.add(artifact)
+                yield result
+            manifest.close()
+            size = manifest_file.tell()
+            manifest_file.seek(0)
+            writer.add_file(MANIFEST_FILE, manifest_file, size, MANIFEST_MODE)
+        return
+
+    extension = ARCHIVE_FORMATS.get(output_format, (None, None))[1]
+    with staged_directory(output_directory) as staging:
+        writer = DirectoryWriter(staging, link_shared=link_shared)
+        manifest_path = staging / MANIFEST_FILE
+        fd = os.open(str(manifest_path), os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                     MANIFEST_MODE)
+        with os.fdopen(fd, 'wb') as manifest_file, \
+                IssuanceDB(staging / ISSUED_DB_FILE) as database:
+            os.fchmod(manifest_file.fileno(), MANIFEST_MODE)
+            manifest = ManifestWriter(manifest_file)
+            for artifact in shared:
+                writer.add(artifact)
+                manifest.add(artifact)
+            for result in results:
+                if archive_per_node:
+                    write_archive_file(staging / (result.node + extension),
+                                       result.artifacts, output_format,
+                                       link_shared)
+                for artifact in result.artifacts:
+                    if not archive_per_node:
+                        writer.add(artifact)
+                    manifest.add(artifact)
+                database.record(issued_certs(result.artifacts))
+                yield result
+            manifest.close()
+
+
+def generate_streamed(node_specs, output_directory, jobs, store_backend,
+                      pool, key_pool_dir, key_type, key_size, validity_days,
+                      keep_root_key, intermediate, output_format,
+                      archive_per_node, link_shared, ca=None):
+    """
+    Generates and writes the artifacts of the nodes of the iterable
+    `node_specs` one node at a time.
+
+    Returns:
+        List of the `NodeResult` of the nodes without their artifacts.
+    """
+    from .ensemble import stream_nodes
+
+    root, truststore, shared = create_issuer(key_type, key_size,
+                                             validity_days, store_backend,
+                                             pool, keep_root_key,
+                                             intermediate, ca)
+
+    results = []
+    with timings.span('nodes'):
+        for result in write_streamed_output(
+                output_directory, shared,
+                stream_nodes(node_specs, jobs, root, truststore,
+                             store_backend, key_pool_dir, key_type, key_size,
+                             validity_days), output_format, archive_per_node,
+                link_shared):
+            click.echo('Generated artifacts for {}'.format(result.node),
+                       err=True)
+            results.append(result._replace(artifacts=[]))
+    return results
+
+
+def report_key_pool(pool, results):
+    if pool is None:
+        return
+
+    hits = pool.hits + sum(result.pool_hits for result in results)
+    misses = pool.misses + sum(result.pool_misses for result in results)
+    click.echo('Key pool: {} hits, {} misses'.format(hits, misses), err=True)
+
+
+def report_reclaimed(pool):
+    reclaimed = pool.reclaim()
+    if reclaimed:
+        click.echo('Put back {} keys claimed by runs which crashed.'.format(
+            reclaimed))
 
 
 @click.command(name='exhibitor-tls-artifacts')
@@ -12,68 +457,887 @@ from .validators import validate_dir_missing
 @click.option(
     '-d',
     '--output-directory',
-    help='Directory to put artifacts in. This output_directory must not exist.',
+    help='Directory to put artifacts in. This output_directory must not exist. '
+    'With --output-format tar or tgz the archive to write, `-` for stdout.',
     default='./artifacts/',
     callback=validate_dir_missing)
-def app(nodes, output_directory):
+@generation_options
+@click.option(
+    '--keep-root-key',
+    help='Keep the root key as `root-key.pem` in the output directory, which '
+    'is needed to add nodes later.',
+    is_flag=True)
+@click.option(
+    '--intermediate',
+    help='Issue the node certificates with an intermediate CA signed by the '
+    'root. Its certificate and key are kept as `intermediate-cert.pem` and '
+    '`intermediate-key.pem`, so that nodes can be added and renewed while '
+    'the root key is kept offline.',
+    is_flag=True)
+@click.option(
+    '--ca-cert',
+    help='Issue the certificates with an existing root CA instead of '
+    'generating a new one. PEM file with the self-signed CA certificate, '
+    'requires --ca-key.',
+    type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--ca-key',
+    help='PEM file with the private key of --ca-cert.',
+    type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--ca-key-password-file',
+    help='Read the passphrase of an encrypted --ca-key from FILE, `-` for '
+    'stdin.',
+    type=click.File('rb'))
+@click.option(
+    '--output-format',
+    help='Write the artifacts as directory tree or stream them into a `tar` '
+    'or gzipped `tar` archive. Default: directory.',
+    type=click.Choice(('directory', ) + tuple(sorted(ARCHIVE_FORMATS))),
+    default='directory')
+@click.option(
+    '--archive-per-node',
+    help='Write one archive per node into the output directory, next to the '
+    'shared root certificate and truststore.',
+    is_flag=True)
+@link_shared_option
+@click.option(
+    '--nodes-from',
+    help='Read the nodes from FILE, `-` for stdin: one node per line, '
+    'optionally followed by extra subject alternative names. Artifacts are '
+    'written as soon as a node is done.',
+    type=click.File('r'))
+def app(nodes, output_directory, jobs, store_jobs, store_backend, key_pool,
+        key_type, key_size, validity_days, timings_format, keep_root_key,
+        intermediate, ca_cert, ca_key, ca_key_password_file, output_format,
+        archive_per_node, link_shared, nodes_from):
     """
     Generates Admin Router and Exhibitor TLS artifacts. NODES should consist
     of a space separated list of master ip addresses. See
     https://docs.mesosphere.com/1.13/security/ent/tls-ssl/exhibitor/
     """
-    if not nodes:
-        raise click.BadArgumentUsage('No nodes have been provided.')
+    if nodes_from is not None:
+        if nodes:
+            raise click.BadArgumentUsage(
+                'NODES and --nodes-from cannot be used together.')
+        # Streamed nodes build their keystores in the worker processes.
+        if store_jobs is not None:
+            raise click.BadOptionUsage(
+                '--store-jobs',
+                '--store-jobs cannot be used with --nodes-from.')
+    else:
+        validate_nodes(nodes)
+    key_type, key_size = validate_key_options(key_type, key_size)
+    validate_output(output_directory, output_format, archive_per_node)
+    pool = open_key_pool(key_pool, key_type, key_size)
+    # The CA is validated before anything is generated and parsed once for
+    # the whole run.
+    ca = load_ca_options(ca_cert, ca_key, ca_key_password_file,
+                         keep_root_key, store_backend)
 
-    # Create artifact output_directory
-    os.makedirs(output_directory)
+    from .ensemble import (DuplicateNodeError, generate_nodes, read_nodes,
+                           unique_nodes)
+    from .manifest import build_manifest, manifest_artifact
 
-    # Admin Router is configured to use the URI ` http://exhibitor/` to reach
-    # the local Exhibitor. To make hostname verification pass `exhibitor`
-    # needs to be present as a subject alternative name (of type `DNSname`).
-    # Also see https://trac.nginx.org/nginx/ticket/1307
+    if nodes_from is not None:
+        node_specs = read_nodes(nodes_from)
+        first = next(node_specs, None)
+        if first is None:
+            raise click.BadArgumentUsage('No nodes have been provided.')
+        node_specs = unique_nodes(itertools.chain([first], node_specs))
+        try:
+            with timings_report(timings_format):
+                results = generate_streamed(node_specs, output_directory,
+                                            jobs, store_backend, pool,
+                                            key_pool, key_type, key_size,
+                                            validity_days, keep_root_key,
+                                            intermediate, output_format,
+                                            archive_per_node, link_shared,
+                                            ca)
+        except DuplicateNodeError as e:
+            raise click.BadParameter(str(e), param_hint='--nodes-from')
+        report_key_pool(pool, results)
+        return
 
-    sans = ['localhost', 'exhibitor', '127.0.0.1']
+    with timings_report(timings_format):
+        issuer, truststore, artifacts = create_issuer(
+            key_type, key_size, validity_days, store_backend, pool,
+            keep_root_key, intermediate, ca)
+
+        with timings.span('nodes'):
+            results = generate_nodes(nodes, jobs, issuer, truststore,
+                                     store_backend, key_pool, key_type,
+                                     key_size, validity_days, store_jobs)
+
+        for result in results:
+            artifacts.extend(result.artifacts)
+        with timings.span('manifest'):
+            artifacts.append(manifest_artifact(build_manifest(artifacts)))
+
+        # Nothing is written before all artifacts have been built. Unless
+        # asked for, the root key is never written.
+        with timings.span('write'):
+            write_output(output_directory, artifacts, output_format,
+                         archive_per_node, link_shared)
+
+    report_key_pool(pool, results)
+
+
+@click.command(name='add-nodes')
+@click.argument('nodes', nargs=-1)
+@click.option('-d',
+              '--output-directory',
+              help='Directory with the artifacts generated with '
+              '--keep-root-key.',
+              default='./artifacts/',
+              callback=validate_artifact_dir)
+@generation_options
+@link_shared_option
+def add_nodes(nodes, output_directory, jobs, store_jobs, store_backend,
+              key_pool, key_type, key_size, validity_days, timings_format,
+              link_shared):
+    """
+    Generates artifacts for NODES in an existing artifact directory using its
+    root certificate and key. The artifacts of the other nodes are not
+    changed.
+    """
+    validate_nodes(nodes)
+    existing = sorted(set(nodes) & set(os.listdir(str(output_directory))))
+    if existing:
+        raise click.BadArgumentUsage(
+            'Nodes already exist in {}: {}'.format(output_directory,
+                                                   ' '.join(existing)))
+
+    check_root_key(output_directory, '--output-directory', 'add nodes')
+    key_type, key_size = validate_key_options(key_type, key_size)
+    pool = open_key_pool(key_pool, key_type, key_size)
+
+    from .ensemble import generate_nodes
+    from .manifest import update_manifest
+    from .revocation import record_issued
+
+    with timings_report(timings_format):
+        root, truststore = load_root_directory(output_directory,
+                                               store_backend)
+
+        with timings.span('nodes'):
+            results = generate_nodes(nodes, jobs, root, truststore,
+                                     store_backend, key_pool, key_type,
+                                     key_size, validity_days, store_jobs)
+
+        artifacts = [
+            artifact for result in results for artifact in result.artifacts
+        ]
+        with timings.span('write'), staged_entries(output_directory,
+                                                   'add-nodes') as staging:
+            write_artifacts(staging, artifacts, link_shared=link_shared)
+
+        with timings.span('manifest'):
+            update_manifest(output_directory, artifacts)
+        with timings.span('record'):
+            record_issued(output_directory, artifacts)
+
+    report_key_pool(pool, results)
+
+
+@click.command(name='remove-nodes')
+@click.argument('nodes', nargs=-1)
+@click.option('-d',
+              '--output-directory',
+              help='Directory with the generated artifacts.',
+              default='./artifacts/',
+              callback=validate_artifact_dir)
+def remove_nodes(nodes, output_directory):
+    """
+    Removes the artifacts of NODES from an artifact directory. The artifacts
+    of the other nodes are not changed.
+    """
+    import shutil
 
+    from .manifest import update_manifest
+
+    validate_nodes(nodes)
+    missing = sorted(set(nodes) - set(node_directories(output_directory)))
+    if missing:
+        raise click.BadArgumentUsage(
+            'Nodes do not exist in {}: {}'.format(output_directory,
+                                                  ' '.join(missing)))
+
+    for node in nodes:
+        shutil.rmtree(str(output_directory / node))
+
+    update_manifest(output_directory, removed_nodes=nodes)
+
+
+@click.command(name='renew')
+@click.option('-d',
+              '--output-directory',
+              help='Directory with the artifacts generated with '
+              '--keep-root-key.',
+              default='./artifacts/',
+              callback=validate_artifact_dir)
+@click.option('--within',
+              help='Renew certificates expiring within this duration, e.g. '
+              '30d, 12h or 2w. Default: 30d.',
+              default='30d',
+              callback=validate_duration)
+@validity_option
+@click.option(
+    '--store-backend',
+    help='How to create the jks keystores. Default: native.',
+    type=click.Choice(BACKENDS),
+    default='native')
+@click.option('--dry-run',
+              help='Only list the certificates which would be renewed.',
+              is_flag=True)
+def renew_command(output_directory, within, validity_days, store_backend,
+                  dry_run):
+    """
+    Reissues the certificates of an artifact directory which expire soon and
+    rebuilds the stores containing them. Other artifacts are not changed.
+    """
+    from .manifest import update_manifest
+    from .renewal import RenewalError, find_expiring, renew
+    from .revocation import record_issued
+
+    expiring = find_expiring(output_directory, within)
+    for cert in expiring:
+        click.echo('{} certificate{} expires {}'.format(
+            cert.name, '' if cert.node is None else ' of ' + cert.node,
+            cert.not_after.isoformat()))
+
+    if not expiring:
+        click.echo('No certificates expire within {}.'.format(within))
+        return
+    if dry_run:
+        return
+
+    try:
+        artifacts = renew(output_directory, expiring, store_backend,
+                          validity_days)
+    except RenewalError as e:
+        raise click.ClickException(str(e))
+
+    update_manifest(output_directory, artifacts)
+    record_issued(output_directory, artifacts)
+
+    click.echo('Renewed {} certificates.'.format(len(expiring)))
+
+
+@click.command(name='revoke')
+@click.argument('nodes', nargs=-1)
+@click.option('-d',
+              '--output-directory',
+              help='Directory with the artifacts generated with '
+              '--keep-root-key or --intermediate.',
+              default='./artifacts/',
+              callback=validate_artifact_dir)
+@click.option('--serial',
+              'serials',
+              help='Hexadecimal serial number of a certificate to revoke, '
+              'e.g. from the manifest. Can be given multiple times.',
+              multiple=True,
+              callback=validate_serials)
+@click.option('--reason',
+              help='Reason recorded in the CRL. Default: unspecified.',
+              type=click.Choice(('unspecified', 'key-compromise',
+                                 'affiliation-changed', 'superseded',
+                                 'cessation-of-operation')),
+              default='unspecified')
+@click.option('--full',
+              help='Issue a new full CRL instead of a delta CRL.',
+              is_flag=True)
+@click.option('--crl-validity-days',
+              help='Days until relying parties should fetch a new CRL. '
+              'Default: 7.',
+              type=click.IntRange(min=1),
+              default=7)
+def revoke_command(nodes, output_directory, serials, reason, full,
+                   crl_validity_days):
+    """
+    Revokes all certificates ever issued to NODES and the certificates with
+    the given serial numbers, then issues `delta-crl.pem`, a delta CRL
+    listing the certificates revoked since the last full CRL `crl.pem`. The
+    full CRL is issued with --full or if there is none yet. Without NODES
+    and --serial new CRLs are issued, e.g. before the current ones expire.
+    """
+    check_root_key(output_directory, '--output-directory',
+                   'revoke certificates')
+
+    from .manifest import update_manifest
+    from .revocation import RevocationError, revoke
+
+    issuer, _ = load_root_directory(output_directory, 'native')
     try:
-        cert_generator = CertificateGenerator(output_directory)
-        root_cert_path, root_key_path = cert_generator.get_cert(
-            cert_name='root')
-        store_generator = KeystoreGenerator(output_directory)
-        root_truststore = store_generator.create_truststore([root_cert_path])
-
-        for node in nodes:
-            node_path_name = str(node)
-            client_cert_path, client_key_path = cert_generator.get_cert(
-                cert_name='client',
-                node_cert_path=node_path_name,
-                issuer=(root_cert_path, root_key_path),
-                sa_names=sans + [node])
-            server_cert_path, server_key_path = cert_generator.get_cert(
-                cert_name='server',
-                node_cert_path=node_path_name,
-                issuer=(root_cert_path, root_key_path),
-                sa_names=sans + [node])
-
-            store_generator.create_entitystore(client_cert_path,
-                                               client_key_path,
-                                               store_name='clientstore',
-                                               node_cert_path=node_path_name)
-            store_generator.create_entitystore(server_cert_path,
-                                               server_key_path,
-                                               store_name='serverstore',
-                                               node_cert_path=node_path_name)
-            os.remove(server_cert_path)
-            os.remove(server_key_path)
-
-            shutil.copy(root_cert_path, client_cert_path.parent)
-            shutil.copy(root_truststore, client_cert_path.parent)
-        os.remove(root_key_path)
-
-    except Exception as e:
-        if os.path.exists(output_directory):
-            shutil.rmtree(output_directory)
-        raise e
+        revoked, artifacts = revoke(output_directory, issuer, nodes,
+                                    serials, reason, full, crl_validity_days)
+    except RevocationError as e:
+        raise click.BadArgumentUsage(str(e))
+
+    write_artifacts(output_directory, artifacts, overwrite=True)
+    update_manifest(output_directory, artifacts)
+
+    for cert in revoked:
+        click.echo('Revoked the {} certificate of {} with serial {}'.format(
+            cert.name, cert.node, cert.serial))
+    click.echo('Issued {}.'.format(' and '.join(
+        artifact.path for artifact in artifacts)))
+
+
+@click.command(name='verify')
+@click.argument('output_directory',
+                metavar='DIRECTORY',
+                default='./artifacts/',
+                callback=validate_artifact_dir)
+@click.option('-j',
+              '--jobs',
+              help='Number of nodes to verify in parallel. Defaults to the '
+              'number of CPUs.',
+              type=click.IntRange(min=1),
+              default=default_jobs)
+def verify_command(output_directory, jobs):
+    """
+    Verifies an artifact directory: certificates chain to the root
+    certificate and have the expected SANs, keys match their certificates,
+    the stores contain the expected entries and files have the expected
+    modes. Exits with status 1 if problems are found.
+    """
+    from .verify import verify_tree
+
+    nodes, problems = verify_tree(output_directory, jobs)
+    for problem in problems:
+        click.echo(problem, err=True)
+
+    if problems:
+        raise click.ClickException('Found {} problems in {}.'.format(
+            len(problems), output_directory))
+
+    click.echo('Verified the artifacts of {} nodes in {}.'.format(
+        len(nodes), output_directory))
+
+
+@click.command(name='recover')
+@click.argument('directory',
+                default='.',
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--dry-run',
+              help='Only list the staging paths which would be removed.',
+              is_flag=True)
+def recover(directory, dry_run):
+    """
+    Removes the staging directories and files left behind by runs which
+    crashed or were killed, in DIRECTORY and in the artifact directories
+    below it. Output is only moved into place once it is complete, nodes
+    which `add-nodes` had only partially moved into place are moved back
+    and removed with their staging directory. Staging paths of running
+    processes are kept.
+    """
+    directories = [Path(directory)] + [
+        path for path in sorted(Path(directory).iterdir())
+        if path.is_dir() and (path / ROOT_CERT_FILE).is_file()
+    ]
+    stale = [path for d in directories for path in find_stale(d)]
+    for path in stale:
+        if not dry_run:
+            remove_staging(path)
+        click.echo('{} {}'.format('Would remove' if dry_run else 'Removed',
+                                  path))
+    if not stale:
+        click.echo('No stale staging paths found in {}.'.format(directory))
+
+
+@click.command(name='batch')
+@click.argument('spec', type=click.Path(exists=True, dir_okay=False))
+@click.option('-j',
+              '--jobs',
+              help='Number of keys and certificates to generate in parallel, '
+              'shared by all clusters. Defaults to the number of CPUs.',
+              type=click.IntRange(min=1),
+              default=default_jobs)
+@click.option(
+    '--store-backend',
+    help='How to create the jks keystores. Default: native.',
+    type=click.Choice(BACKENDS),
+    default='native')
+@click.option('--report-format',
+              help='Format of the summary report. Default: table.',
+              type=click.Choice(('table', 'json')),
+              default='table')
+def batch_command(spec, jobs, store_backend, report_format):
+    """
+    Generates the artifacts of all clusters listed in the YAML file SPEC,
+    see the README for its format. Each cluster gets its own root
+    certificate and output directory, which is written once all of its
+    artifacts are generated. A failing cluster does not stop the others but
+    makes the command exit with status 1.
+    """
+    from .batch import SpecError, format_reports, generate_batch, load_spec
+
+    try:
+        clusters = load_spec(spec)
+    except SpecError as e:
+        raise click.BadParameter(str(e), param_hint='SPEC')
+
+    reports = []
+    for report in generate_batch(clusters, jobs, store_backend):
+        click.echo('{} cluster {}'.format(
+            'Failed' if report.error else 'Generated', report.name),
+                   err=True)
+        reports.append(report)
+
+    order = [cluster.name for cluster in clusters]
+    reports.sort(key=lambda report: order.index(report.name))
+    click.echo(format_reports(reports, report_format))
+
+    failed = [report for report in reports if report.error]
+    if failed:
+        raise click.ClickException('{} of {} clusters failed.'.format(
+            len(failed), len(reports)))
+
+
+@click.command(name='create-csrs')
+@click.argument('node')
+@click.option('-d',
+              '--output-directory',
+              help='Directory to create the node directory with the keys and '
+              'signing requests in. Default: ./csrs/.',
+              default='./csrs/',
+              type=click.Path(file_okay=False))
+@click.option('--san',
+              'sans',
+              help='Extra subject alternative name to request, e.g. a DNS '
+              'name of the master. Can be given multiple times.',
+              multiple=True)
+@key_options
+def create_csrs(node, output_directory, sans, key_type, key_size):
+    """
+    Generates the client and server keys of NODE and certificate signing
+    requests for them, to be run on the master itself. Send the `.csr` files
+    of the node directory to be signed with `sign-csrs`, the keys stay on
+    the master.
+    """
+    key_type, key_size = validate_key_options(key_type, key_size)
+    if os.path.lexists(os.path.join(output_directory, node)):
+        raise click.BadArgumentUsage('Node {} already exists in {}.'.format(
+            node, output_directory))
+
+    from .csr import create_requests
+
+    os.makedirs(output_directory, exist_ok=True)
+    artifacts = create_requests(node, key_type, key_size, sans)
+    with staged_entries(output_directory, 'create-csrs') as staging:
+        write_artifacts(staging, artifacts)
+
+    click.echo('Created the signing requests of {} in {}.'.format(
+        node, os.path.join(output_directory, node)))
+
+
+@click.command(name='sign-csrs')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('-d',
+              '--ca-directory',
+              help='Artifact directory generated with --keep-root-key whose '
+              'root signs the requests.',
+              required=True,
+              callback=validate_artifact_dir)
+@click.option('-j',
+              '--jobs',
+              help='Number of nodes to sign in parallel. Defaults to the '
+              'number of CPUs.',
+              type=click.IntRange(min=1),
+              default=default_jobs)
+@validity_option
+@click.option(
+    '--store-backend',
+    help='How to create the truststore if the CA directory has none. '
+    'Default: native.',
+    type=click.Choice(BACKENDS),
+    default='native')
+def sign_csrs(directory, ca_directory, jobs, validity_days, store_backend):
+    """
+    Signs the certificate signing requests of all node directories in
+    DIRECTORY, created by `create-csrs` on the masters. All requests are
+    validated first: they must request the SANs localhost, exhibitor,
+    127.0.0.1 and the node, no other IP addresses and use supported keys.
+    Nothing is signed if any request is invalid. The certificates, the root
+    certificate and the truststore are written to the node directories.
+    """
+    check_root_key(ca_directory, '--ca-directory', 'sign requests')
+
+    from .csr import load_requests, sign_requests
+    from .revocation import record_issued
+
+    node_requests, problems = load_requests(directory)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise click.ClickException('Found {} problems in {}.'.format(
+            len(problems), directory))
+    if not node_requests:
+        raise click.ClickException(
+            'No signing requests found in {}.'.format(directory))
+
+    root, truststore = load_root_directory(ca_directory, store_backend)
+    artifacts = sign_requests(node_requests, root, truststore, validity_days,
+                              jobs)
+    write_artifacts(directory, artifacts, overwrite=True)
+    record_issued(ca_directory, artifacts)
+
+    click.echo('Signed the requests of {} nodes in {}.'.format(
+        len(node_requests), directory))
+
+
+@click.command(name='build-stores')
+@click.argument('node_directory',
+                metavar='NODE_DIRECTORY',
+                type=click.Path(exists=True, file_okay=False))
+@click.option(
+    '--store-backend',
+    help='How to create the jks keystores. Default: native.',
+    type=click.Choice(BACKENDS),
+    default='native')
+def build_stores_command(node_directory, store_backend):
+    """
+    Builds the keystores of a node directory from the keys created by
+    `create-csrs` and the certificates signed by `sign-csrs`, to be run on
+    the master. The server key, the server certificate and the signing
+    requests are removed afterwards, leaving the regular artifacts of the
+    node.
+    """
+    from .csr import RequestError, build_stores
+
+    try:
+        build_stores(node_directory, store_backend)
+    except RequestError as e:
+        raise click.ClickException(str(e))
+
+    click.echo('Built the keystores in {}.'.format(node_directory))
+
+
+def parse_key_specs(ctx, param, value):
+    """ Parses `TYPE[:SIZE]` key specs into (key_type, key_size) pairs. """
+    assert ctx or param  # For linting
+    specs = []
+    for spec in value:
+        key_type, _, key_size = spec.partition(':')
+        if key_type not in KEY_TYPES or (key_size and
+                                         not key_size.isdigit()):
+            raise click.BadParameter(
+                "'{}' is not a key type optionally followed by a size, e.g. "
+                "rsa:2048 or ecdsa.".format(spec))
+        try:
+            specs.append(key_spec(key_type, int(key_size) if key_size else
+                                  None))
+        except ValueError as e:
+            raise click.BadParameter('{}: {}'.format(spec, e))
+    return specs
+
+
+@click.command(name='bench-handshake')
+@click.argument('directories',
+                metavar='[DIRECTORY]...',
+                nargs=-1,
+                callback=lambda ctx, param, value: [
+                    validate_artifact_dir(ctx, param, directory)
+                    for directory in value
+                ])
+@click.option('--node',
+              help='Node whose artifacts are used. Default: the first node '
+              'of every directory.')
+@click.option('--key-spec',
+              'key_specs',
+              help='Also benchmark artifacts generated for the run with keys '
+              'of TYPE[:SIZE], e.g. rsa:2048 or ecdsa:384. Can be given '
+              'multiple times.',
+              multiple=True,
+              callback=parse_key_specs)
+@click.option('-n',
+              '--handshakes',
+              help='Number of handshakes per benchmark. Default: 200.',
+              type=click.IntRange(min=1),
+              default=200)
+@click.option('-c',
+              '--concurrency',
+              help='Number of clients connecting at the same time. '
+              'Default: 1.',
+              type=click.IntRange(min=1),
+              default=1)
+@click.option('--resume',
+              help='Resume the session of a first handshake, like clients '
+              'reconnecting with a session cache, instead of doing full '
+              'handshakes.',
+              is_flag=True)
+@click.option('--report-format',
+              help='Format of the report. Default: table.',
+              type=click.Choice(('table', 'json')),
+              default='table')
+def bench_handshake(directories, node, key_specs, handshakes, concurrency,
+                    resume, report_format):
+    """
+    Measures mutually authenticated TLS handshakes with the artifacts of a
+    node on loopback: a local server presents the server certificate of the
+    node and clients present its client certificate and verify the server
+    against root-cert.pem and the SAN exhibitor, like Admin Router. Reports
+    handshakes per second and latency percentiles for every DIRECTORY and
+    --key-spec.
+    """
+    if not directories and not key_specs:
+        raise click.BadArgumentUsage(
+            'No DIRECTORY or --key-spec has been provided.')
+    targets = []
+    for directory in directories:
+        nodes = node_directories(directory)
+        if node is not None and node not in nodes:
+            raise click.BadParameter(
+                "Node '{}' does not exist in {}.".format(node, directory),
+                param_hint='--node')
+        if not nodes:
+            raise click.BadArgumentUsage(
+                'No nodes found in {}.'.format(directory))
+        targets.append((str(directory), directory / (node or nodes[0])))
+
+    import ssl
+    import tempfile
+
+    from .ensemble import generate_ensemble
+    from .handshake import bench_node, format_reports
+
+    reports = []
+    with tempfile.TemporaryDirectory() as generated:
+        for key_type, key_size in key_specs:
+            name = key_type if key_size is None else '{}-{}'.format(
+                key_type, key_size)
+            click.echo('Generating {} artifacts'.format(name), err=True)
+            bundle = generate_ensemble([node or '127.0.0.1'],
+                                       key_type=key_type,
+                                       key_size=key_size).nodes[0]
+            artifacts = [
+                Artifact(os.path.join(name, file_name), data, KEY_MODE)
+                for file_name, data in bundle.files.items()
+            ]
+            write_artifacts(generated, artifacts)
+            targets.append(('generated ' + name, Path(generated) / name))
+
+        for name, node_path in targets:
+            click.echo('Benchmarking {}'.format(name), err=True)
+            try:
+                reports.append(
+                    bench_node(node_path, handshakes, concurrency, resume,
+                               name))
+            except (ssl.SSLError, OSError) as e:
+                raise click.ClickException(
+                    'Handshake with the artifacts of {} failed: {}'.format(
+                        node_path, e))
+
+    click.echo(format_reports(reports, report_format))
+
+
+def validate_loopback(ctx, param, value):
+    assert ctx or param  # For linting
+    try:
+        loopback = ipaddress.ip_address(value).is_loopback
+    except ValueError:
+        loopback = value == 'localhost'
+    if not loopback:
+        raise click.BadParameter(
+            "'{}' is not a loopback address. The service does not "
+            "authenticate clients.".format(value))
+    return value
+
+
+@click.command(name='serve')
+@click.option('--socket',
+              'socket_path',
+              help='Listen on the Unix socket PATH, which only the current '
+              'user can connect to, instead of --host and --port.',
+              type=click.Path(dir_okay=False))
+@click.option('--host',
+              help='Loopback address to listen on. Default: 127.0.0.1.',
+              default='127.0.0.1',
+              callback=validate_loopback)
+@click.option('--port',
+              help='Port to listen on. Default: 8181.',
+              type=click.IntRange(min=0, max=65535),
+              default=8181)
+@click.option('-d',
+              '--ca-directory',
+              help='Artifact directory generated with --keep-root-key whose '
+              'root issues the certificates. Without it a new root is '
+              'created, which is only kept in memory.',
+              type=click.Path(exists=True, file_okay=False),
+              callback=lambda ctx, param, value: None if value is None else
+              validate_artifact_dir(ctx, param, value))
+@key_options
+@validity_option
+@click.option(
+    '--store-backend',
+    help='How to create the jks keystores. Default: native.',
+    type=click.Choice(BACKENDS),
+    default='native')
+@click.option('--prefetch',
+              help='Number of keys generated ahead of time. Default: '
+              '16.',
+              type=click.IntRange(min=1),
+              default=16)
+@click.option('--max-concurrency',
+              help='Number of nodes issued at the same time. Defaults to the '
+              'number of CPUs.',
+              type=click.IntRange(min=1),
+              default=default_jobs)
+@click.option('--queue-timeout',
+              help='Seconds a request waits for a free slot before it is '
+              'rejected with status 503. Default: 5.',
+              type=click.FloatRange(min=0),
+              default=5.0)
+def serve(socket_path, host, port, ca_directory, key_type, key_size,
+          validity_days, store_backend, prefetch, max_concurrency,
+          queue_timeout):
+    """
+    Runs a local HTTP service issuing node artifacts. The root is kept in
+    memory and keys are generated in the background, so artifacts are
+    returned with low latency. `POST /nodes/NODE` issues the artifacts of a
+    node, `GET /metrics` returns request latencies.
+    """
+    from .ensemble import create_root
+    from .server import IssuingService, MemoryKeyPool, make_server
+
+    if socket_path is not None and os.path.lexists(socket_path):
+        raise click.BadParameter(
+            "'{}' already exists.".format(socket_path), param_hint='--socket')
+    key_type, key_size = validate_key_options(key_type, key_size)
+    if ca_directory is not None:
+        check_root_key(ca_directory, '--ca-directory', 'serve them')
+        root, truststore = load_root_directory(ca_directory, store_backend)
+    else:
+        root, truststore = create_root(key_type, key_size, validity_days,
+                                       store_backend)
+
+    pool = MemoryKeyPool(key_type, key_size, prefetch)
+    service = IssuingService(root, truststore, pool, key_type, key_size,
+                             validity_days, store_backend, max_concurrency,
+                             queue_timeout, ca_directory)
+    server = make_server(service, host, port, socket_path)
+    pool.start()
+    if socket_path is not None:
+        click.echo('Listening on {}'.format(socket_path), err=True)
+    else:
+        click.echo('Listening on http://{}:{}/'.format(
+            *server.server_address[:2]), err=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.stop()
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    Group which invokes `default_command` if the first argument is not the
+    name of a subcommand. This keeps `exhibitor-tls-artifacts NODES...`
+    working next to the subcommands.
+    """
+
+    def __init__(self, *args, default_command=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] != '--help'):
+            args = [self.default_command] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(name='exhibitor-tls-artifacts',
+             cls=DefaultCommandGroup,
+             default_command='generate')
+def cli():
+    """
+    Generates and manages Admin Router and Exhibitor TLS artifacts. Without a
+    COMMAND, `generate` is run.
+    """
+
+
+cli.add_command(app, name='generate')
+cli.add_command(add_nodes)
+cli.add_command(remove_nodes)
+cli.add_command(renew_command)
+cli.add_command(revoke_command)
+cli.add_command(verify_command)
+cli.add_command(serve)
+cli.add_command(recover)
+cli.add_command(batch_command)
+cli.add_command(create_csrs)
+cli.add_command(sign_csrs)
+cli.add_command(build_stores_command)
+cli.add_command(bench_handshake)
+
+
+@cli.group()
+def keypool():
+    """
+    Manages a pool of pre-generated private keys.
+    """
+
+
+@keypool.command()
+@click.option('-n',
+              '--count',
+              help='Number of keys to generate.',
+              type=click.IntRange(min=1),
+              required=True)
+@click.option('-p',
+              '--pool-directory',
+              help='Directory of the key pool. It is created with mode 0700.',
+              default='./keypool/',
+              type=click.Path(file_okay=False))
+@click.option('-j',
+              '--jobs',
+              help='Number of keys to generate in parallel. Defaults to the '
+              'number of CPUs.',
+              type=click.IntRange(min=1),
+              default=default_jobs)
+@key_options
+def fill(count, pool_directory, jobs, key_type, key_size):
+    """
+    Generates private keys into the key pool. Keys can be used by concurrent
+    runs as soon as they are written, so this can run in the background.
+    Keys left claimed by runs which crashed are put back into the pool.
+    """
+    from .keypool import KeyPool, KeyPoolError
+
+    key_type, key_size = validate_key_options(key_type, key_size)
+    pool = KeyPool(pool_directory, key_size, key_type)
+    try:
+        pool.fill(count, jobs)
+    except KeyPoolError as e:
+        raise click.BadParameter(str(e), param_hint='--pool-directory')
+    report_reclaimed(pool)
+    click.echo('Key pool {} contains {} keys.'.format(pool_directory,
+                                                      pool.size()))
+
+
+@keypool.command()
+@click.option('-p',
+              '--pool-directory',
+              help='Directory of the key pool.',
+              default='./keypool/',
+              type=click.Path(file_okay=False))
+@key_options
+def status(pool_directory, key_type, key_size):
+    """
+    Shows the number of keys in the key pool. Keys left claimed by runs which
+    crashed are put back into the pool.
+    """
+    from .keypool import KeyPool
+
+    key_type, key_size = validate_key_options(key_type, key_size)
+    pool = KeyPool(pool_directory, key_size, key_type)
+    report_reclaimed(pool)
+    click.echo('Key pool {} contains {} keys.'.format(pool_directory,
+                                                      pool.size()))
 
 
 if __name__ == '__main__':
-    app()
+    cli()
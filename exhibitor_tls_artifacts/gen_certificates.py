@@ -2,14 +2,306 @@ import datetime
 import os
 import ipaddress
 
+from collections import namedtuple
 from pathlib import Path
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.primitives import hashes
+from .timings import span
+
+# `cryptography` is imported by the functions using it, so that `--help` and
+# argument validation do not pay for loading it.
+
+KEY_TYPES = ('rsa', 'ecdsa', 'ed25519')
+DEFAULT_KEY_SIZES = {'rsa': 4096, 'ecdsa': 256, 'ed25519': None}
+# Names of the `cryptography.hazmat.primitives.asymmetric.ec` curves.
+EC_CURVES = {256: 'SECP256R1', 384: 'SECP384R1'}
+MIN_RSA_KEY_SIZE = 2048
+DEFAULT_VALIDITY_DAYS = 10 * 365
+
+PEM_CERT_END = b'-----END CERTIFICATE-----'
+
+CertifiedKey = namedtuple('CertifiedKey', ['name', 'key', 'cert', 'chain'])
+CertifiedKey.__new__.__defaults__ = ((), )
+CertifiedKey.__doc__ = """
+Private key and the certificate issued for it. `name` is the certificate name
+without the `-cert` suffix, e.g. `root`, `intermediate`, `client` or
+`server`. `chain` holds the certificates of the issuers up to and including
+the root, it is empty for the root itself.
+"""
+
+
+def key_spec(key_type='rsa', key_size=None):
+    """
+    Validates a key type and size combination.
+
+    Args:
+        key_type: One of `KEY_TYPES`.
+        key_size: RSA modulus size in bits, ECDSA curve size (`256` for
+        P-256, `384` for P-384) or `None` for the default size of the key
+        type. Ed25519 keys do not have a size.
+
+    Returns:
+        (key_type, key_size) tuple with the default size filled in.
+    """
+    if key_type not in KEY_TYPES:
+        raise ValueError('Unknown key type: {}'.format(key_type))
+
+    if key_size is None:
+        return key_type, DEFAULT_KEY_SIZES[key_type]
+
+    if key_type == 'rsa' and key_size < MIN_RSA_KEY_SIZE:
+        raise ValueError('RSA keys must have at least {} bits'.format(
+            MIN_RSA_KEY_SIZE))
+    if key_type == 'ecdsa' and key_size not in EC_CURVES:
+        raise ValueError('ECDSA keys must have one of the sizes {}'.format(
+            ', '.join(str(size) for size in sorted(EC_CURVES))))
+    if key_type == 'ed25519':
+        raise ValueError('Ed25519 keys do not have a configurable size')
+
+    return key_type, key_size
+
+
+def generate_private_key(key_size=4096, key_type='rsa'):
+    """
+    Generates a private key of the given type and size.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if key_type == 'rsa':
+        return rsa.generate_private_key(public_exponent=65537,
+                                        key_size=key_size,
+                                        backend=default_backend())
+    if key_type == 'ecdsa':
+        return ec.generate_private_key(getattr(ec, EC_CURVES[key_size])(),
+                                       default_backend())
+    if key_type == 'ed25519':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError('Unknown key type: {}'.format(key_type))
+
+
+def key_spec_of(key):
+    """
+    (key_type, key_size) of a private or public key, see `key_spec`.
+    """
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'rsa', key.key_size
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return 'ecdsa', key.curve.key_size
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'ed25519', None
+    raise ValueError('Unsupported key: {!r}'.format(key))
+
+
+def not_valid_before(cert):
+    """ Start of the validity of `cert` as naive UTC datetime. """
+    try:
+        return cert.not_valid_before_utc.replace(tzinfo=None)
+    except AttributeError:
+        return cert.not_valid_before
+
+
+def not_valid_after(cert):
+    """ Expiry of `cert` as naive UTC datetime. """
+    try:
+        return cert.not_valid_after_utc.replace(tzinfo=None)
+    except AttributeError:
+        return cert.not_valid_after
+
+
+def subject_alternative_names(cert):
+    """
+    DNS names and IP addresses of `cert` as strings, empty if it has no
+    subject alternative names, like most external root CAs.
+    """
+    from cryptography import x509
+
+    try:
+        sa_names = cert.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value
+    except x509.ExtensionNotFound:
+        return []
+    return sa_names.get_values_for_type(x509.DNSName) + [
+        str(ip) for ip in sa_names.get_values_for_type(x509.IPAddress)
+    ]
+
+
+def subject_fields(cert):
+    """
+    `CertificateGenerator` keyword arguments reproducing the subject of
+    `cert`, apart from its common name.
+    """
+    from cryptography.x509.oid import NameOID
+
+    fields = {
+        'country': NameOID.COUNTRY_NAME,
+        'state': NameOID.STATE_OR_PROVINCE_NAME,
+        'locality': NameOID.LOCALITY_NAME,
+        'organization': NameOID.ORGANIZATION_NAME,
+    }
+    kwargs = {}
+    for field, oid in fields.items():
+        attributes = cert.subject.get_attributes_for_oid(oid)
+        if attributes:
+            kwargs[field] = attributes[0].value
+    return kwargs
+
+
+def verify_signature(cert, issuer_public_key):
+    """
+    Verifies that `cert` was signed by the key of `issuer_public_key`.
+
+    Raises:
+        cryptography.exceptions.InvalidSignature
+    """
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+
+    if isinstance(issuer_public_key, rsa.RSAPublicKey):
+        issuer_public_key.verify(cert.signature, cert.tbs_certificate_bytes,
+                                 padding.PKCS1v15(),
+                                 cert.signature_hash_algorithm)
+    elif isinstance(issuer_public_key, ec.EllipticCurvePublicKey):
+        issuer_public_key.verify(cert.signature, cert.tbs_certificate_bytes,
+                                 ec.ECDSA(cert.signature_hash_algorithm))
+    else:
+        issuer_public_key.verify(cert.signature, cert.tbs_certificate_bytes)
+
+
+def public_key_der(key):
+    """ `DER` encoded public key of a private or public key. """
+    from cryptography.hazmat.primitives import serialization
+
+    if hasattr(key, 'public_key'):
+        key = key.public_key()
+    return key.public_bytes(serialization.Encoding.DER,
+                            serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def signature_hash(key):
+    """
+    Hash algorithm to sign certificates with `key`. Ed25519 signatures
+    include the hash, so `None` is returned for Ed25519 keys.
+    """
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return None
+    if isinstance(key, ec.EllipticCurvePrivateKey) and key.key_size > 256:
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def cert_pem(cert):
+    """ Serializes a certificate to `pem`. """
+    from cryptography.hazmat.primitives import serialization
+
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+
+def key_pem(key, password=None):
+    """ Serializes a private key to `pem`, optionally encrypted. """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    if password is None:
+        encryption = serialization.NoEncryption()
+    else:
+        encryption = serialization.BestAvailableEncryption(password)
+
+    # Ed25519 keys can only be serialized as `PKCS#8`.
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        key_format = serialization.PrivateFormat.PKCS8
+    else:
+        key_format = serialization.PrivateFormat.TraditionalOpenSSL
+
+    return key.private_bytes(encoding=serialization.Encoding.PEM,
+                             format=key_format,
+                             encryption_algorithm=encryption)
+
+
+def load_pem_chain(data):
+    """
+    Parses all `pem` certificates of `data`, in order.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+
+    return [
+        x509.load_pem_x509_certificate(block + PEM_CERT_END,
+                                       default_backend())
+        for block in bytes(data).split(PEM_CERT_END)[:-1]
+    ]
+
+
+def chain_pem(certified_key):
+    """
+    Serializes the certificate of a `CertifiedKey` followed by its chain.
+    """
+    return b''.join(
+        cert_pem(cert)
+        for cert in (certified_key.cert, ) + tuple(certified_key.chain))
+
+
+def presented_chain(certified_key):
+    """
+    Certificate of a `CertifiedKey` followed by the intermediate certificates
+    linking it to the root, as presented to peers. The root itself is only
+    part of the truststores.
+    """
+    return [certified_key.cert] + list(certified_key.chain[:-1])
+
+
+def store_chain(certified_key):
+    """
+    Certificates put in the keystore of a `CertifiedKey`: only its
+    certificate if the root issued it, otherwise its whole chain including
+    the root, which `openssl pkcs12 -chain` needs to build the chain.
+    """
+    if len(certified_key.chain) > 1:
+        return [certified_key.cert] + list(certified_key.chain)
+    return [certified_key.cert]
+
+
+def root_cert_of(certified_key):
+    """ Root certificate at the end of the chain of a `CertifiedKey`. """
+    if certified_key.chain:
+        return certified_key.chain[-1]
+    return certified_key.cert
+
+
+def verify_chain(certs, root_cert):
+    """
+    Verifies that every certificate of `certs` was signed by the next one
+    and the last one by `root_cert`.
+
+    Raises:
+        cryptography.exceptions.InvalidSignature
+    """
+    from cryptography.exceptions import InvalidSignature
+
+    for cert, issuer in zip(certs, list(certs[1:]) + [root_cert]):
+        if cert.issuer != issuer.subject:
+            raise InvalidSignature()
+        verify_signature(cert, issuer.public_key())
+
+
+def load_certified_key(name, cert_data, key_data, password=None):
+    """
+    Parses a `pem` certificate, optionally followed by its chain, and key
+    into a `CertifiedKey`.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    certs = load_pem_chain(cert_data)
+    if not certs:
+        raise ValueError('No certificate found for {}'.format(name))
+    key = serialization.load_pem_private_key(data=bytes(key_data),
+                                             password=password,
+                                             backend=default_backend())
+    return CertifiedKey(name, key, certs[0], tuple(certs[1:]))
 
 
 class CertificateGenerator:
@@ -18,19 +310,30 @@ class CertificateGenerator:
     """
 
     def __init__(self,
-                 artifact_dir,
+                 artifact_dir='',
                  country='US',
                  state='CA',
                  locality='San Francisco',
-                 organization='Mesosphere'):
+                 organization='Mesosphere',
+                 key_pool=None,
+                 key_type='rsa',
+                 key_size=None,
+                 validity_days=DEFAULT_VALIDITY_DAYS):
         # This adds trailing / to the path
         self.artifact_dir = os.path.join(artifact_dir, '')
         self.country = country
         self.state = state
         self.locality = locality
         self.organization = organization
+        # Optional `KeyPool` to take pre-generated keys from.
+        self.key_pool = key_pool
+        self.key_type, self.key_size = key_spec(key_type, key_size)
+        self.validity = datetime.timedelta(days=validity_days)
 
     def load_cert(self, cert_path):
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+
         with open(cert_path, "rb") as f:
             cert_data = f.read()
             cert = x509.load_pem_x509_certificate(cert_data, default_backend())
@@ -39,10 +342,13 @@ class CertificateGenerator:
 
     def __store_cert(self, cert, cert_path):
         cert_path.parent.mkdir(mode=0o755, exist_ok=True)
-        with open(cert_path, 'wb') as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        with span('pem', cert_path.name), open(cert_path, 'wb') as f:
+            f.write(cert_pem(cert))
 
     def load_key(self, key_path, password=None):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+
         with open(key_path, "rb") as f:
             key_data = f.read()
             key = serialization.load_pem_private_key(data=bytes(key_data),
@@ -53,88 +359,125 @@ class CertificateGenerator:
 
     def __store_key(self, key, key_path, password=None):
         key_path.parent.mkdir(mode=0o755, exist_ok=True)
-        if password is None:
-            encryption = serialization.NoEncryption()
-        else:
-            encryption = serialization.BestAvailableEncryption(password)
-
-        with open(key_path, 'wb') as f:
-            f.write(
-                key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.TraditionalOpenSSL,
-                    encryption_algorithm=encryption))
+        with span('pem', key_path.name), open(key_path, 'wb') as f:
+            f.write(key_pem(key, password))
 
         os.chmod(key_path, 0o600)
 
-    def get_cert(self,
-                 cert_name='entity',
-                 node_cert_path='',
-                 key_pass=None,
-                 sa_names=None,
-                 issuer=None):
+    def generate_key(self):
+        """
+        Returns a new private key, taken from the key pool if there is one.
         """
-        Creates self signed CA certificates or end-entity certificates.
+        if self.key_pool is not None:
+            return self.key_pool.get_key()
+        return generate_private_key(self.key_size, self.key_type)
+
+    def issue(self,
+              cert_name='entity',
+              sa_names=None,
+              issuer=None,
+              key=None,
+              ca=None,
+              subject=None):
+        """
+        Creates a self signed CA certificate, an intermediate CA certificate
+        or an end-entity certificate in memory.
 
         Args:
-            cert_name: Name of the certificate without `-cert` in the name or
-            the `.pem` suffix.
-            node_cert_path: The node specific directory for to store the cert
-            key_pass: Password to use for the certificate key. Default:
-            `None`.
+            cert_name: Name of the certificate, used as its common name.
             sa_names: List of IP addresses or DNS addresses to be used as
-            `Subject Alternative Names` for the certificate. Default:
-            `None`.
-            issuer: (Certificate, Key, Password) triple for the issuer.
-            If none is provided the certificate will be self signed.
-            Default: `None`.
-        """
+            `Subject Alternative Names` for the certificate, `localhost` if
+            `None`, left out if empty. Default: `None`.
+            issuer: `CertifiedKey` of the issuer. If none is provided the
+            certificate will be self signed. Default: `None`.
+            key: Existing private key to certify instead of generating a new
+            one. Default: `None`.
+            ca: Whether the certificate may issue certificates. Defaults to
+            `True` for self signed certificates only. Intermediate CA
+            certificates may only issue end-entity certificates.
+            subject: Existing `x509.Name` to use as the subject instead of
+            the fields of the generator and `cert_name`, e.g. to re-issue a
+            CA certificate without changing its name. Default: `None`.
 
-        cert_file = cert_name + '-cert.pem'
-        key_file = cert_name + '-key.pem'
+        Returns:
+            `CertifiedKey` with the key, the new certificate and its chain.
+        """
+        if key is not None:
+            cert_key = key
+        else:
+            with span('keygen', cert_name):
+                cert_key = self.generate_key()
 
-        base_path = Path(self.artifact_dir) / node_cert_path
+        cert = self.certify(cert_name, cert_key.public_key(), sa_names,
+                            issuer, cert_key, ca, subject)
+        chain = () if issuer is None else (issuer.cert, ) + tuple(
+            issuer.chain)
+        return CertifiedKey(cert_name, cert_key, cert, chain)
 
-        cert_path = base_path / cert_file
-        key_path = base_path / key_file
+    def certify(self,
+                cert_name,
+                public_key,
+                sa_names=None,
+                issuer=None,
+                key=None,
+                ca=None,
+                subject=None):
+        """
+        Creates a certificate for an existing public key in memory, e.g. the
+        key of a certificate signing request.
 
-        cert_key = rsa.generate_private_key(public_exponent=65537,
-                                            key_size=4096,
-                                            backend=default_backend())
+        Args:
+            cert_name: Name of the certificate, used as its common name.
+            public_key: Public key to certify.
+            sa_names: List of IP addresses or DNS addresses to be used as
+            `Subject Alternative Names` for the certificate, `localhost` if
+            `None`, left out if empty. Default: `None`.
+            issuer: `CertifiedKey` of the issuer. If none is provided the
+            certificate will be self signed with `key`, the private key of
+            `public_key`. Default: `None`.
+            ca: See `issue`.
+            subject: See `issue`.
 
-        self.__store_key(cert_key, key_path, key_pass)
+        Returns:
+            The signed `x509.Certificate`.
+        """
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.x509.oid import NameOID
 
-        cert_subject = x509.Name([
-            x509.NameAttribute(NameOID.COUNTRY_NAME, self.country),
-            x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, self.state),
-            x509.NameAttribute(NameOID.LOCALITY_NAME, self.locality),
-            x509.NameAttribute(NameOID.ORGANIZATION_NAME, self.organization),
-            x509.NameAttribute(NameOID.COMMON_NAME, cert_name),
-        ])
+        cert_subject = subject
+        if cert_subject is None:
+            cert_subject = x509.Name([
+                x509.NameAttribute(NameOID.COUNTRY_NAME, self.country),
+                x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME,
+                                   self.state),
+                x509.NameAttribute(NameOID.LOCALITY_NAME, self.locality),
+                x509.NameAttribute(NameOID.ORGANIZATION_NAME,
+                                   self.organization),
+                x509.NameAttribute(NameOID.COMMON_NAME, cert_name),
+            ])
 
         if sa_names is None:
             sa_names = ['localhost']
 
         if issuer is not None:
-            issuer_cert = self.load_cert(issuer[0])
-            cert_issuer_subject = issuer_cert.subject
-            issuer_key = self.load_key(issuer[1],
-                                       issuer[2] if len(issuer) > 2 else None)
+            cert_issuer_subject = issuer.cert.subject
+            issuer_key = issuer.key
         else:
             cert_issuer_subject = cert_subject
-            issuer_key = cert_key
+            issuer_key = key
 
         cert = x509.CertificateBuilder().subject_name(cert_subject).issuer_name(
-            cert_issuer_subject).public_key(
-                cert_key.public_key()).serial_number(
-                    x509.random_serial_number()).not_valid_before(
-                        datetime.datetime.utcnow()).not_valid_after(
-                            datetime.datetime.utcnow() +
-                            datetime.timedelta(days=10 * 365))
+            cert_issuer_subject).public_key(public_key).serial_number(
+                x509.random_serial_number()).not_valid_before(
+                    datetime.datetime.utcnow()).not_valid_after(
+                        datetime.datetime.utcnow() + self.validity)
 
+        if ca is None:
+            ca = issuer is None
         cert = cert.add_extension(
-            x509.BasicConstraints(ca=True if issuer is None else False,
-                                  path_length=None),
+            x509.BasicConstraints(ca=ca,
+                                  path_length=0 if ca and issuer else None),
             critical=True,
         )
 
@@ -146,13 +489,59 @@ class CertificateGenerator:
             except ValueError:
                 converted_names.append(x509.DNSName(name))
 
-        cert = cert.add_extension(
-            x509.SubjectAlternativeName(converted_names),
-            critical=True,
-        )
+        # An empty extension is invalid, e.g. for re-signed root CAs which
+        # had none.
+        if converted_names:
+            cert = cert.add_extension(
+                x509.SubjectAlternativeName(converted_names),
+                critical=True,
+            )
+
+        with span('sign', cert_name):
+            return cert.sign(issuer_key, signature_hash(issuer_key),
+                             default_backend())
+
+    def get_cert(self,
+                 cert_name='entity',
+                 node_cert_path='',
+                 key_pass=None,
+                 sa_names=None,
+                 issuer=None):
+        """
+        Creates self signed CA certificates or end-entity certificates and
+        stores them as `pem` files.
+
+        Args:
+            cert_name: Name of the certificate without `-cert` in the name or
+            the `.pem` suffix.
+            node_cert_path: The node specific directory for to store the cert
+            key_pass: Password to use for the certificate key. Default:
+            `None`.
+            sa_names: List of IP addresses or DNS addresses to be used as
+            `Subject Alternative Names` for the certificate. Default:
+            `None`.
+            issuer: (Certificate, Key, Password) triple for the issuer.
+            If none is provided the certificate will be self signed.
+            Default: `None`.
+        """
+
+        cert_file = cert_name + '-cert.pem'
+        key_file = cert_name + '-key.pem'
+
+        base_path = Path(self.artifact_dir) / node_cert_path
+
+        cert_path = base_path / cert_file
+        key_path = base_path / key_file
+
+        if issuer is not None:
+            issuer = CertifiedKey(
+                None, self.load_key(issuer[1],
+                                    issuer[2] if len(issuer) > 2 else None),
+                self.load_cert(issuer[0]))
 
-        cert = cert.sign(issuer_key, hashes.SHA256(), default_backend())
+        certified_key = self.issue(cert_name, sa_names, issuer)
 
-        self.__store_cert(cert, cert_path)
+        self.__store_key(certified_key.key, key_path, key_pass)
+        self.__store_cert(certified_key.cert, cert_path)
 
         return cert_path, key_path
@@ -3,18 +3,219 @@ import logging
 from pathlib import Path
 
 from subprocess import Popen, PIPE
+from tempfile import TemporaryDirectory
+
+# `asyncio` and `cryptography` are imported by the functions using them, see
+# `gen_certificates`.
+
+from . import jks
+from .gen_certificates import cert_pem, key_pem, load_pem_chain
+from .timings import node_label, span
 
 log = logging.getLogger(__name__)
 
+# `native` serializes the keystores in-process, `keytool` shells out to
+# `openssl` and the Java `keytool`.
+BACKENDS = ('native', 'keytool')
+
+DEFAULT_PASSWORD = 'not-relevant-for-security'
+
+
+def load_pem_certs(cert_path):
+    """
+    Loads all `pem` certificates found in `cert_path`, in file order.
+    """
+    with open(str(cert_path), 'rb') as f:
+        certs = load_pem_chain(f.read())
+    if not certs:
+        raise ValueError('No certificate found in {}'.format(cert_path))
+    return certs
+
+
+def pkcs12_command(cert_path, key_path, pkcs12_path, alias, password,
+                   chain=False):
+    """ `openssl` command exporting a certificate and key as `pkcs12`. """
+    cmd = [
+        'openssl', 'pkcs12', '-export', '-in',
+        str(cert_path), '-inkey',
+        str(key_path), '-out',
+        str(pkcs12_path), '-name', alias, '-passout', 'pass:' + password
+    ]
+    if chain:
+        cmd.extend(['-CAfile', str(cert_path), '-chain'])
+    return cmd
+
+
+def import_keystore_command(pkcs12_path, store_path, alias, password):
+    """ `keytool` command converting a `pkcs12` keystore to `jks`. """
+    return [
+        'keytool', '-importkeystore', '-destkeystore',
+        str(store_path), '-deststoretype', 'jks', '-srckeystore',
+        str(pkcs12_path), '-srcstoretype', 'pkcs12', '-alias', alias,
+        '-srcstorepass', password, '-deststorepass', password, '-noprompt'
+    ]
+
+
+async def run_command(cmd):
+    """
+    Runs `cmd` without blocking the event loop.
+
+    Raises:
+        Exception with the output of `cmd` if it fails.
+    """
+    import asyncio
+
+    proc = await asyncio.create_subprocess_exec(*cmd,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise Exception('{}{}'.format(stdout.decode(), stderr.decode()))
+
 
 class KeystoreGenerator:
     """
     Generate `jks` keystores from `pem` certificate files.
     """
 
-    def __init__(self, artifact_dir):
+    def __init__(self, artifact_dir='', backend='native', key_type='rsa'):
         # Directory where the artifacts, certificates are stored.
         self.artifact_dir = os.path.join(artifact_dir, '')
+        if backend not in BACKENDS:
+            raise ValueError('Unknown keystore backend: {}'.format(backend))
+        self.backend = backend
+        # Type of the keys put in entity stores, see `gen_certificates`.
+        self.key_type = key_type
+        if key_type == 'ed25519':
+            log.warning('Keystores with Ed25519 keys can only be loaded by '
+                        'Java 15 or newer.')
+
+    def build_truststore(self, trusted_certs, password=DEFAULT_PASSWORD):
+        """
+        Generate `jks` truststore in memory.
+
+        Args:
+            trusted_certs: List of (alias, certificate) pairs to be placed in
+            the truststore.
+            password: Password to be used for the keystore. Default:
+            `not-relevant-for-security`.
+
+        Returns:
+            The truststore as bytes.
+        """
+        if self.backend == 'native':
+            from cryptography.hazmat.primitives import serialization
+
+            entries = [
+                jks.TrustedCertEntry(
+                    alias, jks.now(),
+                    cert.public_bytes(serialization.Encoding.DER))
+                for alias, cert in trusted_certs
+            ]
+            with span('jks', 'truststore.jks'):
+                return jks.dumps(entries, password)
+
+        # `keytool` only works on files, which are kept out of the artifact
+        # directory.
+        with TemporaryDirectory() as tmp_dir:
+            cert_paths = []
+            for alias, cert in trusted_certs:
+                cert_path = os.path.join(tmp_dir, alias + '.pem')
+                with open(cert_path, 'wb') as f:
+                    f.write(cert_pem(cert))
+                cert_paths.append(cert_path)
+
+            store_path = KeystoreGenerator(tmp_dir, 'keytool').create_truststore(
+                cert_paths, password=password)
+            with open(store_path, 'rb') as f:
+                return f.read()
+
+    def build_entitystore(self,
+                          alias,
+                          key,
+                          cert_chain,
+                          store_password=DEFAULT_PASSWORD):
+        """
+        Generate `jks` entitystore in memory.
+
+        Args:
+            alias: Alias of the key entry.
+            key: Private key to be put in the keystore.
+            cert_chain: List of certificates, starting with the certificate
+            of `key`.
+            store_password: Password to be used for the keystore. Default:
+            `not-relevant-for-security`.
+
+        Returns:
+            The keystore as bytes.
+        """
+        if self.backend == 'native':
+            from cryptography.hazmat.primitives import serialization
+
+            with span('jks', alias):
+                entry = jks.PrivateKeyEntry(
+                    alias, jks.now(),
+                    key.private_bytes(
+                        encoding=serialization.Encoding.DER,
+                        format=serialization.PrivateFormat.PKCS8,
+                        encryption_algorithm=serialization.NoEncryption()),
+                    [cert.public_bytes(serialization.Encoding.DER)
+                     for cert in cert_chain])
+                return jks.dumps([entry], store_password)
+
+        with TemporaryDirectory() as tmp_dir:
+            cert_path = Path(tmp_dir) / (alias + '.pem')
+            key_path = Path(tmp_dir) / (alias + '-key.pem')
+            cert_path.write_bytes(b''.join(cert_pem(cert)
+                                           for cert in cert_chain))
+            key_path.write_bytes(key_pem(key))
+
+            store_path = KeystoreGenerator(
+                tmp_dir, 'keytool').create_entitystore(
+                    cert_path,
+                    key_path,
+                    chain=len(cert_chain) > 1,
+                    store_password=store_password)
+            return store_path.read_bytes()
+
+    async def build_entitystore_async(self,
+                                      alias,
+                                      key,
+                                      cert_chain,
+                                      store_password=DEFAULT_PASSWORD,
+                                      node=None):
+        """
+        Like `build_entitystore`, but runs `openssl` and `keytool` as
+        asynchronous subprocesses so that the event loop can make progress
+        while they run. `node` labels the timing spans.
+
+        Returns:
+            The keystore as bytes.
+        """
+        if self.backend == 'native':
+            with node_label(node):
+                return self.build_entitystore(alias, key, cert_chain,
+                                              store_password)
+
+        with TemporaryDirectory() as tmp_dir:
+            cert_path = Path(tmp_dir) / (alias + '.pem')
+            key_path = Path(tmp_dir) / (alias + '-key.pem')
+            pkcs12_path = Path(tmp_dir) / (alias + '.p12')
+            store_path = Path(tmp_dir) / (alias + '.jks')
+            with span('pem', alias, node=node):
+                cert_path.write_bytes(b''.join(cert_pem(cert)
+                                               for cert in cert_chain))
+                key_path.write_bytes(key_pem(key))
+
+            with span('openssl pkcs12', alias, node=node):
+                await run_command(
+                    pkcs12_command(cert_path, key_path, pkcs12_path, alias,
+                                   store_password, len(cert_chain) > 1))
+            with span('keytool', alias, node=node):
+                await run_command(
+                    import_keystore_command(pkcs12_path, store_path, alias,
+                                            store_password))
+            return store_path.read_bytes()
 
     def create_truststore(self,
                           trusted_cert_paths,
@@ -35,18 +236,34 @@ class KeystoreGenerator:
         """
         store_path = self.artifact_dir + name + '.jks'
 
+        if self.backend == 'native':
+            trusted_certs = [
+                (os.path.splitext(os.path.basename(cert_path))[0],
+                 load_pem_certs(cert_path)[0])
+                for cert_path in trusted_cert_paths
+            ]
+
+            log.info('Creating Java TrustStore: {}'.format(store_path))
+            with open(store_path, 'wb') as f:
+                f.write(self.build_truststore(trusted_certs, password))
+
+            os.chmod(store_path, 0o600)
+            return store_path
+
         for cert_path in trusted_cert_paths:
             alias = os.path.splitext(os.path.basename(cert_path))[0]
             cmd = [
                 'keytool', '-keystore',
-                str(store_path), '-import', '-alias', alias, '-file',
+                str(store_path), '-storetype', 'jks', '-import', '-alias',
+                alias, '-file',
                 str(cert_path), '-trustcacerts', '-storepass', password,
                 '-noprompt'
             ]
 
             log.info('Creating Java TrustStore: {}'.format(' '.join(cmd)))
-            proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
-            stdout, stderr = proc.communicate()
+            with span('keytool', name + '.jks'):
+                proc = Popen(cmd, shell=False, stderr=PIPE, stdout=PIPE)
+                stdout, stderr = proc.communicate()
             if proc.wait() != 0:
                 raise Exception('{}{}'.format(stdout.decode(), stderr.decode()))
 
@@ -87,38 +304,37 @@ class KeystoreGenerator:
         pkcs12_store_path = Path(str(java_store_path) + '.p12')  # trust.jks.p12
         certificate_alias = cert_path.name.split('.')[0]
 
-        pkcs12_cmd = [
-            'openssl', 'pkcs12', '-export', '-in',
-            str(cert_path), '-inkey',
-            str(key_path), '-out',
-            str(pkcs12_store_path), '-name', certificate_alias, '-passout',
-            'pass:' + store_password
-        ]
+        if self.backend == 'native':
+            self.__write_native_entitystore(cert_path, key_path,
+                                            java_store_path,
+                                            certificate_alias, chain,
+                                            store_password)
+            java_store_path.chmod(0o600)
+            return java_store_path
 
-        if chain:
-            pkcs12_cmd.extend(['-CAfile', str(cert_path), '-chain'])
+        pkcs12_cmd = pkcs12_command(cert_path, key_path, pkcs12_store_path,
+                                    certificate_alias, store_password, chain)
 
         log.info('Creating pkcs12 {} keystore: {}'.format(
             store_name, ' '.join(pkcs12_cmd)))
 
-        proc = Popen(pkcs12_cmd, shell=False, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
+        with span('openssl pkcs12', java_store_file):
+            proc = Popen(pkcs12_cmd, shell=False, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = proc.communicate()
         if proc.wait() != 0:
             raise Exception('{}{}'.format(stdout.decode(), stderr.decode()))
 
-        keystore_cmd = [
-            'keytool', '-importkeystore', '-destkeystore',
-            str(java_store_path), '-srckeystore',
-            str(pkcs12_store_path), '-srcstoretype', 'pkcs12', '-alias',
-            certificate_alias, '-srcstorepass', store_password,
-            '-deststorepass', store_password, '-noprompt'
-        ]
+        keystore_cmd = import_keystore_command(pkcs12_store_path,
+                                               java_store_path,
+                                               certificate_alias,
+                                               store_password)
 
         log.info('Creating jks {} keystore: {}'.format(store_name,
                                                        ' '.join(pkcs12_cmd)))
 
-        proc = Popen(keystore_cmd, shell=False, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
+        with span('keytool', java_store_file):
+            proc = Popen(keystore_cmd, shell=False, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = proc.communicate()
         if proc.wait() != 0:
             raise Exception('{}{}'.format(stdout.decode(), stderr.decode()))
 
@@ -130,3 +346,22 @@ class KeystoreGenerator:
 
         java_store_path.chmod(0o600)
         return java_store_path
+
+    def __write_native_entitystore(self, cert_path, key_path, store_path,
+                                   alias, chain, store_password):
+        certs = load_pem_certs(cert_path)
+        if not chain:
+            certs = certs[:1]
+
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+
+        with open(str(key_path), 'rb') as f:
+            key = serialization.load_pem_private_key(f.read(),
+                                                     password=None,
+                                                     backend=default_backend())
+
+        log.info('Creating jks keystore: {}'.format(store_path))
+        store_path.parent.mkdir(mode=0o755, exist_ok=True)
+        with open(str(store_path), 'wb') as f:
+            f.write(self.build_entitystore(alias, key, certs, store_password))
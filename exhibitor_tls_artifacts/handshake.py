@@ -0,0 +1,257 @@
+"""
+Benchmark of TLS handshakes with the artifacts of a node.
+
+Exhibitor instances talk to each other and Admin Router checks Exhibitor
+over connections which are opened often, so every connection pays for a
+mutually authenticated TLS handshake with the generated certificates. Its
+cost mostly depends on the key type and size.
+
+`bench_node` starts a TLS server on loopback which presents the server
+certificate of `serverstore.jks` and requires a client certificate issued
+by the root. Clients present `client-cert.pem` and verify the server
+against `root-cert.pem` and the subject alternative name `exhibitor`, like
+Admin Router does. A handshake is timed from connecting until the first
+byte sent by the server after it accepted the client certificate arrives,
+so it includes one loopback round trip.
+"""
+import socket
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from . import jks
+from .artifacts import (CERT_MODE, ROOT_CERT_FILE, Artifact, key_artifact,
+                        write_artifacts)
+from .gen_certificates import cert_pem, key_spec_of
+from .gen_stores import DEFAULT_PASSWORD
+from .server import PERCENTILES, percentile
+
+DEFAULT_HANDSHAKES = 200
+# Name Admin Router connects to, see `SANS`.
+SERVER_NAME = 'exhibitor'
+HOST = '127.0.0.1'
+# Sent by the server once the handshake is complete.
+READY = b'.'
+
+HandshakeReport = namedtuple('HandshakeReport', [
+    'name', 'key_type', 'key_size', 'protocol', 'resumed', 'handshakes',
+    'errors', 'seconds', 'latency'
+])
+HandshakeReport.__doc__ = """
+Result of `bench_node`. `latency` maps `mean`, `max` and the percentiles of
+`PERCENTILES`, e.g. `p50`, to the handshake latency in seconds. `resumed` is
+the number of handshakes which resumed the session of the first one.
+"""
+
+TLSFiles = namedtuple('TLSFiles', [
+    'server_cert', 'server_key', 'client_cert', 'client_key', 'root_cert'
+])
+TLSFiles.__doc__ = """
+Paths of the `pem` files of a node as the `ssl` module loads them.
+"""
+
+
+def write_server_files(node_path, directory):
+    """
+    Writes the server certificate, followed by its chain, and the server key
+    of `serverstore.jks` of a node to `directory` as `pem`, since `ssl`
+    cannot read keystores.
+
+    Returns:
+        `TLSFiles` of the node.
+    """
+    node_path = Path(node_path)
+    entry = jks.loads((node_path / 'serverstore.jks').read_bytes(),
+                      DEFAULT_PASSWORD)[0]
+    key = serialization.load_der_private_key(entry.key, None,
+                                             default_backend())
+    chain = b''.join(
+        cert_pem(x509.load_der_x509_certificate(der, default_backend()))
+        for der in entry.cert_chain)
+    write_artifacts(directory, [
+        Artifact('server-cert.pem', chain, CERT_MODE),
+        key_artifact('server-key.pem', key),
+    ])
+    return TLSFiles(
+        str(Path(directory) / 'server-cert.pem'),
+        str(Path(directory) / 'server-key.pem'),
+        str(node_path / 'client-cert.pem'),
+        str(node_path / 'client-key.pem'),
+        str(node_path / ROOT_CERT_FILE))
+
+
+def server_context(files):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.load_verify_locations(files.root_cert)
+    context.load_cert_chain(files.server_cert, files.server_key)
+    return context
+
+
+def client_context(files):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(files.root_cert)
+    context.load_cert_chain(files.client_cert, files.client_key)
+    return context
+
+
+class HandshakeHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            with self.server.context.wrap_socket(self.request,
+                                                 server_side=True) as conn:
+                conn.sendall(READY)
+                # Wait for the client to close the connection.
+                conn.recv(1)
+        except (ssl.SSLError, OSError):
+            # The client counts the failed handshake.
+            pass
+
+
+class HandshakeServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, context):
+        super().__init__((HOST, 0), HandshakeHandler)
+        self.context = context
+
+
+def handshake(context, port, session=None):
+    """
+    Connects to the server and completes one handshake.
+
+    Returns:
+        (latency in seconds, `SSLSession`, protocol version, whether the
+        session was resumed) tuple.
+
+    Raises:
+        ssl.SSLError, OSError: The handshake failed.
+    """
+    start = time.perf_counter()
+    with socket.create_connection((HOST, port)) as sock:
+        # Handshake messages are small, waiting to coalesce them would
+        # dominate the latency on loopback.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with context.wrap_socket(sock,
+                                 server_hostname=SERVER_NAME,
+                                 session=session) as conn:
+            if conn.recv(1) != READY:
+                raise ssl.SSLError('The server closed the connection.')
+            latency = time.perf_counter() - start
+            return latency, conn.session, conn.version(), conn.session_reused
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    summary = {
+        'mean': sum(latencies) / len(latencies),
+        'max': latencies[-1],
+    }
+    for percent in PERCENTILES:
+        summary['p{}'.format(percent)] = percentile(latencies, percent)
+    return summary
+
+
+def bench_node(node_path, handshakes=DEFAULT_HANDSHAKES, concurrency=1,
+               resume=False, name=None):
+    """
+    Times `handshakes` handshakes with the artifacts of a node directory,
+    `concurrency` at a time. With `resume` clients resume the session of a
+    first handshake, which is not timed, instead of doing full handshakes.
+
+    Returns:
+        `HandshakeReport`, named `name` or after the node directory.
+
+    Raises:
+        ssl.SSLError, OSError: The first handshake failed, e.g. because the
+        certificates do not match.
+    """
+    node_path = Path(node_path)
+    key_type, key_size = key_spec_of(
+        x509.load_pem_x509_certificate(
+            (node_path / 'client-cert.pem').read_bytes(),
+            default_backend()).public_key())
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_server_files(node_path, directory)
+        server = HandshakeServer(server_context(files))
+        context = client_context(files)
+        thread = threading.Thread(target=server.serve_forever,
+                                  name='handshake-server',
+                                  daemon=True)
+        thread.start()
+        try:
+            port = server.server_address[1]
+            _, session, protocol, _ = handshake(context, port)
+            if not resume:
+                session = None
+
+            def run(_):
+                try:
+                    return handshake(context, port, session)
+                except (ssl.SSLError, OSError):
+                    return None
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(run, range(handshakes)))
+            seconds = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    completed = [result for result in results if result is not None]
+    return HandshakeReport(name or node_path.name, key_type, key_size,
+                           protocol,
+                           sum(1 for result in completed if result[3]),
+                           len(completed), handshakes - len(completed),
+                           seconds,
+                           summarize(result[0] for result in completed))
+
+
+def format_reports(reports, output_format='table'):
+    """ Formats `HandshakeReport` as `table` or `json`. """
+    if output_format == 'json':
+        import json
+
+        return json.dumps([
+            dict(report._asdict(),
+                 handshakes_per_second=report.handshakes / report.seconds)
+            for report in reports
+        ], indent=2)
+
+    columns = ['{:>4}'.format('p{}'.format(percent))
+               for percent in PERCENTILES]
+    lines = [
+        '{:<24} {:<12} {:<8} {:>10} {:>7}  {} (ms)'.format(
+            'artifacts', 'key', 'protocol', 'handshakes', 'per sec',
+            ' '.join('{:>7}'.format(column) for column in columns))
+    ]
+    for report in reports:
+        key = report.key_type if report.key_size is None else '{}-{}'.format(
+            report.key_type, report.key_size)
+        lines.append('{:<24} {:<12} {:<8} {:>10} {:>7.0f}  {}'.format(
+            report.name, key, report.protocol, report.handshakes,
+            report.handshakes / report.seconds, ' '.join(
+                '{:>7.2f}'.format(
+                    report.latency.get('p{}'.format(percent), 0) * 1000)
+                for percent in PERCENTILES)))
+        if report.errors:
+            lines[-1] += '  {} failed'.format(report.errors)
+    return '\n'.join(lines)
@@ -0,0 +1,296 @@
+"""
+Minimal implementation of the Java `JKS` keystore format.
+
+Only the parts needed to write and read back the stores generated by this
+package are implemented: trusted certificate entries and private key entries
+protected with the proprietary Sun `KeyProtector` algorithm. This is the
+format written by `keytool` of Java 8, which Exhibitor uses to load its
+keystores.
+"""
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from collections import namedtuple
+
+MAGIC = 0xFEEDFEED
+VERSION = 2
+PRIVATE_KEY_TAG = 1
+TRUSTED_CERT_TAG = 2
+CERT_TYPE = 'X.509'
+
+# Object identifier of the Sun `KeyProtector` algorithm.
+KEY_PROTECTOR_OID = '1.3.6.1.4.1.42.2.17.1.1'
+# Java hashes the keystore password followed by this text to compute the
+# integrity check appended to the keystore.
+INTEGRITY_WHITENER = b'Mighty Aphrodite'
+
+SALT_LEN = 20
+DIGEST_LEN = 20
+
+PrivateKeyEntry = namedtuple('PrivateKeyEntry',
+                             ['alias', 'timestamp', 'key', 'cert_chain'])
+PrivateKeyEntry.__doc__ = """
+`key` is the `DER` encoded `PKCS#8` private key and `cert_chain` a list of
+`DER` encoded certificates, starting with the certificate of the key.
+"""
+
+TrustedCertEntry = namedtuple('TrustedCertEntry',
+                              ['alias', 'timestamp', 'cert'])
+TrustedCertEntry.__doc__ = """
+`cert` is the `DER` encoded trusted certificate.
+"""
+
+
+class KeystoreError(Exception):
+    """ Raised when a keystore cannot be read. """
+
+
+def now():
+    """ Current time in milliseconds since the epoch, as used by Java. """
+    return int(time.time() * 1000)
+
+
+def dumps(entries, password):
+    """
+    Serializes keystore entries to `JKS`.
+
+    Args:
+        entries: List of `PrivateKeyEntry` and `TrustedCertEntry`. Aliases are
+        lower cased just like `keytool` does.
+        password: Password used to protect the private keys and the integrity
+        of the keystore.
+
+    Returns:
+        The keystore as bytes.
+    """
+    password_bytes = _password_bytes(password)
+    aliases = set()
+
+    data = struct.pack('>III', MAGIC, VERSION, len(entries))
+    for entry in entries:
+        alias = entry.alias.lower()
+        if alias in aliases:
+            raise ValueError('Duplicate keystore alias: {}'.format(alias))
+        aliases.add(alias)
+
+        if isinstance(entry, PrivateKeyEntry):
+            protected_key = _encode_encrypted_key(
+                _protect_key(entry.key, password_bytes))
+            data += struct.pack('>I', PRIVATE_KEY_TAG)
+            data += _utf(alias) + struct.pack('>Q', entry.timestamp)
+            data += struct.pack('>I', len(protected_key)) + protected_key
+            data += struct.pack('>I', len(entry.cert_chain))
+            for cert in entry.cert_chain:
+                data += _certificate(cert)
+        elif isinstance(entry, TrustedCertEntry):
+            data += struct.pack('>I', TRUSTED_CERT_TAG)
+            data += _utf(alias) + struct.pack('>Q', entry.timestamp)
+            data += _certificate(entry.cert)
+        else:
+            raise TypeError('Unsupported keystore entry: {!r}'.format(entry))
+
+    return data + _integrity_digest(data, password_bytes)
+
+
+def loads(data, password):
+    """
+    Parses a `JKS` keystore and decrypts its private keys.
+
+    Args:
+        data: The keystore as bytes.
+        password: Password of the keystore.
+
+    Returns:
+        List of `PrivateKeyEntry` and `TrustedCertEntry` in keystore order.
+    """
+    password_bytes = _password_bytes(password)
+
+    if len(data) < 12 + DIGEST_LEN:
+        raise KeystoreError('Keystore is truncated')
+
+    body, digest = data[:-DIGEST_LEN], data[-DIGEST_LEN:]
+    if not hmac.compare_digest(digest,
+                               _integrity_digest(body, password_bytes)):
+        raise KeystoreError(
+            'Keystore was tampered with, or password was incorrect')
+
+    reader = _Reader(body)
+    magic, version, count = reader.unpack('>III')
+    if magic != MAGIC or version != VERSION:
+        raise KeystoreError('Not a JKS keystore')
+
+    entries = []
+    for _ in range(count):
+        tag, = reader.unpack('>I')
+        alias = reader.utf()
+        timestamp, = reader.unpack('>Q')
+        if tag == PRIVATE_KEY_TAG:
+            protected_key = reader.read(reader.unpack('>I')[0])
+            key = _unprotect_key(_decode_encrypted_key(protected_key),
+                                 password_bytes)
+            chain_len, = reader.unpack('>I')
+            chain = [reader.certificate() for _ in range(chain_len)]
+            entries.append(PrivateKeyEntry(alias, timestamp, key, chain))
+        elif tag == TRUSTED_CERT_TAG:
+            entries.append(
+                TrustedCertEntry(alias, timestamp, reader.certificate()))
+        else:
+            raise KeystoreError('Unsupported keystore entry tag: {}'.format(tag))
+
+    if not reader.at_end():
+        raise KeystoreError('Unexpected data after the last keystore entry')
+
+    return entries
+
+
+def _password_bytes(password):
+    # Java passes passwords as `char[]`, which are hashed as UTF-16BE.
+    if isinstance(password, bytes):
+        password = password.decode()
+    return password.encode('utf-16be')
+
+
+def _integrity_digest(data, password_bytes):
+    return hashlib.sha1(password_bytes + INTEGRITY_WHITENER + data).digest()
+
+
+def _utf(text):
+    # Java's modified UTF-8 only differs from UTF-8 for NUL and characters
+    # outside of the BMP, which are not valid in aliases.
+    encoded = text.encode('utf-8')
+    return struct.pack('>H', len(encoded)) + encoded
+
+
+def _certificate(cert):
+    return _utf(CERT_TYPE) + struct.pack('>I', len(cert)) + cert
+
+
+def _keystream(salt, password_bytes, length):
+    stream = b''
+    digest = salt
+    while len(stream) < length:
+        digest = hashlib.sha1(password_bytes + digest).digest()
+        stream += digest
+    return stream[:length]
+
+
+def _protect_key(key, password_bytes):
+    salt = os.urandom(SALT_LEN)
+    stream = _keystream(salt, password_bytes, len(key))
+    encrypted = bytes(k ^ s for k, s in zip(key, stream))
+    check = hashlib.sha1(password_bytes + key).digest()
+    return salt + encrypted + check
+
+
+def _unprotect_key(protected, password_bytes):
+    if len(protected) < SALT_LEN + DIGEST_LEN:
+        raise KeystoreError('Protected key is truncated')
+
+    salt = protected[:SALT_LEN]
+    encrypted = protected[SALT_LEN:-DIGEST_LEN]
+    check = protected[-DIGEST_LEN:]
+    stream = _keystream(salt, password_bytes, len(encrypted))
+    key = bytes(e ^ s for e, s in zip(encrypted, stream))
+    if not hmac.compare_digest(check,
+                               hashlib.sha1(password_bytes + key).digest()):
+        raise KeystoreError('Cannot recover key, password was incorrect')
+    return key
+
+
+# A private key is stored as `DER` encoded `EncryptedPrivateKeyInfo`:
+#
+#   SEQUENCE {
+#     SEQUENCE { OBJECT IDENTIFIER 1.3.6.1.4.1.42.2.17.1.1, NULL }
+#     OCTET STRING <salt || encrypted key || check>
+#   }
+
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        encoded_length = bytes([length])
+    else:
+        length_bytes = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+        encoded_length = bytes([0x80 | len(length_bytes)]) + length_bytes
+    return bytes([tag]) + encoded_length + content
+
+
+def _der_oid(oid):
+    arcs = [int(arc) for arc in oid.split('.')]
+    content = bytes([arcs[0] * 40 + arcs[1]])
+    for arc in arcs[2:]:
+        encoded = [arc & 0x7f]
+        arc >>= 7
+        while arc:
+            encoded.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        content += bytes(encoded)
+    return _der(0x06, content)
+
+
+KEY_PROTECTOR_ALGORITHM = _der(0x30, _der_oid(KEY_PROTECTOR_OID) + b'\x05\x00')
+
+
+def _encode_encrypted_key(protected):
+    return _der(0x30, KEY_PROTECTOR_ALGORITHM + _der(0x04, protected))
+
+
+def _decode_encrypted_key(data):
+    content, rest = _der_read(data, 0x30)
+    if rest:
+        raise KeystoreError('Unexpected data after the protected key')
+    algorithm_len = len(KEY_PROTECTOR_ALGORITHM)
+    if content[:algorithm_len] != KEY_PROTECTOR_ALGORITHM:
+        raise KeystoreError('Unsupported key protection algorithm')
+    protected, rest = _der_read(content[algorithm_len:], 0x04)
+    if rest:
+        raise KeystoreError('Unexpected data in the protected key')
+    return protected
+
+
+def _der_read(data, tag):
+    if len(data) < 2 or data[0] != tag:
+        raise KeystoreError('Malformed protected key')
+
+    length = data[1]
+    offset = 2
+    if length & 0x80:
+        num_bytes = length & 0x7f
+        length = int.from_bytes(data[2:2 + num_bytes], 'big')
+        offset += num_bytes
+
+    if offset + length > len(data):
+        raise KeystoreError('Malformed protected key')
+    return data[offset:offset + length], data[offset + length:]
+
+
+class _Reader:
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, length):
+        if self.offset + length > len(self.data):
+            raise KeystoreError('Keystore is truncated')
+        chunk = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return chunk
+
+    def unpack(self, fmt):
+        return struct.unpack(fmt, self.read(struct.calcsize(fmt)))
+
+    def utf(self):
+        return self.read(self.unpack('>H')[0]).decode('utf-8')
+
+    def certificate(self):
+        cert_type = self.utf()
+        if cert_type != CERT_TYPE:
+            raise KeystoreError(
+                'Unsupported certificate type: {}'.format(cert_type))
+        return self.read(self.unpack('>I')[0])
+
+    def at_end(self):
+        return self.offset == len(self.data)
@@ -0,0 +1,218 @@
+"""
+Spool directory of pre-generated private keys.
+
+Generating private keys, 4096 bit RSA keys in particular, dominates the time
+needed to create the artifacts. `KeyPool.fill` generates keys ahead of time,
+`KeyPool.get_key` hands them out during artifact generation and falls back to
+generating a key when the pool is empty.
+
+Every key is stored in its own file. A key is claimed by atomically renaming
+its file before reading and deleting it, so concurrent consumers never get
+the same key. The claimed name contains the process id of the consumer, so
+that keys claimed by consumers which died before deleting them can be put
+back into the pool by `KeyPool.reclaim`. Keys are written to temporary files
+named after the process id of the writer as well, so that `KeyPool.reclaim`
+can remove the partially written keys of writers which died.
+"""
+import os
+import re
+import stat
+import uuid
+
+# `cryptography` and `concurrent.futures` are imported by the functions using
+# them, see `gen_certificates`.
+
+from .gen_certificates import generate_private_key, key_spec
+from .staging import process_running
+
+KEY_SUFFIX = '.pem'
+TMP_PREFIX = '.tmp-'
+CLAIMED_INFIX = '.claimed-'
+CLAIMED_PATTERN = re.compile(
+    r'^(?P<key>.+' + re.escape(KEY_SUFFIX) + ')' + re.escape(CLAIMED_INFIX) +
+    r'(?:(?P<pid>\d+)-)?[0-9a-f]+$')
+TMP_PATTERN = re.compile(
+    '^' + re.escape(TMP_PREFIX) + r'(?:(?P<pid>\d+)-)?[0-9a-f]+$')
+
+
+class KeyPoolError(Exception):
+    """ Raised when the key pool cannot be used safely. """
+
+
+class KeyPool:
+    """
+    Pool of unencrypted `pem` private keys stored below `pool_dir`. Keys of
+    different types and sizes are kept in separate sub directories.
+    """
+
+    def __init__(self, pool_dir, key_size=None, key_type='rsa'):
+        self.pool_dir = str(pool_dir)
+        self.key_type, self.key_size = key_spec(key_type, key_size)
+        if self.key_size is None:
+            key_dir = self.key_type
+        else:
+            key_dir = '{}-{}'.format(self.key_type, self.key_size)
+        self.key_dir = os.path.join(self.pool_dir, key_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def check(self):
+        """
+        Ensures that the pool directory is only accessible by its owner.
+        """
+        for path in (self.pool_dir, self.key_dir):
+            try:
+                mode = os.stat(path).st_mode
+            except FileNotFoundError:
+                continue
+            if not stat.S_ISDIR(mode):
+                raise KeyPoolError('{} is not a directory'.format(path))
+            if mode & 0o077:
+                raise KeyPoolError(
+                    'Key pool directory {} must not be accessible by group '
+                    'or others (mode {:o})'.format(path, stat.S_IMODE(mode)))
+
+    def size(self):
+        """ Number of keys currently available in the pool. """
+        return len(self.__key_files())
+
+    def fill(self, count, jobs=1):
+        """
+        Generates `count` keys into the pool using up to `jobs` processes.
+        Keys become available to consumers as soon as each one is written.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.check()
+        os.makedirs(self.key_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.pool_dir, 0o700)
+        os.chmod(self.key_dir, 0o700)
+
+        if jobs == 1 or count <= 1:
+            for _ in range(count):
+                add_key(self.key_dir, self.key_size, self.key_type)
+            return
+
+        with ProcessPoolExecutor(max_workers=min(jobs, count)) as executor:
+            for _ in executor.map(add_key, [self.key_dir] * count,
+                                  [self.key_size] * count,
+                                  [self.key_type] * count):
+                pass
+
+    def claim(self):
+        """
+        Removes a key from the pool and returns it.
+
+        Returns:
+            The private key or `None` if the pool is empty.
+        """
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+
+        self.check()
+        for name in self.__key_files():
+            path = os.path.join(self.key_dir, name)
+            claimed_path = '{}{}{}-{}'.format(path, CLAIMED_INFIX,
+                                              os.getpid(),
+                                              uuid.uuid4().hex[:8])
+            try:
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                # Claimed by a concurrent consumer.
+                continue
+
+            try:
+                with open(claimed_path, 'rb') as f:
+                    return serialization.load_pem_private_key(
+                        f.read(), password=None, backend=default_backend())
+            finally:
+                os.remove(claimed_path)
+
+        return None
+
+    def reclaim(self):
+        """
+        Puts keys claimed by consumers which died before deleting them back
+        into the pool and removes the temporary files of writers which died
+        before adding their key. Files of running processes are left alone.
+
+        Returns:
+            Number of keys put back.
+        """
+        try:
+            names = os.listdir(self.key_dir)
+        except FileNotFoundError:
+            return 0
+
+        reclaimed = 0
+        for name in names:
+            match = TMP_PATTERN.match(name)
+            if match is not None:
+                pid = match.group('pid')
+                if pid is None or not process_running(int(pid)):
+                    try:
+                        os.remove(os.path.join(self.key_dir, name))
+                    except FileNotFoundError:
+                        pass
+                continue
+
+            match = CLAIMED_PATTERN.match(name)
+            if match is None:
+                continue
+            pid = match.group('pid')
+            if pid is not None and process_running(int(pid)):
+                continue
+            try:
+                os.rename(os.path.join(self.key_dir, name),
+                          os.path.join(self.key_dir, match.group('key')))
+            except FileNotFoundError:
+                # Reclaimed concurrently.
+                continue
+            reclaimed += 1
+        return reclaimed
+
+    def get_key(self):
+        """
+        Returns a key from the pool or a newly generated one if the pool is
+        empty. `hits` and `misses` count the keys taken from the pool and the
+        keys that had to be generated.
+        """
+        key = self.claim()
+        if key is None:
+            self.misses += 1
+            return generate_private_key(self.key_size, self.key_type)
+
+        self.hits += 1
+        return key
+
+    def __key_files(self):
+        try:
+            names = os.listdir(self.key_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names
+                      if name.endswith(KEY_SUFFIX) and
+                      not name.startswith(TMP_PREFIX))
+
+
+def add_key(key_dir, key_size, key_type='rsa'):
+    """
+    Generates a key and atomically adds it to `key_dir`. This is a module
+    level function so that it can be run in a worker process.
+    """
+    from cryptography.hazmat.primitives import serialization
+
+    key = generate_private_key(key_size, key_type)
+    name = uuid.uuid4().hex
+    tmp_path = os.path.join(key_dir,
+                            '{}{}-{}'.format(TMP_PREFIX, os.getpid(), name))
+
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(
+            key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption()))
+
+    os.rename(tmp_path, os.path.join(key_dir, name + KEY_SUFFIX))
@@ -0,0 +1,187 @@
+"""
+Machine-readable index of an artifact directory.
+
+`manifest.json` describes every artifact: its mode, size and SHA-256 digest
+and, depending on the artifact, the certificate details (serial, validity,
+subject alternative names, fingerprint), the key type or the keystore
+entries. It is built from the in-memory artifacts while they are written, so
+tools can answer questions about the artifacts without parsing every file.
+"""
+import datetime
+import hashlib
+import json
+
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+
+from . import jks
+from .artifacts import Artifact, write_artifacts
+from .gen_certificates import (key_spec_of, not_valid_after, not_valid_before,
+                               subject_alternative_names)
+from .gen_stores import DEFAULT_PASSWORD
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+MANIFEST_MODE = 0o644
+
+PEM_CERT_MARKER = b'-----BEGIN CERTIFICATE-----'
+PEM_KEY_MARKER = b'PRIVATE KEY-----'
+
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _common_name(name):
+    attributes = name.get_attributes_for_oid(x509.oid.NameOID.COMMON_NAME)
+    return attributes[0].value if attributes else None
+
+
+def describe_cert(cert):
+    """ Manifest entry of a certificate. """
+    return {
+        'subject': _common_name(cert.subject),
+        'issuer': _common_name(cert.issuer),
+        'serial': format(cert.serial_number, 'x'),
+        'not_before': _timestamp(not_valid_before(cert)),
+        'not_after': _timestamp(not_valid_after(cert)),
+        'sans': subject_alternative_names(cert),
+        'fingerprint_sha256': cert.fingerprint(hashes.SHA256()).hex(),
+    }
+
+
+def describe_store(data, password=DEFAULT_PASSWORD):
+    """ Manifest entry of a `jks` keystore. """
+    entries = []
+    for entry in jks.loads(data, password):
+        if isinstance(entry, jks.PrivateKeyEntry):
+            der_certs = entry.cert_chain
+            entry_type = 'PrivateKeyEntry'
+        else:
+            der_certs = [entry.cert]
+            entry_type = 'trustedCertEntry'
+        entries.append({
+            'alias': entry.alias,
+            'type': entry_type,
+            'certificates': [
+                describe_cert(
+                    x509.load_der_x509_certificate(der, default_backend()))
+                for der in der_certs
+            ],
+        })
+    return {'type': 'jks', 'entries': entries}
+
+
+def describe_key(data):
+    """ Manifest entry of a `pem` private key, without any key material. """
+    key = serialization.load_pem_private_key(data,
+                                             password=None,
+                                             backend=default_backend())
+    key_type, key_size = key_spec_of(key)
+    return {'type': key_type, 'size': key_size}
+
+
+def describe(artifact):
+    """ Manifest entry of an `Artifact`. """
+    entry = {
+        'mode': format(artifact.mode, '04o'),
+        'size': len(artifact.data),
+        'sha256': hashlib.sha256(artifact.data).hexdigest(),
+    }
+    if artifact.path.endswith('.jks'):
+        entry['store'] = describe_store(artifact.data)
+    elif PEM_CERT_MARKER in artifact.data:
+        entry['certificate'] = describe_cert(
+            x509.load_pem_x509_certificate(artifact.data, default_backend()))
+    elif PEM_KEY_MARKER in artifact.data:
+        entry['key'] = describe_key(artifact.data)
+    return entry
+
+
+def build_manifest(artifacts, manifest=None):
+    """
+    Adds `artifacts` to `manifest`, or to a new manifest.
+
+    Returns:
+        The manifest as dictionary.
+    """
+    if manifest is None:
+        manifest = {'version': MANIFEST_VERSION, 'artifacts': {}}
+
+    for artifact in artifacts:
+        manifest['artifacts'][artifact.path] = describe(artifact)
+
+    manifest['artifacts'] = dict(sorted(manifest['artifacts'].items()))
+    manifest['updated_at'] = _timestamp(datetime.datetime.utcnow())
+    return manifest
+
+
+class ManifestWriter:
+    """
+    Writes a manifest to the binary `fileobj` one artifact at a time, so
+    the manifest of any number of artifacts is built in constant memory.
+    The result is formatted like `manifest_artifact`, but entries are in the
+    order they were added.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+        self.fileobj.write(b'{\n  "artifacts": {')
+
+    def add(self, artifact):
+        entry = json.dumps(describe(artifact), indent=2, sort_keys=True)
+        self.fileobj.write('{}\n    {}: {}'.format(
+            ',' if self.count else '', json.dumps(artifact.path),
+            entry.replace('\n', '\n    ')).encode())
+        self.count += 1
+
+    def close(self):
+        closing = '{}}},\n  "updated_at": {},\n  "version": {}\n}}\n'
+        self.fileobj.write(closing.format(
+            '\n  ' if self.count else '',
+            json.dumps(_timestamp(datetime.datetime.utcnow())),
+            MANIFEST_VERSION).encode())
+
+
+def manifest_artifact(manifest):
+    data = json.dumps(manifest, indent=2, sort_keys=True) + '\n'
+    return Artifact(MANIFEST_FILE, data.encode(), MANIFEST_MODE)
+
+
+def load_manifest(output_directory):
+    """
+    Returns:
+        The manifest of an artifact directory or `None` if it has none.
+    """
+    try:
+        with open(str(Path(output_directory) / MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def update_manifest(output_directory, artifacts=(), removed_nodes=()):
+    """
+    Updates the manifest of an artifact directory after `artifacts` were
+    written and the directories of `removed_nodes` were removed. Directories
+    without a manifest are left alone.
+    """
+    manifest = load_manifest(output_directory)
+    if manifest is None:
+        return
+
+    prefixes = tuple(node + '/' for node in removed_nodes)
+    if prefixes:
+        manifest['artifacts'] = {
+            path: entry
+            for path, entry in manifest['artifacts'].items()
+            if not path.startswith(prefixes)
+        }
+
+    write_artifacts(output_directory,
+                    [manifest_artifact(build_manifest(artifacts, manifest))],
+                    overwrite=True)
@@ -0,0 +1,103 @@
+"""
+Two stage pipeline overlapping CPU bound work with external processes.
+
+Every item first runs through a CPU bound stage in a pool of worker
+processes, e.g. generating keys and signing certificates, and then through
+an I/O bound coroutine in the main process, e.g. running `openssl` and
+`keytool`. A bounded queue connects the stages, so the workers already work
+on the next items while the subprocesses of earlier items run. Items are
+handed to the workers only as the I/O stage keeps up, so at most `cpu_jobs`
+plus `queue_size` results of the CPU stage are held at a time.
+"""
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+async def _run(loop, executor, items, cpu_stage, io_stage, cpu_jobs,
+               io_jobs, queue_size):
+    queue = asyncio.Queue(maxsize=queue_size)
+    # Items are only submitted to the workers while fewer than `cpu_jobs`
+    # results are being computed or `queue_size` are waiting for the I/O
+    # stage, so the results of the CPU stage, e.g. private keys, do not pile
+    # up in memory when the I/O stage is slower.
+    slots = asyncio.Semaphore(cpu_jobs + queue_size)
+    futures = []
+    cpu_tasks = []
+    results = [None] * len(items)
+
+    async def compute(index, item):
+        future = loop.run_in_executor(executor, cpu_stage, item)
+        futures.append(future)
+        try:
+            entry = index, await future, None
+        except Exception as e:
+            # Failures go through the queue as well, so that the consumer
+            # releases the slot of the item and fails the run.
+            entry = index, None, e
+        await queue.put(entry)
+
+    async def produce():
+        for index, item in enumerate(items):
+            await slots.acquire()
+            cpu_tasks.append(asyncio.ensure_future(compute(index, item)))
+        await asyncio.gather(*cpu_tasks)
+        for _ in range(io_jobs):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            slots.release()
+            index, value, error = entry
+            if error is not None:
+                raise error
+            results[index] = await io_stage(value)
+
+    tasks = [asyncio.ensure_future(produce())] + [
+        asyncio.ensure_future(consume()) for _ in range(io_jobs)
+    ]
+    done, pending = await asyncio.wait(tasks,
+                                       return_when=asyncio.FIRST_EXCEPTION)
+    for task in list(pending) + cpu_tasks + futures:
+        task.cancel()
+    await asyncio.gather(*(list(pending) + cpu_tasks),
+                         return_exceptions=True)
+    for task in done:
+        task.result()
+    return results
+
+
+def run_pipeline(items, cpu_stage, io_stage, cpu_jobs, io_jobs,
+                 queue_size=None):
+    """
+    Runs `cpu_stage(item)` in up to `cpu_jobs` worker processes and passes
+    each result to the coroutine function `io_stage` as soon as it is ready,
+    running up to `io_jobs` of them at the same time. `cpu_stage` must be
+    picklable, e.g. a module level function or a `functools.partial` of one.
+
+    If a stage fails, items which have not been started are cancelled and
+    the error is raised.
+
+    Args:
+        queue_size: Number of results of the CPU stage waiting for the I/O
+        stage at most. Items are only handed to the workers while fewer
+        than `cpu_jobs + queue_size` results are outstanding. Default:
+        `io_jobs`.
+
+    Returns:
+        List of the results of `io_stage`, in the order of `items`.
+    """
+    loop = asyncio.new_event_loop()
+    # Child processes are only watched on the event loop of the thread.
+    asyncio.set_event_loop(loop)
+    try:
+        with ProcessPoolExecutor(max_workers=cpu_jobs) as executor:
+            return loop.run_until_complete(
+                _run(loop, executor, items, cpu_stage, io_stage, cpu_jobs,
+                     io_jobs, queue_size or io_jobs))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,268 @@
+"""
+Renewal of the certificates of an artifact directory which are close to
+expiry.
+
+Only the expiring certificates and the stores containing them are reissued:
+
+* An expiring root certificate is re-signed with the existing root key and
+  subject. Node certificates stay valid, but `root-cert.pem` and
+  `truststore.jks` are replaced everywhere.
+* An expiring intermediate CA certificate is re-signed by the root with the
+  existing intermediate key and subject. Node certificates stay valid.
+* An expiring client certificate is reissued with a new key, replacing
+  `client-cert.pem`, `client-key.pem` and `clientstore.jks` of its node.
+* An expiring server certificate is reissued with a new key, replacing
+  `serverstore.jks` of its node.
+
+With an intermediate CA the keystores of the nodes hold the chain up to the
+root, so renewing the root or the intermediate CA certificate rebuilds the
+keystores, and `client-cert.pem`, of all nodes with the new chain.
+"""
+import datetime
+import os
+
+from collections import namedtuple
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from . import jks
+from .artifacts import (INTERMEDIATE_CERT_FILE, INTERMEDIATE_KEY_FILE,
+                        ROOT_CERT_FILE, ROOT_KEY_FILE, TRUSTSTORE_FILE,
+                        cert_artifact, key_artifact, node_directories,
+                        store_artifact, write_artifacts)
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, CertificateGenerator,
+                               CertifiedKey, key_spec_of, load_certified_key,
+                               load_pem_chain, not_valid_after, store_chain,
+                               subject_alternative_names, subject_fields)
+from .gen_stores import DEFAULT_PASSWORD, KeystoreGenerator
+
+ExpiringCert = namedtuple('ExpiringCert',
+                          ['node', 'name', 'cert', 'not_after'])
+ExpiringCert.__doc__ = """
+Certificate inside the renewal window. `node` is `None` for the root and
+intermediate CA certificates and `name` one of `root`, `intermediate`,
+`client` or `server`.
+"""
+
+
+class RenewalError(Exception):
+    """ Raised when the artifacts cannot be renewed. """
+
+
+def load_server_cert(node_path, password=DEFAULT_PASSWORD):
+    """ Loads the server certificate from `serverstore.jks` of a node. """
+    entries = jks.loads((Path(node_path) / 'serverstore.jks').read_bytes(),
+                        password)
+    return x509.load_der_x509_certificate(entries[0].cert_chain[0],
+                                          default_backend())
+
+
+def load_entity(node_path, name, password=DEFAULT_PASSWORD):
+    """
+    Loads the key and certificate chain of the `client` or `server`
+    keystore of a node.
+
+    Returns:
+        `CertifiedKey` of the keystore entry.
+    """
+    entry = jks.loads(
+        (Path(node_path) / '{}store.jks'.format(name)).read_bytes(),
+        password)[0]
+    key = serialization.load_der_private_key(entry.key, None,
+                                             default_backend())
+    certs = [
+        x509.load_der_x509_certificate(der, default_backend())
+        for der in entry.cert_chain
+    ]
+    return CertifiedKey(name, key, certs[0], tuple(certs[1:]))
+
+
+def load_client_cert(node_path):
+    return x509.load_pem_x509_certificate(
+        (Path(node_path) / 'client-cert.pem').read_bytes(), default_backend())
+
+
+def find_expiring(output_directory, within, now=None):
+    """
+    Finds the certificates of an artifact directory which expire within the
+    `within` timedelta.
+
+    Returns:
+        List of `ExpiringCert`, the root and intermediate CA certificates
+        first.
+    """
+    output_directory = Path(output_directory)
+    deadline = (now or datetime.datetime.utcnow()) + within
+    expiring = []
+
+    root_cert = x509.load_pem_x509_certificate(
+        (output_directory / ROOT_CERT_FILE).read_bytes(), default_backend())
+    if not_valid_after(root_cert) <= deadline:
+        expiring.append(
+            ExpiringCert(None, 'root', root_cert, not_valid_after(root_cert)))
+
+    intermediate_path = output_directory / INTERMEDIATE_CERT_FILE
+    if intermediate_path.is_file():
+        intermediate_cert = load_pem_chain(intermediate_path.read_bytes())[0]
+        if not_valid_after(intermediate_cert) <= deadline:
+            expiring.append(
+                ExpiringCert(None, 'intermediate', intermediate_cert,
+                             not_valid_after(intermediate_cert)))
+
+    for node in node_directories(output_directory):
+        node_path = output_directory / node
+        for name, cert in (('client', load_client_cert(node_path)),
+                           ('server', load_server_cert(node_path))):
+            if not_valid_after(cert) <= deadline:
+                expiring.append(
+                    ExpiringCert(node, name, cert, not_valid_after(cert)))
+
+    return expiring
+
+
+def _load_ca(output_directory, name, cert_file, key_file, key_required):
+    """
+    Loads the root or intermediate CA of an artifact directory. Its key is
+    `None` if it is not required and missing.
+    """
+    key_path = output_directory / key_file
+    cert_data = (output_directory / cert_file).read_bytes()
+    if key_path.is_file():
+        return load_certified_key(name, cert_data, key_path.read_bytes())
+    if key_required and name == 'root':
+        raise RenewalError(
+            "Root key '{}' does not exist. Artifacts must be generated with "
+            "--keep-root-key to be renewed.".format(
+                key_path))
+    if key_required:
+        raise RenewalError(
+            "Intermediate key '{}' does not exist, the node certificates "
+            "cannot be renewed.".format(key_path))
+    certs = load_pem_chain(cert_data)
+    return CertifiedKey(name, None, certs[0], tuple(certs[1:]))
+
+
+def renew(output_directory,
+          expiring,
+          store_backend='native',
+          validity_days=DEFAULT_VALIDITY_DAYS):
+    """
+    Reissues the `expiring` certificates of an artifact directory, see the
+    module documentation. Keys of reissued certificates have the same type
+    and size as the keys they replace.
+
+    Returns:
+        List of the written `Artifact`.
+    """
+    output_directory = Path(output_directory)
+    if not expiring:
+        return []
+
+    # Node certificates are issued by the intermediate CA if there is one,
+    # the root key is only needed to renew the root or the intermediate CA.
+    names = {cert.name for cert in expiring}
+    renew_nodes = bool(names - {'root', 'intermediate'})
+    has_intermediate = (output_directory / INTERMEDIATE_CERT_FILE).is_file()
+    root = _load_ca(
+        output_directory, 'root', ROOT_CERT_FILE, ROOT_KEY_FILE,
+        bool(names & {'root', 'intermediate'})
+        or (renew_nodes and not has_intermediate))
+    intermediate = None
+    if has_intermediate:
+        intermediate = _load_ca(output_directory, 'intermediate',
+                                INTERMEDIATE_CERT_FILE, INTERMEDIATE_KEY_FILE,
+                                renew_nodes)
+
+    def generator(cert):
+        key_type, key_size = key_spec_of(cert.public_key())
+        return CertificateGenerator(key_type=key_type,
+                                    key_size=key_size,
+                                    validity_days=validity_days,
+                                    **subject_fields(cert))
+
+    store_generator = KeystoreGenerator(backend=store_backend)
+    artifacts = []
+
+    if 'root' in names:
+        root = generator(root.cert).issue(
+            cert_name='root',
+            sa_names=subject_alternative_names(root.cert),
+            key=root.key,
+            subject=root.cert.subject)
+        truststore = store_generator.build_truststore([('root-cert',
+                                                        root.cert)])
+        for directory in [''] + node_directories(output_directory):
+            artifacts.append(
+                cert_artifact(os.path.join(directory, ROOT_CERT_FILE),
+                              root.cert))
+            artifacts.append(
+                store_artifact(os.path.join(directory, TRUSTSTORE_FILE),
+                               truststore))
+
+    if intermediate is not None:
+        if 'intermediate' in names:
+            intermediate = generator(intermediate.cert).issue(
+                cert_name='intermediate',
+                sa_names=subject_alternative_names(intermediate.cert),
+                issuer=root,
+                key=intermediate.key,
+                ca=True,
+                subject=intermediate.cert.subject)
+        else:
+            intermediate = intermediate._replace(chain=(root.cert, ))
+        if names & {'root', 'intermediate'}:
+            artifacts.append(
+                cert_artifact(INTERMEDIATE_CERT_FILE, intermediate.cert,
+                              intermediate.chain))
+    issuer = root if intermediate is None else intermediate
+
+    for cert in expiring:
+        if cert.node is None:
+            continue
+
+        renewed = generator(cert.cert).issue(
+            cert_name=cert.name,
+            sa_names=subject_alternative_names(cert.cert),
+            issuer=issuer)
+        artifacts.extend(
+            _entity_artifacts(cert.node, renewed, store_generator))
+
+    if intermediate is not None and names & {'root', 'intermediate'}:
+        reissued = {(cert.node, cert.name) for cert in expiring}
+        for node in node_directories(output_directory):
+            for name in ('client', 'server'):
+                if (node, name) in reissued:
+                    continue
+                entity = load_entity(output_directory / node, name)._replace(
+                    chain=(intermediate.cert, ) + tuple(intermediate.chain))
+                artifacts.extend(
+                    _entity_artifacts(node, entity, store_generator,
+                                      new_key=False))
+
+    write_artifacts(output_directory, artifacts, overwrite=True)
+    return artifacts
+
+
+def _entity_artifacts(node, entity, store_generator, new_key=True):
+    """
+    Artifacts of the `client` or `server` `CertifiedKey` of a node. The
+    client key is only included if it is `new_key`.
+    """
+    store = store_generator.build_entitystore(entity.name + '-cert',
+                                              entity.key,
+                                              store_chain(entity))
+    artifacts = []
+    if entity.name == 'client':
+        artifacts.append(
+            cert_artifact(os.path.join(node, 'client-cert.pem'), entity.cert,
+                          entity.chain[:-1]))
+        if new_key:
+            artifacts.append(
+                key_artifact(os.path.join(node, 'client-key.pem'),
+                             entity.key))
+    artifacts.append(
+        store_artifact(os.path.join(node, entity.name + 'store.jks'), store))
+    return artifacts
@@ -0,0 +1,391 @@
+"""
+Issuance database and certificate revocation lists of an artifact directory.
+
+Every node certificate written to an artifact directory is recorded in the
+SQLite database `issued.db` next to `root-cert.pem`, indexed by serial and
+by node, so the certificates of a node can be revoked long after its
+directory has been removed or renewed.
+
+Revoking certificates issues a certificate revocation list (CRL) signed by
+the CA issuing the node certificates:
+
+* `crl.pem` is the full CRL. It lists every revoked certificate which has
+  not expired yet.
+* `delta-crl.pem` is a delta CRL on top of the last full CRL. It only lists
+  the certificates revoked since then, so frequent revocations do not need
+  to rewrite and redistribute the full list.
+
+Every CRL gets the next CRL number, a delta CRL refers to the number of its
+full CRL in the delta CRL indicator.
+"""
+import datetime
+import os
+import sqlite3
+
+from collections import namedtuple
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from . import jks
+from .artifacts import CERT_MODE, Artifact, node_directories
+from .gen_certificates import (not_valid_after, not_valid_before,
+                               signature_hash)
+from .gen_stores import DEFAULT_PASSWORD
+
+ISSUED_DB_FILE = 'issued.db'
+CRL_FILE = 'crl.pem'
+DELTA_CRL_FILE = 'delta-crl.pem'
+
+# Files of a node directory holding a node certificate, and its name. The
+# server certificate only exists as file while signing requests.
+NODE_CERT_FILES = {
+    'client-cert.pem': 'client',
+    'server-cert.pem': 'server',
+    'clientstore.jks': 'client',
+    'serverstore.jks': 'server',
+}
+
+# Days until relying parties should fetch a new CRL.
+DEFAULT_CRL_VALIDITY_DAYS = 7
+
+REASONS = {
+    'unspecified': x509.ReasonFlags.unspecified,
+    'key-compromise': x509.ReasonFlags.key_compromise,
+    'affiliation-changed': x509.ReasonFlags.affiliation_changed,
+    'superseded': x509.ReasonFlags.superseded,
+    'cessation-of-operation': x509.ReasonFlags.cessation_of_operation,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    serial TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    name TEXT NOT NULL,
+    not_before TEXT NOT NULL,
+    not_after TEXT NOT NULL,
+    revoked_at TEXT,
+    reason TEXT,
+    crl_number INTEGER
+);
+CREATE INDEX IF NOT EXISTS certificates_node ON certificates (node);
+CREATE INDEX IF NOT EXISTS certificates_revoked
+    ON certificates (crl_number) WHERE revoked_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS crls (
+    number INTEGER PRIMARY KEY,
+    base_number INTEGER,
+    issued_at TEXT NOT NULL
+);
+"""
+
+IssuedCert = namedtuple('IssuedCert', [
+    'serial', 'node', 'name', 'not_before', 'not_after', 'revoked_at',
+    'reason'
+])
+IssuedCert.__doc__ = """
+Certificate recorded in the issuance database. `serial` is the hexadecimal
+serial number, `name` is `client` or `server`. `revoked_at` and `reason`
+are `None` unless the certificate is revoked.
+"""
+
+
+class RevocationError(Exception):
+    """ Raised when certificates cannot be revoked. """
+
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _datetime(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+def serial_hex(serial_number):
+    return format(serial_number, 'x')
+
+
+def _issued(node, name, cert):
+    return IssuedCert(serial_hex(cert.serial_number), node, name,
+                      _timestamp(not_valid_before(cert)),
+                      _timestamp(not_valid_after(cert)), None, None)
+
+
+def issued_certs(artifacts):
+    """
+    Node certificates among `artifacts`: the certificate files and the key
+    entries of the keystores of the node directories, see
+    `NODE_CERT_FILES`. A certificate found in both is returned once.
+
+    Returns:
+        List of `IssuedCert`.
+    """
+    certs = {}
+    for artifact in artifacts:
+        if '/' not in artifact.path:
+            continue
+        node, file_name = artifact.path.split('/', 1)
+        if file_name not in NODE_CERT_FILES:
+            continue
+        name = NODE_CERT_FILES[file_name]
+        if file_name.endswith('.pem'):
+            cert = x509.load_pem_x509_certificate(artifact.data,
+                                                  default_backend())
+        else:
+            entry = jks.loads(artifact.data, DEFAULT_PASSWORD)[0]
+            cert = x509.load_der_x509_certificate(entry.cert_chain[0],
+                                                  default_backend())
+        issued = _issued(node, name, cert)
+        certs.setdefault(issued.serial, issued)
+    return list(certs.values())
+
+
+def directory_certs(output_directory):
+    """
+    Node certificates found in the node directories of an artifact
+    directory, see `issued_certs`.
+    """
+    output_directory = Path(output_directory)
+    artifacts = []
+    for node in node_directories(output_directory):
+        for file_name in ('client-cert.pem', 'serverstore.jks'):
+            path = output_directory / node / file_name
+            if path.is_file():
+                artifacts.append(
+                    Artifact(node + '/' + file_name, path.read_bytes(),
+                             CERT_MODE))
+    return issued_certs(artifacts)
+
+
+class IssuanceDB:
+    """
+    The issuance database of an artifact directory. Use `open_database` to
+    open the database of an existing artifact directory.
+    """
+
+    def __init__(self, path):
+        new = not os.path.exists(str(path))
+        self.connection = sqlite3.connect(str(path), timeout=30)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+        if new:
+            os.chmod(str(path), CERT_MODE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, certs):
+        """ Records issued certificates, known serials are skipped. """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO certificates (serial, node, name, '
+                'not_before, not_after) VALUES (?, ?, ?, ?, ?)',
+                [cert[:5] for cert in certs])
+
+    def _select(self, where, args):
+        rows = self.connection.execute(
+            'SELECT serial, node, name, not_before, not_after, revoked_at, '
+            'reason FROM certificates WHERE ' + where, args)
+        return [IssuedCert(*row) for row in rows]
+
+    def find(self, node=None, serial=None):
+        """
+        Certificates of `node` or with the hexadecimal `serial`.
+
+        Returns:
+            List of `IssuedCert`.
+        """
+        if serial is not None:
+            return self._select('serial = ?', (serial.lower(), ))
+        return self._select('node = ? ORDER BY not_before, serial',
+                            (node, ))
+
+    def revoked_serials(self):
+        """ Set of the serials of all revoked certificates. """
+        return {
+            row[0]
+            for row in self.connection.execute(
+                'SELECT serial FROM certificates '
+                'WHERE revoked_at IS NOT NULL')
+        }
+
+    def revoke(self, certs, reason='unspecified', now=None):
+        """
+        Marks `certs` revoked unless they already are.
+
+        Returns:
+            List of the newly revoked `IssuedCert`.
+        """
+        revoked_at = _timestamp(now or datetime.datetime.utcnow())
+        revoked = []
+        with self.connection:
+            for cert in certs:
+                cursor = self.connection.execute(
+                    'UPDATE certificates SET revoked_at = ?, reason = ? '
+                    'WHERE serial = ? AND revoked_at IS NULL',
+                    (revoked_at, reason, cert.serial))
+                if cursor.rowcount:
+                    revoked.append(
+                        cert._replace(revoked_at=revoked_at, reason=reason))
+        return revoked
+
+    def last_full_crl(self):
+        """ Number of the last full CRL or `None`. """
+        row = self.connection.execute(
+            'SELECT max(number) FROM crls WHERE base_number IS NULL'
+        ).fetchone()
+        return row[0]
+
+    def issue_crl(self, issuer, delta=False,
+                  validity_days=DEFAULT_CRL_VALIDITY_DAYS, now=None):
+        """
+        Issues the next full CRL or, with `delta`, a delta CRL on top of the
+        last full CRL, signed by `issuer`, the `CertifiedKey` of the CA
+        issuing the node certificates. Certificates which have expired are
+        left out.
+
+        Returns:
+            The CRL in `pem` format.
+        """
+        now = now or datetime.datetime.utcnow()
+        base_number = self.last_full_crl() if delta else None
+        if delta and base_number is None:
+            raise RevocationError('A delta CRL needs a full CRL first.')
+
+        with self.connection:
+            number = (self.connection.execute(
+                'SELECT max(number) FROM crls').fetchone()[0] or 0) + 1
+            where = 'revoked_at IS NOT NULL AND not_after > ?'
+            args = [_timestamp(now)]
+            if delta:
+                where += ' AND (crl_number IS NULL OR crl_number > ?)'
+                args.append(base_number)
+            certs = self._select(where + ' ORDER BY revoked_at, serial',
+                                 args)
+            self.connection.execute(
+                'UPDATE certificates SET crl_number = ? '
+                'WHERE revoked_at IS NOT NULL AND crl_number IS NULL',
+                (number, ))
+            self.connection.execute(
+                'INSERT INTO crls (number, base_number, issued_at) '
+                'VALUES (?, ?, ?)', (number, base_number, _timestamp(now)))
+            return build_crl(issuer, certs, number, base_number,
+                             validity_days, now)
+
+
+def build_crl(issuer, certs, number, base_number=None,
+              validity_days=DEFAULT_CRL_VALIDITY_DAYS, now=None):
+    """
+    Builds and signs a CRL listing the revoked `certs`, a delta CRL if
+    `base_number` is given.
+
+    Returns:
+        The CRL in `pem` format.
+    """
+    now = now or datetime.datetime.utcnow()
+    builder = x509.CertificateRevocationListBuilder().issuer_name(
+        issuer.cert.subject).last_update(now).next_update(
+            now + datetime.timedelta(days=validity_days)).add_extension(
+                x509.CRLNumber(number), critical=False).add_extension(
+                    x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                        issuer.cert.public_key()),
+                    critical=False)
+    if base_number is not None:
+        builder = builder.add_extension(x509.DeltaCRLIndicator(base_number),
+                                        critical=True)
+
+    for cert in certs:
+        revoked = x509.RevokedCertificateBuilder().serial_number(
+            int(cert.serial, 16)).revocation_date(_datetime(cert.revoked_at))
+        if cert.reason != 'unspecified':
+            revoked = revoked.add_extension(
+                x509.CRLReason(REASONS[cert.reason]), critical=False)
+        builder = builder.add_revoked_certificate(
+            revoked.build(default_backend()))
+
+    crl = builder.sign(issuer.key, signature_hash(issuer.key),
+                       default_backend())
+    return crl.public_bytes(serialization.Encoding.PEM)
+
+
+def open_database(output_directory):
+    """
+    Opens the issuance database of an artifact directory. A missing
+    database is created from the certificates of the node directories, so
+    directories generated before it existed can be revoked as well.
+
+    Returns:
+        `IssuanceDB`
+    """
+    path = Path(output_directory) / ISSUED_DB_FILE
+    if path.exists():
+        return IssuanceDB(path)
+
+    database = IssuanceDB(path)
+    database.record(directory_certs(output_directory))
+    return database
+
+
+def record_issued(output_directory, artifacts):
+    """
+    Records the node certificates among `artifacts` in the issuance database
+    of an artifact directory.
+    """
+    with open_database(output_directory) as database:
+        database.record(issued_certs(artifacts))
+
+
+def revoke(output_directory, issuer, nodes=(), serials=(),
+           reason='unspecified', full=False,
+           validity_days=DEFAULT_CRL_VALIDITY_DAYS, now=None):
+    """
+    Revokes all certificates of `nodes` and the certificates with the
+    hexadecimal `serials`, then issues a delta CRL. A full CRL is issued
+    instead with `full` or if there is none yet, followed by an empty delta
+    CRL on top of it.
+
+    Returns:
+        (list of the newly revoked `IssuedCert`, list of CRL `Artifact`)
+
+    Raises:
+        RevocationError: A node or serial is not in the database.
+    """
+    with open_database(output_directory) as database:
+        certs = []
+        unknown = []
+        for node in nodes:
+            found = database.find(node=node)
+            certs.extend(found)
+            if not found:
+                unknown.append(node)
+        for serial in serials:
+            found = database.find(serial=serial)
+            certs.extend(found)
+            if not found:
+                unknown.append(serial)
+        if unknown:
+            raise RevocationError(
+                'No certificates of {} have been issued in {}.'.format(
+                    ', '.join(unknown), output_directory))
+
+        revoked = database.revoke(certs, reason, now)
+
+        artifacts = []
+        if full or database.last_full_crl() is None:
+            artifacts.append(
+                Artifact(CRL_FILE,
+                         database.issue_crl(issuer, False, validity_days,
+                                            now), CERT_MODE))
+        artifacts.append(
+            Artifact(DELTA_CRL_FILE,
+                     database.issue_crl(issuer, True, validity_days, now),
+                     CERT_MODE))
+    return revoked, artifacts
@@ -0,0 +1,379 @@
+"""
+Local HTTP service issuing node artifacts from a CA kept in memory.
+
+Every run of the command pays for starting Python, importing the package and
+creating or loading the root before it issues anything. `serve` pays that
+once: the root stays in memory and a background thread generates keys ahead
+of time, so a request only signs two certificates and builds the keystores.
+
+The service listens on a Unix socket or a loopback address and answers:
+
+    POST /nodes/<node>?san=<name>&format=json|tar
+        Issues the artifacts of a node. Extra subject alternative names can
+        be given as repeated `san` parameters. `json` returns the files of
+        the node directory base64 encoded, `tar` a `tar` archive of the node
+        directory.
+    GET /root-cert.pem
+    GET /truststore.jks
+    GET /metrics
+        Request counts, request latency percentiles and key pool usage as
+        JSON.
+
+It does not authenticate clients: anybody able to connect can have
+certificates issued, so the socket must only be accessible to trusted users.
+"""
+import base64
+import collections
+import http.server
+import io
+import json
+import logging
+import math
+import os
+import queue
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from .artifacts import ArchiveWriter
+from .ensemble import NodeResult, build_node_artifacts, node_bundle
+from .gen_certificates import (DEFAULT_VALIDITY_DAYS, CertificateGenerator,
+                               cert_pem, generate_private_key, key_spec,
+                               root_cert_of)
+from .gen_stores import KeystoreGenerator
+from .revocation import record_issued
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH = 16
+LATENCY_WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+
+
+class MemoryKeyPool:
+    """
+    Keys generated ahead of time by a background thread and kept in memory.
+    Has the `get_key` interface of `KeyPool`, so it can be passed to
+    `CertificateGenerator`.
+
+    Args:
+        size: Number of keys kept ready.
+    """
+
+    def __init__(self, key_type='rsa', key_size=None, size=DEFAULT_PREFETCH):
+        self.key_type, self.key_size = key_spec(key_type, key_size)
+        self.keys = queue.Queue(maxsize=size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ Starts generating keys until the pool is full. """
+        self._thread = threading.Thread(target=self._fill,
+                                        name='key-pool',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _fill(self):
+        key = None
+        while not self._stopped.is_set():
+            if key is None:
+                key = generate_private_key(self.key_size, self.key_type)
+            try:
+                self.keys.put(key, timeout=0.1)
+                key = None
+            except queue.Full:
+                pass
+
+    def size(self):
+        """ Number of keys currently available in the pool. """
+        return self.keys.qsize()
+
+    def get_key(self):
+        """
+        Returns a pre-generated key, or generates one if none is ready.
+        """
+        try:
+            key = self.keys.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.misses += 1
+            return generate_private_key(self.key_size, self.key_type)
+
+        with self._lock:
+            self.hits += 1
+        return key
+
+
+def percentile(samples, percent):
+    """ Nearest-rank percentile of the sorted `samples`. """
+    rank = max(1, math.ceil(percent / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+class Metrics:
+    """
+    Thread safe request counters and the latencies of the last
+    `LATENCY_WINDOW` requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.total_latency = 0.0
+        self.in_flight = 0
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counts[name] += value
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, status, latency):
+        with self._lock:
+            self.in_flight -= 1
+            self.counts['responses_{}xx'.format(status // 100)] += 1
+            self.latencies.append(latency)
+            self.total_latency += latency
+
+    def snapshot(self):
+        """
+        Returns:
+            Dictionary of the counters and the latency summary in seconds.
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+            snapshot = dict(self.counts)
+            snapshot['in_flight'] = self.in_flight
+            total = self.total_latency
+
+        latency = {'window': len(latencies)}
+        if latencies:
+            latency['mean'] = sum(latencies) / len(latencies)
+            latency['max'] = latencies[-1]
+            for percent in PERCENTILES:
+                latency['p{}'.format(percent)] = percentile(
+                    latencies, percent)
+        snapshot['latency'] = latency
+        snapshot['latency_seconds_total'] = total
+        return snapshot
+
+
+class Busy(Exception):
+    """ No issuing slot became free in time. """
+
+
+class IssuingService:
+    """
+    Issues node artifacts with the `CertifiedKey` `root` of the root or of
+    an intermediate CA. At most
+    `max_concurrency` nodes are issued at the same time, further requests
+    wait up to `queue_timeout` seconds for a slot. With `ca_directory` the
+    issued certificates are recorded in its issuance database.
+    """
+
+    def __init__(self, root, truststore, key_pool, key_type='rsa',
+                 key_size=None, validity_days=DEFAULT_VALIDITY_DAYS,
+                 store_backend='native', max_concurrency=None,
+                 queue_timeout=5.0, ca_directory=None):
+        self.root = root
+        self.ca_directory = ca_directory
+        self.truststore = truststore
+        self.key_pool = key_pool
+        self.cert_generator = CertificateGenerator(key_pool=key_pool,
+                                                   key_type=key_type,
+                                                   key_size=key_size,
+                                                   validity_days=validity_days)
+        self.store_generator = KeystoreGenerator(backend=store_backend,
+                                                 key_type=key_type)
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self.queue_timeout = queue_timeout
+        self.metrics = Metrics()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def issue(self, node, extra_sans=()):
+        """
+        Returns:
+            `NodeResult` of the node.
+
+        Raises:
+            Busy: `max_concurrency` nodes are being issued for longer than
+            `queue_timeout`.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise Busy()
+        try:
+            artifacts = build_node_artifacts(node, self.root,
+                                             self.truststore,
+                                             self.cert_generator,
+                                             self.store_generator, extra_sans)
+        finally:
+            self._slots.release()
+        if self.ca_directory is not None:
+            record_issued(self.ca_directory, artifacts)
+        return NodeResult(node, artifacts, 0, 0, [])
+
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot()
+        snapshot['max_concurrency'] = self.max_concurrency
+        snapshot['key_pool'] = {
+            'size': self.key_pool.size(),
+            'hits': self.key_pool.hits,
+            'misses': self.key_pool.misses,
+        }
+        return snapshot
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP interface of the `IssuingService` of the server.
+    """
+    server_version = 'exhibitor-tls-artifacts'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        log.info('%s %s', self.address_string(), format % args)
+
+    def _send(self, status, body, content_type='application/json'):
+        if isinstance(body, dict):
+            body = (json.dumps(body, indent=2, sort_keys=True) +
+                    '\n').encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _error(self, status, message):
+        return self._send(status, {'error': message})
+
+    def _handle(self, method):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+
+        if method == 'GET' and url.path == '/metrics':
+            return self._send(200, service.metrics_snapshot())
+        if method == 'GET' and url.path == '/root-cert.pem':
+            return self._send(200, cert_pem(root_cert_of(service.root)),
+                              'application/x-pem-file')
+        if method == 'GET' and url.path == '/truststore.jks':
+            return self._send(200, service.truststore,
+                              'application/octet-stream')
+        if not url.path.startswith('/nodes/'):
+            return self._error(404, 'Not found.')
+        if method != 'POST':
+            return self._error(405, 'Nodes are issued with POST.')
+
+        node = urllib.parse.unquote(url.path[len('/nodes/'):])
+        output_format = query.get('format', ['json'])[-1]
+        if not node or '/' in node or node.startswith('.'):
+            return self._error(400, "Invalid node '{}'.".format(node))
+        if output_format not in ('json', 'tar'):
+            return self._error(
+                400, "Invalid format '{}'.".format(output_format))
+
+        try:
+            result = service.issue(node, query.get('san', []))
+        except Busy:
+            service.metrics.increment('rejected')
+            return self._error(503, 'Too many requests in progress.')
+        except ValueError as e:
+            return self._error(400, str(e))
+        service.metrics.increment('issued')
+
+        if output_format == 'tar':
+            body = io.BytesIO()
+            with ArchiveWriter(body, 'tar') as writer:
+                for artifact in result.artifacts:
+                    writer.add(artifact)
+            return self._send(200, body.getvalue(), 'application/x-tar')
+
+        bundle = node_bundle(result)
+        return self._send(200, {
+            'node': bundle.node,
+            'files': {
+                name: base64.b64encode(data).decode()
+                for name, data in bundle.files.items()
+            },
+        })
+
+    def _dispatch(self, method):
+        metrics = self.server.service.metrics
+        metrics.started()
+        start = time.perf_counter()
+        status = 500
+        try:
+            # Request bodies are not used, but must be consumed to keep the
+            # connection usable.
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            status = self._handle(method)
+        except Exception:
+            log.exception('Request %s %s failed', method, self.path)
+            status = self._error(500, 'Internal error.')
+        finally:
+            metrics.finished(status, time.perf_counter() - start)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, RequestHandler)
+        self.service = service
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        super().__init__(str(path), RequestHandler)
+        self.service = service
+
+    def server_bind(self):
+        # Only the owner may connect, see the module documentation.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def make_server(service, host='127.0.0.1', port=0, socket_path=None):
+    """
+    Creates a server for `service` listening on the Unix socket
+    `socket_path` or on `host`:`port`. Call `serve_forever` to start it.
+    """
+    if socket_path is not None:
+        return UnixHTTPServer(socket_path, service)
+    return HTTPServer((host, port), service)
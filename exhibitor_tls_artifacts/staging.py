@@ -0,0 +1,224 @@
+"""
+Crash-safe publishing of output directories and files.
+
+Output is written to a staging path next to its target, named
+`.<target>.staging-<pid>-<random>`. Once everything is written, all files
+and directories are synced to disk in one pass and the staging path is
+renamed to the target. Readers and later runs therefore see either no
+output or complete output, even if the process is killed or the host loses
+power; at worst a staging path is left behind. `find_stale` finds staging
+paths of processes which are no longer running so they can be removed.
+
+New entries of an existing directory cannot be renamed into it in one step.
+`staged_entries` therefore lists them in a journal inside the staging
+directory before the first rename and removes the journal after the last
+one. As long as the journal exists the entries are not committed, and
+`remove_staging` moves the ones already renamed back before removing the
+staging directory, so the entries are published all or nothing.
+"""
+import contextlib
+import os
+import re
+import shutil
+import uuid
+
+from pathlib import Path
+
+from .timings import span
+
+STAGING_PATTERN = re.compile(
+    r'^\.(?P<target>.+)\.staging-(?P<pid>\d+)-[0-9a-f]+$')
+# Entries of a staging directory which are being renamed into its parent.
+JOURNAL_FILE = '.publishing'
+
+
+def staging_path(target):
+    """ New staging path of `target`, in the same directory. """
+    target = Path(target)
+    return target.with_name('.{}.staging-{}-{}'.format(
+        target.name, os.getpid(), uuid.uuid4().hex[:8]))
+
+
+def fsync_path(path):
+    """ Flushes a file or directory to disk. """
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_tree(directory):
+    """
+    Flushes every file below `directory` to disk, then the directories from
+    the bottom up so the entries of the files are durable as well. Hard
+    linked files are synced once.
+    """
+    seen = set()
+    directories = []
+    for root, _, files in os.walk(str(directory)):
+        directories.append(root)
+        for name in files:
+            path = os.path.join(root, name)
+            inode = os.lstat(path).st_ino
+            if inode not in seen:
+                seen.add(inode)
+                fsync_path(path)
+    for root in reversed(directories):
+        fsync_path(root)
+
+
+def _publish(staging, target, publish):
+    """ Publishes `staging` as `target` and syncs the parent directory. """
+    publish(str(staging), str(target))
+    fsync_path(Path(target).parent)
+
+
+def _rename_directory(staging, target):
+    # `rename` replaces an empty directory, which must not be clobbered
+    # either.
+    if os.path.lexists(target):
+        raise FileExistsError(target)
+    os.rename(staging, target)
+
+
+def _link_file(staging, target):
+    # Unlike `rename`, `link` fails if `target` exists.
+    os.link(staging, target)
+    os.remove(staging)
+
+
+@contextlib.contextmanager
+def staged_directory(target, mode=0o755):
+    """
+    Creates a staging directory for `target`, which must not exist, and
+    yields its path. When the block succeeds, the tree is synced and
+    renamed to `target`. Otherwise the staging directory is removed.
+    """
+    staging = staging_path(target)
+    os.mkdir(str(staging), mode)
+    try:
+        yield staging
+        with span('fsync'):
+            sync_tree(staging)
+        _publish(staging, target, _rename_directory)
+    except BaseException:
+        shutil.rmtree(str(staging), ignore_errors=True)
+        raise
+
+
+def _write_journal(staging, entries):
+    journal = staging / JOURNAL_FILE
+    journal.write_text(''.join(entry + '\n' for entry in entries))
+    fsync_path(journal)
+    fsync_path(staging)
+
+
+def rollback(staging):
+    """
+    Moves the entries of the journal of `staging` which were already
+    renamed into its parent back into it. Does nothing without journal.
+    """
+    staging = Path(staging)
+    journal = staging / JOURNAL_FILE
+    if not journal.is_file():
+        return
+    for entry in journal.read_text().splitlines():
+        published = staging.parent / entry
+        # Renames only fail for existing targets, which are left alone.
+        if not os.path.lexists(str(staging / entry)) and \
+                os.path.lexists(str(published)):
+            os.rename(str(published), str(staging / entry))
+    fsync_path(staging.parent)
+
+
+@contextlib.contextmanager
+def staged_entries(directory, name='entries', mode=0o755):
+    """
+    Like `staged_directory`, but for new entries of the existing
+    `directory`: the entries are written to a staging directory inside it
+    and renamed into `directory` once all of them are synced. If any rename
+    fails, the entries renamed before are moved back.
+    """
+    staging = staging_path(Path(directory) / name)
+    os.mkdir(str(staging), mode)
+    try:
+        yield staging
+        with span('fsync'):
+            sync_tree(staging)
+        entries = sorted(os.listdir(str(staging)))
+        _write_journal(staging, entries)
+        for entry in entries:
+            _rename_directory(str(staging / entry),
+                              os.path.join(str(directory), entry))
+        fsync_path(directory)
+        # Commits the entries.
+        os.remove(str(staging / JOURNAL_FILE))
+        os.rmdir(str(staging))
+        fsync_path(directory)
+    except BaseException:
+        rollback(staging)
+        shutil.rmtree(str(staging), ignore_errors=True)
+        raise
+
+
+@contextlib.contextmanager
+def staged_file(target, mode):
+    """
+    Opens a staging file for `target`, which must not exist, for writing
+    with `mode` and yields it. When the block succeeds, the file is synced
+    and linked to `target`. Otherwise the staging file is removed.
+    """
+    staging = staging_path(target)
+    fd = os.open(str(staging), os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(f.fileno(), mode)
+            yield f
+            f.flush()
+            with span('fsync'):
+                os.fsync(f.fileno())
+        _publish(staging, target, _link_file)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(str(staging))
+        raise
+
+
+def process_running(pid):
+    """ Whether a process with `pid` is running. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user.
+        pass
+    return True
+
+
+def find_stale(directory):
+    """
+    Staging paths in `directory` whose process is not running anymore.
+
+    Returns:
+        Sorted list of `Path`.
+    """
+    stale = []
+    for path in Path(directory).iterdir():
+        match = STAGING_PATTERN.match(path.name)
+        if match and not process_running(int(match.group('pid'))):
+            stale.append(path)
+    return sorted(stale)
+
+
+def remove_staging(path):
+    """
+    Removes a staging directory or file. Entries of a staging directory
+    which were published partially are rolled back first.
+    """
+    if path.is_dir() and not path.is_symlink():
+        rollback(path)
+        shutil.rmtree(str(path))
+    else:
+        path.unlink()
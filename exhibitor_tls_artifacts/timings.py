@@ -0,0 +1,218 @@
+"""
+Lightweight timing instrumentation of the artifact generation.
+
+Stages are wrapped in `span(stage, artifact)`. While no listener is
+registered spans cost next to nothing. Listeners registered with
+`add_listener` are called with every finished `Span`, which is how
+`--timings` collects its report and how callers can export the spans to
+their own tracing:
+
+    timings.add_listener(lambda span: tracer.record(span.stage, ...))
+
+Spans of nodes generated in worker processes are collected in the worker
+and emitted in the main process once the node is done. Spans nest, e.g. the
+`node` span of a node contains the `keygen` and `sign` spans of its
+certificates.
+"""
+import bisect
+import contextlib
+import json
+import time
+
+from collections import OrderedDict, namedtuple
+
+FORMATS = ('table', 'json')
+
+Span = namedtuple('Span', ['stage', 'node', 'artifact', 'start', 'duration'])
+Span.__doc__ = """
+A finished stage. `node` is the node the stage ran for, `None` for stages
+shared by all nodes, and `artifact` names the certificate, key or keystore.
+`start` is a UNIX timestamp and `duration` in seconds.
+"""
+
+_listeners = []
+_labels = {'node': None}
+
+
+def add_listener(listener):
+    """ Calls `listener` with every finished `Span`. """
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def enabled():
+    """ Whether spans are currently recorded. """
+    return bool(_listeners)
+
+
+def emit(span):
+    """ Passes a finished `Span` to the listeners. """
+    for listener in list(_listeners):
+        listener(span)
+
+
+@contextlib.contextmanager
+def span(stage, artifact=None, node=None):
+    """
+    Times the enclosed block as `stage`, labeled with `node` or the current
+    node. Code interleaving several nodes in one thread, like coroutines,
+    passes the node explicitly.
+    """
+    if not _listeners:
+        yield
+        return
+
+    if node is None:
+        node = _labels['node']
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit(Span(stage, node, artifact, start, time.perf_counter() - begin))
+
+
+@contextlib.contextmanager
+def node_label(node):
+    """ Labels the spans of the enclosed block with `node`. """
+    previous = _labels['node']
+    _labels['node'] = node
+    try:
+        yield
+    finally:
+        _labels['node'] = previous
+
+
+class Recorder:
+    """
+    Listener collecting the spans in a list.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, span):
+        self.spans.append(span)
+
+
+@contextlib.contextmanager
+def recording():
+    """
+    Records the spans of the enclosed block.
+
+    Returns:
+        `Recorder` with the spans.
+    """
+    recorder = Recorder()
+    add_listener(recorder)
+    try:
+        yield recorder
+    finally:
+        remove_listener(recorder)
+
+
+def _nested(parent, child, parent_index, child_index):
+    # Spans of other nodes only overlap because nodes run in parallel.
+    # Inner spans finish first, so of two spans with the same interval the
+    # one emitted first is nested in the other.
+    if parent.node is not None and child.node != parent.node:
+        return False
+    if child.start + child.duration > parent.start + parent.duration:
+        return False
+    if child.start == parent.start and child.duration == parent.duration:
+        return child_index < parent_index
+    return True
+
+
+def self_times(spans):
+    """
+    Duration of every span minus the time covered by the spans nested in it,
+    i.e. the spans of the same node, or of any node for shared stages,
+    which run within it.
+
+    Returns:
+        List of durations in seconds, in the order of `spans`.
+    """
+    order = sorted(range(len(spans)), key=lambda index: spans[index].start)
+    starts = [spans[index].start for index in order]
+    result = []
+    for parent_index, parent in enumerate(spans):
+        end = parent.start + parent.duration
+        intervals = []
+        for position in range(bisect.bisect_left(starts, parent.start),
+                              bisect.bisect_right(starts, end)):
+            child_index = order[position]
+            child = spans[child_index]
+            if child_index != parent_index and _nested(
+                    parent, child, parent_index, child_index):
+                intervals.append((child.start, child.start + child.duration))
+
+        covered = 0.0
+        covered_until = parent.start
+        for start, stop in sorted(intervals):
+            if stop > covered_until:
+                covered += stop - max(start, covered_until)
+                covered_until = stop
+        result.append(max(parent.duration - covered, 0.0))
+    return result
+
+
+def summarize(spans):
+    """
+    Aggregates spans by stage. Stages nest, so `total` counts the time of
+    nested stages again, while `self` only counts the time not spent in
+    nested spans. Unless nodes are generated in parallel, the `self` times
+    of all stages add up to the time covered by the spans.
+
+    Returns:
+        List of dictionaries with the `stage`, `count`, `total` and `self`
+        time and the `mean` and `max` duration, the stage with the highest
+        self time first.
+    """
+    durations = OrderedDict()
+    for recorded, self_time in zip(spans, self_times(spans)):
+        durations.setdefault(recorded.stage, []).append(
+            (recorded.duration, self_time))
+
+    summary = []
+    for stage, values in durations.items():
+        totals = [duration for duration, _ in values]
+        summary.append({
+            'stage': stage,
+            'count': len(values),
+            'total': sum(totals),
+            'self': sum(self_time for _, self_time in values),
+            'mean': sum(totals) / len(values),
+            'max': max(totals),
+        })
+    return sorted(summary, key=lambda stage: -stage['self'])
+
+
+def format_table(spans):
+    lines = ['{:<16} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'count', 'self', 'total', 'mean', 'max')]
+    for stage in summarize(spans):
+        lines.append(
+            '{:<16} {:>6} {:>9.3f}s {:>9.3f}s {:>9.3f}s {:>9.3f}s'.format(
+                stage['stage'], stage['count'], stage['self'],
+                stage['total'], stage['mean'], stage['max']))
+    return '\n'.join(lines)
+
+
+def format_json(spans):
+    return json.dumps(
+        {
+            'stages': summarize(spans),
+            'spans': [recorded._asdict() for recorded in spans],
+        },
+        indent=2)
+
+
+def format_report(spans, output_format):
+    """ Formats spans as `table` or `json`, see `FORMATS`. """
+    if output_format == 'json':
+        return format_json(spans)
+    return format_table(spans)
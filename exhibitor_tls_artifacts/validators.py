@@ -1,6 +1,10 @@
 import click
+import datetime
+import re
 from pathlib import Path
 
+DURATION_UNITS = {'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
 
 def validate_dir_missing(ctx, param, value):
     """ click validator to ensure that artifacts directory does not exist """
@@ -13,3 +17,47 @@ def validate_dir_missing(ctx, param, value):
             message="Artifacts location '{}' already exists.".format(value))
 
     return path
+
+
+def validate_artifact_dir(ctx, param, value):
+    """ click validator to ensure that an artifacts directory exists """
+    assert ctx or param  # For linting
+
+    path = Path(value)
+
+    if not (path / 'root-cert.pem').is_file():
+        raise click.BadParameter(
+            message="Artifacts location '{}' does not contain generated "
+            "artifacts.".format(value))
+
+    return path
+
+
+def validate_duration(ctx, param, value):
+    """ click validator converting durations like `30d`, `12h` or `2w` to
+    a timedelta. Numbers without a unit are days. """
+    assert ctx or param  # For linting
+
+    match = re.match(r'^(\d+)([hdw]?)$', str(value).strip())
+    if match is None:
+        raise click.BadParameter(
+            message="'{}' is not a duration like 30d, 12h or 2w.".format(value))
+
+    unit = DURATION_UNITS[match.group(2) or 'd']
+    return datetime.timedelta(**{unit: int(match.group(1))})
+
+
+def validate_serials(ctx, param, value):
+    """ click validator normalizing hexadecimal serial numbers, optionally
+    separated by colons like `openssl` prints them. """
+    assert ctx or param  # For linting
+
+    serials = []
+    for serial in value:
+        try:
+            serials.append(format(int(serial.replace(':', ''), 16), 'x'))
+        except ValueError:
+            raise click.BadParameter(
+                message="'{}' is not a hexadecimal serial number.".format(
+                    serial))
+    return tuple(serials)
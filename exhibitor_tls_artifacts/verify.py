@@ -0,0 +1,403 @@
+"""
+Verification of an artifact directory before it is shipped to the masters.
+
+Every node directory is checked in a separate worker process. Certificates,
+keys and keystores are parsed in-process, no `keytool` is started. Node
+certificates revoked in the issuance database are reported as problems.
+"""
+import hashlib
+import ipaddress
+import stat
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from . import jks
+from .artifacts import (CERT_MODE, INTERMEDIATE_CERT_FILE,
+                        INTERMEDIATE_KEY_FILE, KEY_MODE, ROOT_CERT_FILE,
+                        ROOT_KEY_FILE, STORE_MODE, TRUSTSTORE_FILE)
+from .gen_certificates import (load_pem_chain, public_key_der,
+                               subject_alternative_names, verify_chain,
+                               verify_signature)
+from .gen_stores import DEFAULT_PASSWORD
+from .manifest import load_manifest
+from .revocation import (CRL_FILE, DELTA_CRL_FILE, ISSUED_DB_FILE,
+                         IssuanceDB, serial_hex)
+
+NODE_FILE_MODES = {
+    'client-cert.pem': CERT_MODE,
+    'client-key.pem': KEY_MODE,
+    'clientstore.jks': STORE_MODE,
+    'serverstore.jks': STORE_MODE,
+    ROOT_CERT_FILE: CERT_MODE,
+    TRUSTSTORE_FILE: STORE_MODE,
+}
+
+ROOT_FILE_MODES = {
+    ROOT_CERT_FILE: CERT_MODE,
+    ROOT_KEY_FILE: KEY_MODE,
+    INTERMEDIATE_CERT_FILE: CERT_MODE,
+    INTERMEDIATE_KEY_FILE: KEY_MODE,
+    TRUSTSTORE_FILE: STORE_MODE,
+    ISSUED_DB_FILE: CERT_MODE,
+    CRL_FILE: CERT_MODE,
+    DELTA_CRL_FILE: CERT_MODE,
+}
+
+# Same as `gen_artifacts.SANS`, every node certificate also has the node
+# name as subject alternative name.
+REQUIRED_SANS = ['localhost', 'exhibitor', '127.0.0.1']
+
+# Raised by damaged certificates, keys and keystores.
+PARSE_ERRORS = (ValueError, IndexError, TypeError, jks.KeystoreError)
+
+
+def verified_nodes(directory):
+    """
+    Names of the node directories to verify: every directory which is not
+    hidden, also if its files are missing.
+    """
+    return sorted(path.name for path in Path(directory).iterdir()
+                  if path.is_dir() and not path.name.startswith('.'))
+
+
+def load_certs(data):
+    """ Certificates of a `pem` file, at least one. """
+    certs = load_pem_chain(data)
+    if not certs:
+        raise ValueError('no certificate found')
+    return certs
+
+
+def load_key(data):
+    return serialization.load_pem_private_key(data, None, default_backend())
+
+
+def _parse(load, data, description, problems):
+    """
+    Parses `data` with `load`. Failures are added to `problems`.
+
+    Returns:
+        The parsed object or `None`.
+    """
+    try:
+        return load(data)
+    except PARSE_ERRORS as e:
+        problems.append('{} cannot be parsed: {}'.format(
+            description, e or type(e).__name__))
+        return None
+
+
+def _check_modes(directory, modes, prefix, problems, optional=()):
+    for name, mode in sorted(modes.items()):
+        path = Path(directory) / name
+        if not path.is_file():
+            if name not in optional:
+                problems.append('{}{} is missing'.format(prefix, name))
+            continue
+        actual = stat.S_IMODE(path.stat().st_mode)
+        if actual != mode:
+            problems.append('{}{} has mode {:04o}, expected {:04o}'.format(
+                prefix, name, actual, mode))
+
+
+def _check_cert(cert, name, node, issuer_cert, problems, revoked=()):
+    prefix = '{}: {} certificate'.format(node, name)
+    if serial_hex(cert.serial_number) in revoked:
+        problems.append('{} is revoked'.format(prefix))
+    issuer = 'root' if issuer_cert.issuer == issuer_cert.subject \
+        else 'intermediate CA'
+    if cert.issuer != issuer_cert.subject:
+        problems.append('{} is not issued by the {}'.format(prefix, issuer))
+    else:
+        try:
+            verify_signature(cert, issuer_cert.public_key())
+        except InvalidSignature:
+            problems.append('{} is not signed by the {} key'.format(
+                prefix, issuer))
+
+    expected = REQUIRED_SANS + [node]
+    sans = subject_alternative_names(cert)
+    normalized = set()
+    for san in sans:
+        try:
+            normalized.add(str(ipaddress.ip_address(san)))
+        except ValueError:
+            normalized.add(san)
+    missing = [san for san in expected if san not in normalized]
+    if missing:
+        problems.append('{} is missing the SANs {}'.format(
+            prefix, ', '.join(missing)))
+
+
+def _load_store(path, problems, prefix):
+    try:
+        return jks.loads(path.read_bytes(), DEFAULT_PASSWORD)
+    except (OSError, jks.KeystoreError) as e:
+        problems.append('{}: {}'.format(prefix, e))
+        return None
+
+
+def _check_entitystore(path, alias, node, problems, chain=()):
+    """
+    Checks the key entry of an entitystore, whose certificate must be
+    followed by the certificates of `chain`, and returns its certificate.
+    """
+    prefix = '{}: {}'.format(node, path.name)
+    entries = _load_store(path, problems, prefix)
+    if entries is None:
+        return None
+
+    if [(type(e), e.alias) for e in entries] != [(jks.PrivateKeyEntry, alias)]:
+        problems.append('{} must only contain the key entry {}'.format(
+            prefix, alias))
+        return None
+
+    entry = entries[0]
+    cert = _parse(
+        lambda chain: x509.load_der_x509_certificate(chain[0],
+                                                     default_backend()),
+        entry.cert_chain, prefix + ' certificate', problems)
+    key = _parse(
+        lambda data: serialization.load_der_private_key(
+            data, None, default_backend()), entry.key, prefix + ' key',
+        problems)
+    if cert is None or key is None:
+        return None
+    if public_key_der(key) != public_key_der(cert.public_key()):
+        problems.append('{}: key does not match certificate'.format(prefix))
+    if list(entry.cert_chain[1:]) != [
+            c.public_bytes(serialization.Encoding.DER) for c in chain
+    ]:
+        problems.append('{}: certificate chain does not lead to the '
+                        'root'.format(prefix))
+    return cert
+
+
+def _check_truststore(path, root_cert, prefix, problems):
+    entries = _load_store(path, problems, prefix + path.name)
+    if entries is None:
+        return
+
+    root_der = root_cert.public_bytes(serialization.Encoding.DER)
+    if [(type(e), e.alias) for e in entries] != [(jks.TrustedCertEntry,
+                                                  'root-cert')] or \
+            entries[0].cert != root_der:
+        problems.append('{}{} must only contain the root certificate as '
+                        'root-cert'.format(prefix, path.name))
+
+
+def verify_node(directory, node, root_cert_data,
+                intermediate_cert_data=None, revoked=frozenset()):
+    """
+    Verifies the artifacts of a single node. This is a module level function
+    so that it can be run in a worker process. With `intermediate_cert_data`
+    the certificates must be issued by the intermediate CA. The certificates
+    must not have one of the `revoked` serials.
+
+    Returns:
+        List of problems found.
+    """
+    problems = []
+    node_path = Path(directory) / node
+    root_cert = x509.load_pem_x509_certificate(root_cert_data,
+                                               default_backend())
+    # Certificates presented after the node certificates, and the chain in
+    # the keystores, see `gen_certificates.store_chain`.
+    intermediates = []
+    store_chain = []
+    issuer_cert = root_cert
+    if intermediate_cert_data is not None:
+        issuer_cert = load_pem_chain(intermediate_cert_data)[0]
+        intermediates = [issuer_cert]
+        store_chain = [issuer_cert, root_cert]
+
+    _check_modes(node_path, NODE_FILE_MODES, node + '/', problems)
+
+    node_root_path = node_path / ROOT_CERT_FILE
+    if node_root_path.is_file() and \
+            node_root_path.read_bytes() != root_cert_data:
+        problems.append('{}: root-cert.pem differs from the root '
+                        'certificate'.format(node))
+
+    cert_path = node_path / 'client-cert.pem'
+    key_path = node_path / 'client-key.pem'
+    client_certs = None
+    if cert_path.is_file():
+        client_certs = _parse(load_certs, cert_path.read_bytes(),
+                              node + ': client-cert.pem', problems)
+    if client_certs is not None:
+        client_cert = client_certs[0]
+        _check_cert(client_cert, 'client', node, issuer_cert, problems,
+                    revoked)
+        if client_certs[1:] != intermediates:
+            problems.append('{}: client-cert.pem must be followed by {} '
+                            'intermediate certificates'.format(
+                                node, len(intermediates)))
+        client_key = None
+        if key_path.is_file():
+            client_key = _parse(load_key, key_path.read_bytes(),
+                                node + ': client-key.pem', problems)
+        if client_key is not None:
+            if public_key_der(client_key) != public_key_der(
+                    client_cert.public_key()):
+                problems.append(
+                    '{}: client-key.pem does not match client-cert.pem'.format(
+                        node))
+
+        store_path = node_path / 'clientstore.jks'
+        if store_path.is_file():
+            store_cert = _check_entitystore(store_path, 'client-cert', node,
+                                            problems, store_chain)
+            if store_cert is not None and store_cert != client_cert:
+                problems.append('{}: clientstore.jks does not contain '
+                                'client-cert.pem'.format(node))
+
+    store_path = node_path / 'serverstore.jks'
+    if store_path.is_file():
+        server_cert = _check_entitystore(store_path, 'server-cert', node,
+                                         problems, store_chain)
+        if server_cert is not None:
+            _check_cert(server_cert, 'server', node, issuer_cert, problems,
+                        revoked)
+
+    truststore_path = node_path / TRUSTSTORE_FILE
+    if truststore_path.is_file():
+        _check_truststore(truststore_path, root_cert, node + '/', problems)
+
+    return problems
+
+
+def _check_manifest(directory, problems):
+    manifest = load_manifest(directory)
+    if manifest is None:
+        return
+
+    for path, entry in sorted(manifest['artifacts'].items()):
+        full_path = Path(directory) / path
+        if not full_path.is_file():
+            problems.append('{} is listed in the manifest but missing'.format(
+                path))
+        elif hashlib.sha256(full_path.read_bytes()).hexdigest() != \
+                entry['sha256']:
+            problems.append('{} does not match the manifest'.format(path))
+
+
+def _check_intermediate(directory, root_cert, problems):
+    """
+    Checks the intermediate CA of an artifact directory, if it has one.
+
+    Returns:
+        `intermediate-cert.pem` as `bytes` or `None`.
+    """
+    cert_path = directory / INTERMEDIATE_CERT_FILE
+    if not cert_path.is_file():
+        return None
+
+    data = cert_path.read_bytes()
+    try:
+        certs = load_pem_chain(data)
+    except PARSE_ERRORS:
+        certs = []
+    if not certs or certs[1:] != [root_cert]:
+        problems.append('{} must contain the intermediate certificate '
+                        'followed by the root certificate'.format(
+                            INTERMEDIATE_CERT_FILE))
+        return None
+
+    try:
+        verify_chain(certs[:1], root_cert)
+    except InvalidSignature:
+        problems.append('{} is not signed by the root'.format(
+            INTERMEDIATE_CERT_FILE))
+
+    key_path = directory / INTERMEDIATE_KEY_FILE
+    key = None
+    if key_path.is_file():
+        key = _parse(load_key, key_path.read_bytes(), INTERMEDIATE_KEY_FILE,
+                     problems)
+    if key is not None:
+        if public_key_der(key) != public_key_der(certs[0].public_key()):
+            problems.append('{} does not match {}'.format(
+                INTERMEDIATE_KEY_FILE, INTERMEDIATE_CERT_FILE))
+    return data
+
+
+def verify_tree(directory, jobs=1):
+    """
+    Verifies an artifact directory.
+
+    Returns:
+        (nodes, problems) tuple of the verified node names and the problems
+        found.
+    """
+    directory = Path(directory)
+    problems = []
+
+    _check_modes(directory, ROOT_FILE_MODES, '', problems,
+                 optional=(ROOT_KEY_FILE, INTERMEDIATE_CERT_FILE,
+                           INTERMEDIATE_KEY_FILE, ISSUED_DB_FILE, CRL_FILE,
+                           DELTA_CRL_FILE))
+    nodes = verified_nodes(directory)
+    root_cert_path = directory / ROOT_CERT_FILE
+    if not root_cert_path.is_file():
+        return nodes, problems
+    root_cert_data = root_cert_path.read_bytes()
+    root_cert = _parse(
+        lambda data: x509.load_pem_x509_certificate(data, default_backend()),
+        root_cert_data, ROOT_CERT_FILE, problems)
+    if root_cert is None:
+        # The nodes cannot be checked without the root.
+        return nodes, problems
+    try:
+        verify_signature(root_cert, root_cert.public_key())
+    except InvalidSignature:
+        problems.append('root-cert.pem is not self signed')
+
+    if (directory / TRUSTSTORE_FILE).is_file():
+        _check_truststore(directory / TRUSTSTORE_FILE, root_cert, '',
+                          problems)
+
+    root_key_path = directory / ROOT_KEY_FILE
+    root_key = None
+    if root_key_path.is_file():
+        root_key = _parse(load_key, root_key_path.read_bytes(), ROOT_KEY_FILE,
+                          problems)
+    if root_key is not None:
+        if public_key_der(root_key) != public_key_der(root_cert.public_key()):
+            problems.append('root-key.pem does not match root-cert.pem')
+
+    intermediate_cert_data = _check_intermediate(directory, root_cert,
+                                                 problems)
+
+    _check_manifest(directory, problems)
+
+    revoked = frozenset()
+    if (directory / ISSUED_DB_FILE).is_file():
+        with IssuanceDB(directory / ISSUED_DB_FILE) as database:
+            revoked = frozenset(database.revoked_serials())
+
+    if jobs == 1 or len(nodes) <= 1:
+        results = [
+            verify_node(directory, node, root_cert_data,
+                        intermediate_cert_data, revoked) for node in nodes
+        ]
+    else:
+        workers = min(jobs, len(nodes))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(verify_node, [str(directory)] * len(nodes), nodes,
+                             [root_cert_data] * len(nodes),
+                             [intermediate_cert_data] * len(nodes),
+                             [revoked] * len(nodes)))
+
+    for node_problems in results:
+        problems.extend(node_problems)
+
+    return nodes, problems
+
@@ -25,7 +25,7 @@ setup(
     keywords='exhibitor tls artifact mesosphere',
     entry_points={
         'console_scripts': [
-            'exhibitor-tls-artifacts=exhibitor_tls_artifacts.gen_artifacts:app'
+            'exhibitor-tls-artifacts=exhibitor_tls_artifacts.gen_artifacts:cli'
         ],
     },
 )
@@ -0,0 +1,112 @@
+import io
+import os
+import pytest
+import stat
+import tarfile
+
+from exhibitor_tls_artifacts.artifacts import (Artifact, group_by_node,
+                                               write_archive,
+                                               write_archive_file,
+                                               write_artifacts)
+
+
+class TestWriteArtifacts:
+    """
+    Test writing in-memory artifacts to the output directory.
+    """
+
+    def test_modes(self, tmp_path):
+        umask = os.umask(0o077)
+        try:
+            write_artifacts(tmp_path, [
+                Artifact('node/cert.pem', b'cert', 0o644),
+                Artifact('node/key.pem', b'key', 0o600),
+            ])
+        finally:
+            os.umask(umask)
+
+        assert (tmp_path / 'node' / 'cert.pem').read_bytes() == b'cert'
+        assert stat.S_IMODE(
+            (tmp_path / 'node' / 'cert.pem').stat().st_mode) == 0o644
+        assert stat.S_IMODE(
+            (tmp_path / 'node' / 'key.pem').stat().st_mode) == 0o600
+
+    def test_existing_file(self, tmp_path):
+        (tmp_path / 'cert.pem').write_bytes(b'old')
+
+        with pytest.raises(FileExistsError):
+            write_artifacts(tmp_path, [Artifact('cert.pem', b'new', 0o644)])
+        assert (tmp_path / 'cert.pem').read_bytes() == b'old'
+
+    @pytest.mark.parametrize('link_shared', ['copy', 'hardlink', 'reflink'])
+    @pytest.mark.parametrize('overwrite', [False, True])
+    def test_link_shared(self, tmp_path, link_shared, overwrite):
+        write_artifacts(tmp_path, [
+            Artifact('root-cert.pem', b'root', 0o644),
+            Artifact('node1/root-cert.pem', b'root', 0o644),
+            Artifact('node2/root-cert.pem', b'root', 0o644),
+            Artifact('node2/other.pem', b'root', 0o600),
+        ], overwrite=overwrite, link_shared=link_shared)
+
+        paths = ['root-cert.pem', 'node1/root-cert.pem', 'node2/root-cert.pem']
+        inodes = {(tmp_path / path).stat().st_ino for path in paths}
+        assert len(inodes) == (1 if link_shared == 'hardlink' else 3)
+        for path in paths:
+            assert (tmp_path / path).read_bytes() == b'root'
+            assert stat.S_IMODE((tmp_path / path).stat().st_mode) == 0o644
+        assert stat.S_IMODE(
+            (tmp_path / 'node2' / 'other.pem').stat().st_mode) == 0o600
+        assert (tmp_path / 'node2' / 'other.pem').stat().st_nlink == 1
+
+
+class TestWriteArchive:
+    """
+    Test streaming in-memory artifacts into archives.
+    """
+
+    ARTIFACTS = [
+        Artifact('root-cert.pem', b'root', 0o644),
+        Artifact('node/cert.pem', b'cert', 0o644),
+        Artifact('node/key.pem', b'key', 0o600),
+    ]
+
+    @pytest.mark.parametrize('archive_format', ['tar', 'tgz'])
+    def test_archive(self, archive_format):
+        stream = io.BytesIO()
+        write_archive(stream, self.ARTIFACTS, archive_format)
+
+        stream.seek(0)
+        with tarfile.open(fileobj=stream) as archive:
+            members = [(member.name, member.isdir(), member.mode)
+                       for member in archive.getmembers()]
+            assert archive.extractfile('node/key.pem').read() == b'key'
+        assert members == [('root-cert.pem', False, 0o644),
+                           ('node', True, 0o755),
+                           ('node/cert.pem', False, 0o644),
+                           ('node/key.pem', False, 0o600)]
+
+    def test_archive_hardlinks(self, tmp_path):
+        artifacts = self.ARTIFACTS + [Artifact('node/root-cert.pem', b'root',
+                                               0o644)]
+        path = tmp_path / 'artifacts.tar'
+        write_archive_file(path, artifacts, link_shared='hardlink')
+
+        with tarfile.open(str(path)) as archive:
+            member = archive.getmember('node/root-cert.pem')
+            assert member.islnk() and member.linkname == 'root-cert.pem'
+            archive.extractall(str(tmp_path / 'extracted'))
+        assert (tmp_path / 'extracted' / 'node' /
+                'root-cert.pem').read_bytes() == b'root'
+
+    def test_archive_file(self, tmp_path):
+        path = tmp_path / 'artifacts.tar'
+        write_archive_file(path, self.ARTIFACTS)
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+        with pytest.raises(FileExistsError):
+            write_archive_file(path, self.ARTIFACTS)
+
+    def test_group_by_node(self):
+        shared, nodes = group_by_node(self.ARTIFACTS)
+        assert shared == self.ARTIFACTS[:1]
+        assert list(nodes.items()) == [('node', self.ARTIFACTS[1:])]
@@ -0,0 +1,197 @@
+import json
+
+import pytest
+import yaml
+
+from click.testing import CliRunner
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.x509.oid import NameOID
+
+from exhibitor_tls_artifacts.batch import (SpecError, format_reports,
+                                           generate_batch, load_spec,
+                                           parse_spec)
+from exhibitor_tls_artifacts.gen_artifacts import cli
+from exhibitor_tls_artifacts.verify import verify_tree
+
+SPEC = {
+    'defaults': {
+        'key_type': 'ecdsa',
+        'subject': {
+            'organization': 'Example Inc.'
+        },
+    },
+    'clusters': [{
+        'name': 'prod',
+        'sans': ['exhibitor.prod.example.com'],
+        'subject': {
+            'country': 'DE',
+            'locality': 'Hamburg'
+        },
+        'keep_root_key': True,
+        'masters': [
+            '10.0.0.1', {
+                'address': '10.0.0.2',
+                'sans': ['master2.prod.example.com']
+            }
+        ],
+    }, {
+        'name': 'staging',
+        'output': 'out/staging',
+        'masters': ['10.1.0.1'],
+    }],
+}
+
+
+def load_cert(path):
+    return x509.load_pem_x509_certificate(path.read_bytes(),
+                                          default_backend())
+
+
+def subject_field(cert, oid):
+    return cert.subject.get_attributes_for_oid(oid)[0].value
+
+
+def with_cluster(**fields):
+    spec = json.loads(json.dumps(SPEC))
+    spec['clusters'][0].update(fields)
+    return spec
+
+
+class TestBatch:
+    """
+    Test generating the artifacts of many clusters from a spec.
+    """
+
+    def test_parse_spec(self, tmp_path):
+        prod, staging = parse_spec(SPEC, tmp_path)
+
+        assert prod.output_directory == tmp_path / 'prod'
+        assert prod.masters == [
+            ('10.0.0.1', ('exhibitor.prod.example.com', )),
+            ('10.0.0.2', ('exhibitor.prod.example.com',
+                          'master2.prod.example.com')),
+        ]
+        assert prod.subject == {
+            'country': 'DE',
+            'locality': 'Hamburg',
+            'organization': 'Example Inc.',
+        }
+        assert prod.key_type == 'ecdsa'
+        assert prod.keep_root_key
+
+        assert staging.output_directory == tmp_path / 'out' / 'staging'
+        assert staging.subject == {'organization': 'Example Inc.'}
+        assert not staging.keep_root_key
+
+    @pytest.mark.parametrize('spec, message', [
+        ({}, 'list of clusters'),
+        ({'clusters': []}, 'does not list any clusters'),
+        (with_cluster(colour='red'), 'unknown keys: colour'),
+        (with_cluster(name='staging'), 'same names: staging'),
+        (with_cluster(output='out/staging'), 'same outputs'),
+        (with_cluster(masters=[]), 'non-empty list'),
+        (with_cluster(masters=['10.0.0.1', '10.0.0.1']), 'more than once'),
+        (with_cluster(masters=[{'sans': ['a']}]), 'address'),
+        (with_cluster(subject={'country': 'Germany'}), 'two letter'),
+        (with_cluster(subject={'email': 'a@b.c'}), 'unknown fields: email'),
+        (with_cluster(key_size=1024), 'prod'),
+        (with_cluster(validity_days=0), 'validity_days'),
+    ])
+    def test_invalid_spec(self, tmp_path, spec, message):
+        with pytest.raises(SpecError) as e:
+            parse_spec(spec, tmp_path)
+        assert message in str(e.value)
+
+    def test_existing_output(self, tmp_path):
+        (tmp_path / 'prod').mkdir()
+        with pytest.raises(SpecError) as e:
+            parse_spec(SPEC, tmp_path)
+        assert 'already exists' in str(e.value)
+
+    @pytest.mark.parametrize('jobs', [1, 3])
+    def test_generate_batch(self, tmp_path, jobs):
+        clusters = parse_spec(SPEC, tmp_path)
+        reports = list(generate_batch(clusters, jobs))
+
+        assert sorted(report.name for report in reports) == [
+            'prod', 'staging'
+        ]
+        assert all(report.error is None for report in reports)
+
+        prod = tmp_path / 'prod'
+        assert (prod / 'root-key.pem').is_file()
+        assert not (tmp_path / 'out' / 'staging' / 'root-key.pem').exists()
+        for directory, nodes in ((prod, ['10.0.0.1', '10.0.0.2']),
+                                 (tmp_path / 'out' / 'staging',
+                                  ['10.1.0.1'])):
+            found, problems = verify_tree(directory, 1)
+            assert (sorted(found), problems) == (nodes, [])
+
+        # Each cluster has its own root.
+        assert (prod / 'root-cert.pem').read_bytes() != (
+            tmp_path / 'out' / 'staging' / 'root-cert.pem').read_bytes()
+
+        cert = load_cert(prod / '10.0.0.2' / 'client-cert.pem')
+        assert subject_field(cert, NameOID.COUNTRY_NAME) == 'DE'
+        assert subject_field(cert, NameOID.LOCALITY_NAME) == 'Hamburg'
+        assert subject_field(cert, NameOID.ORGANIZATION_NAME) == \
+            'Example Inc.'
+        sans = cert.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value.get_values_for_type(
+                x509.DNSName)
+        assert {'exhibitor.prod.example.com',
+                'master2.prod.example.com'} <= set(sans)
+
+    def test_failing_cluster(self, tmp_path):
+        clusters = parse_spec(SPEC, tmp_path)
+        # The output of `prod` appears while the batch runs.
+        (tmp_path / 'prod').mkdir()
+
+        reports = {
+            report.name: report
+            for report in generate_batch(clusters, 1)
+        }
+        assert reports['prod'].error is not None
+        assert reports['staging'].error is None
+        assert list((tmp_path / 'prod').iterdir()) == []
+        assert (tmp_path / 'out' / 'staging' / 'root-cert.pem').is_file()
+
+        table = format_reports(
+            [reports['prod'], reports['staging']]).splitlines()
+        assert table[1].split()[:2] == ['prod', '2']
+        assert table[1].split()[3] == 'failed'
+        assert table[2].split()[3] == 'ok'
+
+    def test_load_spec(self, tmp_path):
+        spec = tmp_path / 'spec.yaml'
+        spec.write_text(yaml.safe_dump(SPEC))
+        assert [cluster.name for cluster in load_spec(spec)] == [
+            'prod', 'staging'
+        ]
+
+        spec.write_text('clusters: [')
+        with pytest.raises(SpecError) as e:
+            load_spec(spec)
+        assert 'not valid YAML' in str(e.value)
+
+    def test_batch_command(self, tmp_path):
+        spec = tmp_path / 'spec.yaml'
+        spec.write_text(yaml.safe_dump(SPEC))
+
+        runner = CliRunner(mix_stderr=False)
+        result = runner.invoke(
+            cli, ['batch', '-j', '2', '--report-format', 'json',
+                  str(spec)])
+        assert result.exit_code == 0, result.output
+
+        reports = json.loads(result.stdout)
+        assert [report['name'] for report in reports] == ['prod', 'staging']
+        assert reports[1]['output_directory'] == str(tmp_path / 'out' /
+                                                     'staging')
+        assert [report['nodes'] for report in reports] == [2, 1]
+
+        # The outputs exist now.
+        result = runner.invoke(cli, ['batch', str(spec)])
+        assert result.exit_code == 2
+        assert 'already exists' in result.stderr
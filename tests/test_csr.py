@@ -0,0 +1,173 @@
+import pytest
+
+from click.testing import CliRunner
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from exhibitor_tls_artifacts.artifacts import write_artifacts
+from exhibitor_tls_artifacts.csr import (RequestError, build_request,
+                                         build_stores, create_requests,
+                                         load_requests, sign_requests)
+from exhibitor_tls_artifacts.ensemble import create_intermediate, create_root
+from exhibitor_tls_artifacts.gen_artifacts import cli
+from exhibitor_tls_artifacts.gen_certificates import (
+    generate_private_key, subject_alternative_names)
+from exhibitor_tls_artifacts.revocation import open_database
+from exhibitor_tls_artifacts.verify import verify_tree
+
+NODES = ['10.0.0.1', '10.0.0.2']
+SANS = ['localhost', 'exhibitor', '127.0.0.1']
+
+
+def write_request(directory, node, name, key, sa_names):
+    request = build_request(name, key, sa_names)
+    (directory / node).mkdir(exist_ok=True)
+    (directory / node / (name + '.csr')).write_bytes(
+        request.public_bytes(serialization.Encoding.PEM))
+
+
+class TestCSR:
+    """
+    Test issuing certificates for keys generated on the masters.
+    """
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_sign_and_build_stores(self, tmp_path, jobs):
+        for node in NODES:
+            write_artifacts(
+                tmp_path,
+                create_requests(node, 'ecdsa', extra_sans=['m.example.com']))
+
+        node_requests, problems = load_requests(tmp_path)
+        assert problems == []
+        assert [node_request.node for node_request in node_requests] == NODES
+
+        root, truststore = create_root('ecdsa')
+        artifacts = sign_requests(node_requests, root, truststore, 30, jobs)
+        write_artifacts(tmp_path, artifacts, overwrite=True)
+
+        for node in NODES:
+            build_stores(tmp_path / node)
+            assert not (tmp_path / node / 'server-key.pem').exists()
+            assert not (tmp_path / node / 'client.csr').exists()
+
+        nodes, problems = verify_tree(tmp_path, jobs)
+        assert (nodes, problems) == (NODES, [])
+
+        cert = x509.load_pem_x509_certificate(
+            (tmp_path / NODES[0] / 'client-cert.pem').read_bytes(),
+            default_backend())
+        assert sorted(subject_alternative_names(cert)) == sorted(
+            SANS + [NODES[0], 'm.example.com'])
+        assert cert.issuer == root.cert.subject
+
+    def test_sign_with_intermediate(self, tmp_path):
+        write_artifacts(tmp_path, create_requests(NODES[0], 'ecdsa'))
+        node_requests, _ = load_requests(tmp_path)
+        root, truststore = create_root('ecdsa')
+        intermediate = create_intermediate(root, 'ecdsa')
+        write_artifacts(tmp_path,
+                        sign_requests(node_requests, intermediate, truststore),
+                        overwrite=True)
+        build_stores(tmp_path / NODES[0])
+
+        assert (tmp_path / 'intermediate-cert.pem').is_file()
+        assert verify_tree(tmp_path, 1) == ([NODES[0]], [])
+        cert = x509.load_pem_x509_certificate(
+            (tmp_path / NODES[0] / 'client-cert.pem').read_bytes(),
+            default_backend())
+        assert cert.issuer == intermediate.cert.subject
+
+    def test_invalid_requests(self, tmp_path):
+        key = generate_private_key(256, 'ecdsa')
+        write_request(tmp_path, NODES[0], 'client', key, SANS + [NODES[0]])
+        # Another node's address and a missing SAN.
+        write_request(tmp_path, NODES[0], 'server', key,
+                      ['localhost', '127.0.0.1', NODES[0], NODES[1]])
+        weak_key = rsa.generate_private_key(65537, 1024, default_backend())
+        write_request(tmp_path, NODES[1], 'client', weak_key,
+                      SANS + [NODES[1]])
+
+        node_requests, problems = load_requests(tmp_path)
+        assert [node_request.node for node_request in node_requests] == NODES
+        assert problems == [
+            '10.0.0.1: server request requests the IP address 10.0.0.2 '
+            'which is not the node',
+            '10.0.0.1: server request is missing the SANs exhibitor',
+            '10.0.0.2: client request has an unsupported key: RSA keys must '
+            'have at least 2048 bits',
+            '10.0.0.2/server.csr is missing',
+        ]
+
+    def test_build_stores_mismatch(self, tmp_path):
+        write_artifacts(tmp_path, create_requests(NODES[0], 'ecdsa'))
+        node_requests, _ = load_requests(tmp_path)
+        root, truststore = create_root('ecdsa')
+        write_artifacts(tmp_path, sign_requests(node_requests, root,
+                                                truststore),
+                        overwrite=True)
+
+        node_path = tmp_path / NODES[0]
+        (node_path / 'client-key.pem').write_bytes(
+            (node_path / 'server-key.pem').read_bytes())
+        with pytest.raises(RequestError) as e:
+            build_stores(node_path)
+        assert 'client-cert.pem does not match client-key.pem' in str(e.value)
+        assert not (node_path / 'clientstore.jks').exists()
+
+    def test_commands(self, tmp_path):
+        runner = CliRunner(mix_stderr=False)
+        ca = tmp_path / 'ca'
+        result = runner.invoke(cli, [
+            '--key-type', 'ecdsa', '--keep-root-key', '-d',
+            str(ca), '10.9.9.9'
+        ])
+        assert result.exit_code == 0, result.output
+
+        csrs = tmp_path / 'csrs'
+        for node in NODES:
+            result = runner.invoke(cli, [
+                'create-csrs', '--key-type', 'ecdsa', '-d',
+                str(csrs), node
+            ])
+            assert result.exit_code == 0, result.output
+
+        result = runner.invoke(cli, ['create-csrs', '-d', str(csrs), NODES[0]])
+        assert result.exit_code == 2
+        assert 'already exists' in result.stderr
+
+        result = runner.invoke(
+            cli, ['sign-csrs', '-d', str(ca), '-j', '1',
+                  str(csrs)])
+        assert result.exit_code == 0, result.output
+        # The signed certificates can be revoked with the CA directory.
+        with open_database(ca) as database:
+            assert len(database.find(node=NODES[0])) == 2
+
+        for node in NODES:
+            result = runner.invoke(cli, ['build-stores', str(csrs / node)])
+            assert result.exit_code == 0, result.output
+
+        result = runner.invoke(cli, ['verify', str(csrs)])
+        assert result.exit_code == 0, result.output
+
+    def test_sign_invalid_requests(self, tmp_path):
+        runner = CliRunner(mix_stderr=False)
+        ca = tmp_path / 'ca'
+        runner.invoke(cli, [
+            '--key-type', 'ecdsa', '--keep-root-key', '-d',
+            str(ca), '10.9.9.9'
+        ])
+        csrs = tmp_path / 'csrs'
+        csrs.mkdir()
+        write_artifacts(csrs, create_requests(NODES[0], 'ecdsa'))
+        write_request(csrs, NODES[1], 'client',
+                      generate_private_key(256, 'ecdsa'), ['localhost'])
+
+        result = runner.invoke(cli, ['sign-csrs', '-d', str(ca), str(csrs)])
+        assert result.exit_code == 1
+        assert 'Found 2 problems' in result.stderr
+        # Nothing is signed.
+        assert not (csrs / NODES[0] / 'client-cert.pem').exists()
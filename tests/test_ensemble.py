@@ -0,0 +1,128 @@
+import subprocess
+import sys
+
+import pytest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from exhibitor_tls_artifacts import (DuplicateNodeError, create_intermediate,
+                                     create_root, generate_ensemble,
+                                     iter_ensemble, load_ca)
+from exhibitor_tls_artifacts import jks
+from exhibitor_tls_artifacts.gen_certificates import (
+    cert_pem, key_pem, load_pem_chain, subject_alternative_names,
+    verify_signature)
+from exhibitor_tls_artifacts.gen_stores import DEFAULT_PASSWORD
+
+NODES = ['10.10.10.10', '10.10.10.11']
+FILES = ['client-cert.pem', 'client-key.pem', 'clientstore.jks',
+         'serverstore.jks', 'root-cert.pem', 'truststore.jks']
+
+
+def load_cert(data):
+    return x509.load_pem_x509_certificate(data, default_backend())
+
+
+class TestEnsemble:
+    """
+    Test the library API generating artifacts in memory.
+    """
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_generate(self, tmp_path, monkeypatch, jobs):
+        monkeypatch.chdir(str(tmp_path))
+        ensemble = generate_ensemble(NODES, jobs=jobs, key_type='ecdsa')
+
+        assert [bundle.node for bundle in ensemble.nodes] == NODES
+        root_cert = load_cert(ensemble.root_cert)
+        for bundle in ensemble.nodes:
+            assert list(bundle.files) == FILES
+            assert bundle.files['root-cert.pem'] == ensemble.root_cert
+            assert bundle.files['truststore.jks'] == ensemble.truststore
+            client_cert = load_cert(bundle.files['client-cert.pem'])
+            verify_signature(client_cert, root_cert.public_key())
+            assert bundle.node in subject_alternative_names(client_cert)
+
+            entries = jks.loads(bundle.files['serverstore.jks'],
+                                DEFAULT_PASSWORD)
+            assert [entry.alias for entry in entries] == ['server-cert']
+        assert b'PRIVATE KEY' in ensemble.root_key
+        assert list(tmp_path.iterdir()) == []
+
+    def test_iter(self):
+        root, truststore = create_root(key_type='ecdsa')
+        nodes = iter([('10.10.10.10', ['master1.example.com']),
+                      '10.10.10.11'])
+        bundles = list(iter_ensemble(nodes, root, truststore,
+                                     key_type='ecdsa'))
+
+        assert [bundle.node for bundle in bundles] == NODES
+        client_cert = load_cert(bundles[0].files['client-cert.pem'])
+        assert 'master1.example.com' in subject_alternative_names(client_cert)
+        verify_signature(client_cert, root.cert.public_key())
+        assert bundles[1].files['truststore.jks'] == truststore
+
+    def test_intermediate(self):
+        root, truststore = create_root(key_type='ecdsa')
+        intermediate = create_intermediate(root, key_type='ecdsa')
+        assert intermediate.chain == (root.cert, )
+        verify_signature(intermediate.cert, root.cert.public_key())
+
+        bundle, = iter_ensemble(['10.10.10.10'], intermediate, truststore,
+                                key_type='ecdsa')
+        assert bundle.files['root-cert.pem'] == root.cert.public_bytes(
+            serialization.Encoding.PEM)
+        client_cert, intermediate_cert = load_pem_chain(
+            bundle.files['client-cert.pem'])
+        assert intermediate_cert == intermediate.cert
+        verify_signature(client_cert, intermediate.cert.public_key())
+
+        entries = jks.loads(bundle.files['serverstore.jks'], DEFAULT_PASSWORD)
+        assert len(entries[0].cert_chain) == 3
+
+    def test_load_ca(self):
+        root, _ = create_root(key_type='ecdsa')
+        ca, ca_truststore = load_ca(cert_pem(root.cert),
+                                    key_pem(root.key, b'secret'), b'secret')
+        assert ca.cert == root.cert
+        entry, = jks.loads(ca_truststore, DEFAULT_PASSWORD)
+        assert entry.cert == root.cert.public_bytes(serialization.Encoding.DER)
+
+        bundle, = iter_ensemble(['10.10.10.10'], ca, ca_truststore,
+                                key_type='ecdsa')
+        verify_signature(load_cert(bundle.files['client-cert.pem']),
+                         root.cert.public_key())
+
+        other, _ = create_root(key_type='ecdsa')
+        intermediate = create_intermediate(root, key_type='ecdsa')
+        for cert_data, key_data, password, message in [
+                (cert_pem(root.cert), key_pem(root.key, b'secret'), None,
+                 'not given'),
+                (cert_pem(root.cert), key_pem(root.key, b'secret'), b'wrong',
+                 'password'),
+                (cert_pem(root.cert), key_pem(other.key), None,
+                 'does not match'),
+                (cert_pem(root.cert) * 2, key_pem(root.key), None,
+                 'only contain'),
+                (cert_pem(intermediate.cert), key_pem(intermediate.key),
+                 None, 'not self-signed'),
+        ]:
+            with pytest.raises(ValueError, match=message):
+                load_ca(cert_data, key_data, password)
+
+    def test_invalid(self):
+        with pytest.raises(DuplicateNodeError):
+            generate_ensemble(['10.10.10.10', '10.10.10.10'],
+                              key_type='ecdsa')
+        with pytest.raises(ValueError, match='No nodes'):
+            generate_ensemble([])
+        with pytest.raises(ValueError):
+            generate_ensemble(NODES, key_type='rsa', key_size=1000)
+
+    def test_no_click(self):
+        """ The library API does not import the command line interface """
+        code = ('import sys, exhibitor_tls_artifacts; '
+                'assert "click" not in sys.modules')
+        subprocess.run([sys.executable, '-c', code], check=True)
@@ -1,12 +1,23 @@
+import datetime
+import io
+import json
 import stat
+import subprocess
+import sys
+import tarfile
 import textwrap
 import re
 from pathlib import Path
 
 import click
 import click.testing
+import pytest
 
-from exhibitor_tls_artifacts.gen_artifacts import app
+from exhibitor_tls_artifacts import jks
+from exhibitor_tls_artifacts.gen_artifacts import app, cli
+from exhibitor_tls_artifacts.gen_certificates import (CertificateGenerator,
+                                                      cert_pem, key_pem)
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
 
 
 class TestCLI:
@@ -22,6 +33,8 @@ class TestCLI:
             full_path = directory / f
             assert full_path.exists()
             assert full_path.stat()[stat.ST_MODE] == mode
+        assert sorted(p.name for p in directory.iterdir()) == \
+            [f for f, _ in files]
 
     def test_default(self):
         """ Tests the most basic operation """
@@ -37,6 +50,59 @@ class TestCLI:
             artifact_path = temp_path / 'artifacts' / '10.10.10.10'
             assert artifact_path.exists()
             self._validate_files(artifact_path)
+            assert sorted(p.name for p in artifact_path.parent.iterdir()) == \
+                ['10.10.10.10', 'issued.db', 'manifest.json',
+                 'root-cert.pem', 'truststore.jks']
+
+    def test_keytool_backend(self, tmp_path):
+        """ Test generating the keystores with openssl and keytool """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'keytool'
+        result = runner.invoke(
+            app,
+            args=['-d', output_dir, '--store-backend', 'keytool', '10.10.10.10'],
+            catch_exceptions=False)
+
+        assert result.exit_code == 0
+        self._validate_files(output_dir / '10.10.10.10')
+
+    @pytest.mark.parametrize('key_args', [['--key-type', 'ecdsa'],
+                                          ['--key-type', 'ecdsa',
+                                           '--key-size', '384'],
+                                          ['--key-type', 'ed25519'],
+                                          ['--key-size', '2048']])
+    def test_key_type(self, tmp_path, key_args):
+        """ Test generating artifacts with other key types and sizes """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'keys'
+        result = runner.invoke(app,
+                               args=['-d', output_dir] + key_args +
+                               ['10.10.10.10'],
+                               catch_exceptions=False)
+
+        assert result.exit_code == 0
+        self._validate_files(output_dir / '10.10.10.10')
+        entries = jks.loads(
+            (output_dir / '10.10.10.10' / 'serverstore.jks').read_bytes(),
+            'not-relevant-for-security')
+        assert entries[0].alias == 'server-cert'
+
+    @pytest.mark.parametrize('key_args', [['--key-size', '1024'],
+                                          ['--key-type', 'ecdsa',
+                                           '--key-size', '521'],
+                                          ['--key-type', 'ed25519',
+                                           '--key-size', '256']])
+    def test_invalid_key_size(self, tmp_path, key_args):
+        """ Test error case for unsupported key sizes """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'keys'
+        result = runner.invoke(app,
+                               args=['-d', output_dir] + key_args +
+                               ['10.10.10.10'])
+
+        assert result.exit_code == 2
+        assert 'Invalid value for --key-size' in result.stdout
+        assert not output_dir.exists()
 
     def test_custom_dir(self, tmp_path):
         """ Test outputting artifacts to a customer location """
@@ -49,6 +115,532 @@ class TestCLI:
         assert result.exit_code == 0
         self._validate_files(new_path / '10.10.10.10')
 
+    def test_parallel_jobs(self, tmp_path):
+        """ Test that generating several nodes in parallel creates the same
+        layout as generating them one by one """
+        runner = click.testing.CliRunner()
+        nodes = ['10.10.10.10', '10.10.10.11', '10.10.10.12']
+        output_dir = tmp_path / 'parallel'
+        result = runner.invoke(app,
+                               args=['-d', output_dir, '-j', '3'] + nodes,
+                               catch_exceptions=False)
+
+        assert result.exit_code == 0
+        assert sorted(p.name for p in output_dir.iterdir()) == sorted(
+            nodes + ['issued.db', 'manifest.json', 'root-cert.pem',
+                     'truststore.jks'])
+        for node in nodes:
+            self._validate_files(output_dir / node)
+
+    def test_failure_cleanup(self, tmp_path, monkeypatch):
+        """ Test that no partial output is left behind if a node fails """
+        def fail(*args, **kwargs):
+            raise RuntimeError('keystore failure')
+
+        monkeypatch.setattr(KeystoreGenerator, 'build_entitystore', fail)
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'failed'
+        result = runner.invoke(
+            app, args=['-d', output_dir, '-j', '1', '10.10.10.10'])
+
+        assert isinstance(result.exception, RuntimeError)
+        assert not output_dir.exists()
+
+    def test_write_failure(self, tmp_path, monkeypatch):
+        """ Test that a failure while writing leaves no output behind """
+        def fail(*args, **kwargs):
+            raise OSError('disk full')
+
+        monkeypatch.setattr(
+            'exhibitor_tls_artifacts.artifacts._write_file', fail)
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'failed'
+        result = runner.invoke(
+            app, args=['-d', output_dir, '--key-type', 'ecdsa', '10.10.10.10'])
+
+        assert isinstance(result.exception, OSError)
+        assert list(tmp_path.iterdir()) == []
+
+    def test_recover(self, tmp_path):
+        """ Test removing staging directories of killed runs """
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        stale = tmp_path / '.artifacts.staging-{}-0123abcd'.format(
+            process.pid)
+        (stale / '10.10.10.10').mkdir(parents=True)
+
+        runner = click.testing.CliRunner()
+        result = runner.invoke(cli, args=['recover', '--dry-run',
+                                          str(tmp_path)])
+        assert result.exit_code == 0
+        assert 'Would remove {}'.format(stale) in result.output
+        assert stale.exists()
+
+        result = runner.invoke(cli, args=['recover', str(tmp_path)])
+        assert result.exit_code == 0
+        assert not stale.exists()
+
+        result = runner.invoke(cli, args=['recover', str(tmp_path)])
+        assert 'No stale staging paths found' in result.output
+
+    def test_link_shared(self, tmp_path):
+        """ Test hard linking the artifacts shared by all nodes """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'linked'
+        result = runner.invoke(app,
+                               args=['-d', output_dir, '--link-shared',
+                                     'hardlink', '--key-type', 'ecdsa',
+                                     '10.10.10.10', '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+
+        for node in ['10.10.10.10', '10.10.10.11']:
+            self._validate_files(output_dir / node)
+            for name in ['root-cert.pem', 'truststore.jks']:
+                assert (output_dir / node / name).samefile(output_dir / name)
+        assert (output_dir / 'root-cert.pem').stat().st_nlink == 3
+
+    def test_archive_stdout(self, tmp_path):
+        """ Test streaming the artifacts as archive to stdout """
+        runner = click.testing.CliRunner(mix_stderr=False)
+        result = runner.invoke(app,
+                               args=['-d', '-', '--output-format', 'tgz',
+                                     '--key-type', 'ecdsa', '-j', '1',
+                                     '10.10.10.10'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+
+        with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes)) as archive:
+            archive.extractall(str(tmp_path))
+        self._validate_files(tmp_path / '10.10.10.10')
+
+    def test_archive_per_node(self, tmp_path):
+        """ Test writing one archive per node """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'archives'
+        result = runner.invoke(app,
+                               args=['-d', output_dir, '--output-format',
+                                     'tar', '--archive-per-node',
+                                     '--key-type', 'ecdsa', '10.10.10.10',
+                                     '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert sorted(p.name for p in output_dir.iterdir()) == [
+            '10.10.10.10.tar', '10.10.10.11.tar', 'issued.db',
+            'manifest.json', 'root-cert.pem', 'truststore.jks']
+
+        with tarfile.open(str(output_dir / '10.10.10.11.tar')) as archive:
+            assert archive.getnames()[0] == '10.10.10.11'
+            archive.extractall(str(tmp_path))
+        self._validate_files(tmp_path / '10.10.10.11')
+
+    def test_invalid_archive_options(self, tmp_path):
+        """ Test output options which cannot be combined """
+        runner = click.testing.CliRunner()
+        result = runner.invoke(app, args=['-d', '-', '10.10.10.10'])
+        assert result.exit_code == 2
+        assert 'requires --output-format tar or tgz' in result.output
+
+        result = runner.invoke(app,
+                               args=['-d', '-', '--output-format', 'tar',
+                                     '--archive-per-node', '10.10.10.10'])
+        assert result.exit_code == 2
+        assert 'cannot be written to stdout' in result.output
+
+    def test_nodes_from(self, tmp_path):
+        """ Test reading the nodes with extra SANs from a file """
+        nodes_file = tmp_path / 'nodes.txt'
+        nodes_file.write_text(
+            textwrap.dedent("""\
+                # masters
+                10.10.10.10 master1.example.com
+
+                10.10.10.11
+                """))
+        output_dir = tmp_path / 'streamed'
+        runner = click.testing.CliRunner(mix_stderr=False)
+        result = runner.invoke(app,
+                               args=['-d', output_dir, '--nodes-from',
+                                     nodes_file, '--key-type', 'ecdsa'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Generated artifacts for 10.10.10.10' in result.stderr
+        assert sorted(p.name for p in output_dir.iterdir()) == [
+            '10.10.10.10', '10.10.10.11', 'issued.db', 'manifest.json',
+            'root-cert.pem', 'truststore.jks']
+        for node in ('10.10.10.10', '10.10.10.11'):
+            self._validate_files(output_dir / node)
+
+        manifest = json.loads((output_dir / 'manifest.json').read_text())
+        assert len(manifest['artifacts']) == 14
+        sans = manifest['artifacts']['10.10.10.10/client-cert.pem'][
+            'certificate']['sans']
+        assert sorted(sans) == ['10.10.10.10', '127.0.0.1', 'exhibitor',
+                                'localhost', 'master1.example.com']
+
+        result = runner.invoke(cli, args=['verify', str(output_dir)])
+        assert result.exit_code == 0
+
+    def test_nodes_from_stdin(self, tmp_path):
+        """ Test streaming nodes from stdin into an archive on stdout """
+        runner = click.testing.CliRunner(mix_stderr=False)
+        result = runner.invoke(app,
+                               args=['-d', '-', '--output-format', 'tar',
+                                     '--nodes-from', '-', '--key-type',
+                                     'ecdsa', '-j', '1'],
+                               input='10.10.10.10\n10.10.10.11\n',
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+
+        with tarfile.open(fileobj=io.BytesIO(result.stdout_bytes)) as archive:
+            assert 'manifest.json' in archive.getnames()
+            archive.extractall(str(tmp_path))
+        self._validate_files(tmp_path / '10.10.10.11')
+
+    def test_invalid_nodes_from(self, tmp_path):
+        """ Test error cases of --nodes-from """
+        runner = click.testing.CliRunner()
+        result = runner.invoke(app,
+                               args=['-d', tmp_path / 'both', '--nodes-from',
+                                     '-', '10.10.10.10'])
+        assert result.exit_code == 2
+        assert 'cannot be used together' in result.output
+
+        result = runner.invoke(app,
+                               args=['-d', tmp_path / 'empty', '--nodes-from',
+                                     '-'],
+                               input='# no nodes\n')
+        assert result.exit_code == 2
+        assert 'No nodes have been provided.' in result.output
+
+        result = runner.invoke(app,
+                               args=['-d', tmp_path / 'dup', '--nodes-from',
+                                     '-', '--key-type', 'ecdsa'],
+                               input='10.10.10.10\n10.10.10.10\n')
+        assert result.exit_code == 2
+        assert "Duplicate node '10.10.10.10'" in result.output
+        assert not (tmp_path / 'dup').exists()
+
+        result = runner.invoke(app,
+                               args=['-d', tmp_path / 'jobs', '--nodes-from',
+                                     '-', '--store-jobs', '2'],
+                               input='10.10.10.10\n')
+        assert result.exit_code == 2
+        assert ('--store-jobs cannot be used with --nodes-from'
+                in result.output)
+        assert not (tmp_path / 'jobs').exists()
+
+    def test_duplicate_nodes(self, tmp_path):
+        """ Test error case when a node is provided more than once """
+        runner = click.testing.CliRunner()
+        result = runner.invoke(
+            app, args=['-d', tmp_path / 'dup', '10.10.10.10', '10.10.10.10'])
+
+        assert result.exit_code == 2
+        assert 'Duplicate nodes have been provided: 10.10.10.10' in \
+            result.stdout
+
+    def test_key_pool(self, tmp_path):
+        """ Test that keys are taken from the key pool """
+        runner = click.testing.CliRunner()
+        pool_dir = tmp_path / 'pool'
+        result = runner.invoke(
+            cli,
+            args=['keypool', 'fill', '-n', '2', '-p', pool_dir, '-j', '2'],
+            catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'contains 2 keys' in result.stdout
+
+        output_dir = tmp_path / 'pooled'
+        result = runner.invoke(
+            cli,
+            args=['-d', output_dir, '--key-pool', pool_dir, '10.10.10.10'],
+            catch_exceptions=False)
+
+        assert result.exit_code == 0
+        assert 'Key pool: 2 hits, 1 misses' in result.stdout
+        self._validate_files(output_dir / '10.10.10.10')
+
+    def test_add_remove_nodes(self, tmp_path):
+        """ Test adding and removing nodes of an existing artifact directory """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'incremental'
+        result = runner.invoke(cli,
+                               args=['-d', output_dir, '--keep-root-key',
+                                     '--key-type', 'ecdsa',
+                                     '10.10.10.10', '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert (output_dir / 'root-key.pem').stat().st_mode == 0o100600
+
+        root_cert = (output_dir / 'root-cert.pem').read_bytes()
+        client_cert = (output_dir / '10.10.10.10' / 'client-cert.pem'
+                       ).read_bytes()
+
+        result = runner.invoke(cli,
+                               args=['add-nodes', '-d', output_dir,
+                                     '--key-type', 'ecdsa', '10.10.10.12'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        self._validate_files(output_dir / '10.10.10.12')
+        assert (output_dir / '10.10.10.12' / 'root-cert.pem').read_bytes() \
+            == root_cert
+        assert (output_dir / '10.10.10.10' / 'client-cert.pem'
+                ).read_bytes() == client_cert
+
+        result = runner.invoke(cli,
+                               args=['remove-nodes', '-d', output_dir,
+                                     '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert sorted(p.name for p in output_dir.iterdir()) == [
+            '10.10.10.10', '10.10.10.12', 'issued.db', 'manifest.json',
+            'root-cert.pem', 'root-key.pem', 'truststore.jks']
+
+        manifest = json.loads((output_dir / 'manifest.json').read_text())
+        assert sorted({path.split('/')[0] for path in manifest['artifacts']
+                       if '/' in path}) == ['10.10.10.10', '10.10.10.12']
+
+    def test_intermediate(self, tmp_path):
+        """ Test issuing the node certificates with an intermediate CA """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'intermediate'
+        result = runner.invoke(cli,
+                               args=['-d', output_dir, '--intermediate',
+                                     '--key-type', 'ecdsa', '10.10.10.10'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert not (output_dir / 'root-key.pem').exists()
+        assert (output_dir / 'intermediate-key.pem').stat().st_mode == \
+            0o100600
+        self._validate_files(output_dir / '10.10.10.10')
+        client_cert = (output_dir / '10.10.10.10' / 'client-cert.pem'
+                       ).read_text()
+        assert client_cert.count('BEGIN CERTIFICATE') == 2
+        assert (output_dir / 'root-cert.pem').read_text().count(
+            'BEGIN CERTIFICATE') == 1
+
+        # New nodes are issued without the root key.
+        result = runner.invoke(cli,
+                               args=['add-nodes', '-d', output_dir,
+                                     '--key-type', 'ecdsa', '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        result = runner.invoke(cli, args=['verify', str(output_dir)],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+
+    def test_existing_ca(self, tmp_path):
+        """ Test issuing the node certificates with an existing root CA """
+        runner = click.testing.CliRunner()
+        ca_dir = tmp_path / 'ca'
+        runner.invoke(cli,
+                      args=['-d', ca_dir, '--keep-root-key', '--key-type',
+                            'ecdsa', '10.10.10.10'],
+                      catch_exceptions=False)
+        root_key = CertificateGenerator().load_key(ca_dir / 'root-key.pem')
+        (tmp_path / 'ca-key.pem').write_bytes(key_pem(root_key, b'secret'))
+        ca_args = ['--ca-cert', str(ca_dir / 'root-cert.pem'), '--ca-key',
+                   str(tmp_path / 'ca-key.pem')]
+
+        output_dir = tmp_path / 'reused'
+        result = runner.invoke(cli,
+                               args=['-d', output_dir, '--key-type', 'ecdsa',
+                                     '--ca-key-password-file', '-',
+                                     '10.10.10.10', '10.10.10.11'] + ca_args,
+                               input='secret\n',
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        assert (output_dir / 'root-cert.pem').read_bytes() == (
+            ca_dir / 'root-cert.pem').read_bytes()
+        assert not (output_dir / 'root-key.pem').exists()
+        self._validate_files(output_dir / '10.10.10.11')
+        result = runner.invoke(cli, args=['verify', str(output_dir)],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+
+        for args, message in [
+                (ca_args[:2], '--ca-cert and --ca-key must be used together'),
+                (ca_args, 'Password was not given'),
+                (ca_args + ['--keep-root-key'], 'cannot be used with'),
+                (['--ca-cert', str(ca_dir / '10.10.10.10' /
+                                   'client-cert.pem'),
+                  '--ca-key', str(ca_dir / '10.10.10.10' / 'client-key.pem')],
+                 'not a CA certificate'),
+        ]:
+            result = runner.invoke(cli,
+                                   args=['-d', tmp_path / 'invalid',
+                                         '10.10.10.10'] + args)
+            assert result.exit_code == 2
+            assert message in result.output
+            assert not (tmp_path / 'invalid').exists()
+
+    def test_external_ca(self, tmp_path):
+        """ Test a root CA without subject alternative names, like the ones
+        created with `openssl req -x509` """
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.x509.oid import NameOID
+
+        key = CertificateGenerator(key_type='ecdsa').generate_key()
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'ca')])
+        now = datetime.datetime.utcnow()
+        cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+            name).public_key(key.public_key()).serial_number(
+                x509.random_serial_number()).not_valid_before(
+                    now).not_valid_after(
+                        now + datetime.timedelta(days=1000)).add_extension(
+                            x509.BasicConstraints(ca=True, path_length=None),
+                            critical=True).sign(key, hashes.SHA256(),
+                                                default_backend())
+        (tmp_path / 'ca-cert.pem').write_bytes(cert_pem(cert))
+        (tmp_path / 'ca-key.pem').write_bytes(key_pem(key))
+
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'artifacts'
+        result = runner.invoke(cli,
+                               args=['-d', output_dir, '--key-type', 'ecdsa',
+                                     '--intermediate', '--ca-cert',
+                                     str(tmp_path / 'ca-cert.pem'),
+                                     '--ca-key', str(tmp_path / 'ca-key.pem'),
+                                     '10.10.10.10'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        manifest = json.loads((output_dir / 'manifest.json').read_text())
+        assert manifest['artifacts']['root-cert.pem']['certificate'][
+            'sans'] == []
+
+        result = runner.invoke(cli,
+                               args=['add-nodes', '-d', output_dir,
+                                     '--key-type', 'ecdsa', '--validity-days',
+                                     '10', '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(cli,
+                               args=['renew', '-d', output_dir, '--within',
+                                     '20d'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        assert 'client certificate of 10.10.10.11' in result.output
+        result = runner.invoke(cli, args=['verify', str(output_dir)],
+                               catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+
+    def test_add_existing_node(self, tmp_path):
+        """ Test error cases when adding nodes """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'incremental'
+        runner.invoke(cli,
+                      args=['-d', output_dir, '--key-type', 'ecdsa',
+                            '10.10.10.10'],
+                      catch_exceptions=False)
+
+        result = runner.invoke(cli,
+                               args=['add-nodes', '-d', output_dir,
+                                     '10.10.10.10'])
+        assert result.exit_code == 2
+        assert 'Nodes already exist' in result.stdout
+
+        result = runner.invoke(cli,
+                               args=['add-nodes', '-d', output_dir,
+                                     '10.10.10.11'])
+        assert result.exit_code == 2
+        assert '--keep-root-key' in result.stdout
+        assert not (output_dir / '10.10.10.11').exists()
+
+        result = runner.invoke(cli,
+                               args=['remove-nodes', '-d', output_dir,
+                                     '10.10.10.11'])
+        assert result.exit_code == 2
+        assert 'Nodes do not exist' in result.stdout
+
+    def test_renew(self, tmp_path):
+        """ Test renewing certificates close to expiry """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'renew'
+        runner.invoke(cli,
+                      args=['-d', output_dir, '--keep-root-key',
+                            '--key-type', 'ecdsa', '--validity-days', '10',
+                            '10.10.10.10'],
+                      catch_exceptions=False)
+        node_dir = output_dir / '10.10.10.10'
+        before = {p: p.read_bytes() for p in output_dir.glob('**/*')
+                  if p.is_file()}
+
+        result = runner.invoke(cli,
+                               args=['renew', '-d', output_dir, '--within',
+                                     '5d'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'No certificates expire within 5 days' in result.stdout
+
+        result = runner.invoke(cli,
+                               args=['renew', '-d', output_dir, '--within',
+                                     '2w', '--dry-run'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'client certificate of 10.10.10.10 expires' in result.stdout
+        assert all(p.read_bytes() == data for p, data in before.items())
+
+        result = runner.invoke(cli,
+                               args=['renew', '-d', output_dir, '--within',
+                                     '2w'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Renewed 3 certificates.' in result.stdout
+        self._validate_files(node_dir)
+        assert (output_dir / 'root-key.pem').read_bytes() == \
+            before[output_dir / 'root-key.pem']
+        for name in ['client-cert.pem', 'client-key.pem', 'clientstore.jks',
+                     'serverstore.jks', 'root-cert.pem', 'truststore.jks']:
+            assert (node_dir / name).read_bytes() != before[node_dir / name]
+
+        result = runner.invoke(cli,
+                               args=['renew', '-d', output_dir, '--within',
+                                     '2w'],
+                               catch_exceptions=False)
+        assert 'No certificates expire' in result.stdout
+
+    def test_timings(self, tmp_path):
+        """ Test printing the timings of the generation stages """
+        runner = click.testing.CliRunner(mix_stderr=False)
+        result = runner.invoke(app,
+                               args=['-d', tmp_path / 'timings', '--key-type',
+                                     'ecdsa', '--timings', 'json', '-j', '2',
+                                     '10.10.10.10', '10.10.10.11'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        report = json.loads(result.stderr)
+        stages = {stage['stage']: stage for stage in report['stages']}
+        assert stages['node']['count'] == 2
+        assert stages['sign']['count'] == 5
+        assert {span['node'] for span in report['spans']} == {
+            None, '10.10.10.10', '10.10.10.11'}
+
+    def test_verify(self, tmp_path):
+        """ Test verifying an artifact directory """
+        runner = click.testing.CliRunner()
+        output_dir = tmp_path / 'verify'
+        runner.invoke(cli,
+                      args=['-d', output_dir, '--key-type', 'ecdsa',
+                            '10.10.10.10', '10.10.10.11'],
+                      catch_exceptions=False)
+
+        result = runner.invoke(cli,
+                               args=['verify', str(output_dir), '-j', '2'],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        assert 'Verified the artifacts of 2 nodes' in result.output
+
+        (output_dir / '10.10.10.11' / 'client-key.pem').chmod(0o644)
+        result = runner.invoke(cli,
+                               args=['verify', str(output_dir)],
+                               catch_exceptions=False)
+        assert result.exit_code == 1
+        assert '10.10.10.11/client-key.pem has mode 0644, expected 0600' in \
+            result.output
+
     def test_dir_exists(self):
         """ Test error case when the output directory already exists """
         rgx = re.compile("^Error: Invalid value for \"-d\" / \"--output-directory\": "
@@ -92,9 +684,68 @@ class TestCLI:
               https://docs.mesosphere.com/1.13/security/ent/tls-ssl/exhibitor/
 
             Options:
-              -d, --output-directory TEXT  Directory to put artifacts in. This
-                                           output_directory must not exist.
-              --help                       Show this message and exit.
+              -d, --output-directory TEXT     Directory to put artifacts in. This
+                                              output_directory must not exist. With
+                                              --output-format tar or tgz the archive to
+                                              write, `-` for stdout.
+              -j, --jobs INTEGER RANGE        Number of nodes to generate artifacts for in
+                                              parallel. Defaults to the number of CPUs.
+              --store-jobs INTEGER RANGE      Number of nodes whose keystores are built by
+                                              openssl and keytool at the same time with the
+                                              `keytool` backend, while the next nodes are
+                                              generated. Defaults to the number of jobs.
+              --store-backend [native|keytool]
+                                              How to create the jks keystores. `native`
+                                              writes them directly, `keytool` uses the
+                                              openssl and keytool binaries. Default: native.
+              --key-pool DIRECTORY            Key pool directory filled by `keypool fill` to
+                                              take private keys from. Keys are generated
+                                              when the pool is empty.
+              --key-type [rsa|ecdsa|ed25519]  Type of the keys. Default: rsa.
+              --key-size INTEGER              Size of the keys. The RSA modulus size in bits
+                                              (at least 2048, default 4096) or the ECDSA
+                                              curve size (256 for P-256, the default, or 384
+                                              for P-384). Not used for Ed25519.
+              --validity-days INTEGER RANGE   Number of days the issued certificates are
+                                              valid. Default: 3650.
+              --timings [table|json]          Print how long every stage took, aggregated as
+                                              `table` or as `json` including every span.
+              --keep-root-key                 Keep the root key as `root-key.pem` in the
+                                              output directory, which is needed to add nodes
+                                              later.
+              --intermediate                  Issue the node certificates with an
+                                              intermediate CA signed by the root. Its
+                                              certificate and key are kept as `intermediate-
+                                              cert.pem` and `intermediate-key.pem`, so that
+                                              nodes can be added and renewed while the root
+                                              key is kept offline.
+              --ca-cert FILE                  Issue the certificates with an existing root
+                                              CA instead of generating a new one. PEM file
+                                              with the self-signed CA certificate, requires
+                                              --ca-key.
+              --ca-key FILE                   PEM file with the private key of --ca-cert.
+              --ca-key-password-file FILENAME
+                                              Read the passphrase of an encrypted --ca-key
+                                              from FILE, `-` for stdin.
+              --output-format [directory|tar|tgz]
+                                              Write the artifacts as directory tree or
+                                              stream them into a `tar` or gzipped `tar`
+                                              archive. Default: directory.
+              --archive-per-node              Write one archive per node into the output
+                                              directory, next to the shared root certificate
+                                              and truststore.
+              --link-shared [copy|hardlink|reflink]
+                                              How to write artifacts which are the same for
+                                              every node, like `root-cert.pem` and
+                                              `truststore.jks`: as separate copies, as hard
+                                              links or as copy-on-write clones of a single
+                                              file where the file system supports them.
+                                              Default: copy.
+              --nodes-from FILENAME           Read the nodes from FILE, `-` for stdin: one
+                                              node per line, optionally followed by extra
+                                              subject alternative names. Artifacts are
+                                              written as soon as a node is done.
+              --help                          Show this message and exit.
             """)
         runner = click.testing.CliRunner()
         result = runner.invoke(app, args=['--help'])
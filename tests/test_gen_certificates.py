@@ -4,7 +4,7 @@ import ipaddress
 from tempfile import TemporaryDirectory
 from cryptography import x509
 from cryptography.exceptions import InvalidSignature
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
 from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
 
 
@@ -111,3 +111,51 @@ class TestGenCertificates:
 
             with pytest.raises(InvalidSignature):
                 self.__verify_cert_signature(entity_cert, entity_key)
+
+    @pytest.mark.parametrize('key_type,key_size,key_class', [
+        ('rsa', 2048, rsa.RSAPrivateKey),
+        ('ecdsa', 256, ec.EllipticCurvePrivateKey),
+        ('ecdsa', 384, ec.EllipticCurvePrivateKey),
+        ('ed25519', None, ed25519.Ed25519PrivateKey),
+    ])
+    def test_key_types(self, key_type, key_size, key_class):
+        with TemporaryDirectory() as test_dir:
+            gen = CertificateGenerator(artifact_dir=test_dir,
+                                       key_type=key_type,
+                                       key_size=key_size)
+            issuer_cert_path, issuer_key_path = gen.get_cert(cert_name='root')
+            entity_cert_path, entity_key_path = gen.get_cert(
+                cert_name='entity',
+                issuer=(issuer_cert_path, issuer_key_path)
+            )
+
+            issuer_key = gen.load_key(issuer_key_path)
+            entity_key = gen.load_key(entity_key_path)
+            entity_cert = gen.load_cert(entity_cert_path)
+
+            assert isinstance(entity_key, key_class)
+            if key_size is not None:
+                assert entity_key.key_size == key_size
+            self.__verify_cert_properties(entity_cert, ['localhost'], [],
+                                          False)
+
+            public_key = issuer_key.public_key()
+            if key_type == 'rsa':
+                self.__verify_cert_signature(entity_cert, issuer_key)
+            elif key_type == 'ecdsa':
+                public_key.verify(
+                    entity_cert.signature,
+                    entity_cert.tbs_certificate_bytes,
+                    ec.ECDSA(entity_cert.signature_hash_algorithm))
+            else:
+                public_key.verify(entity_cert.signature,
+                                  entity_cert.tbs_certificate_bytes)
+
+    @pytest.mark.parametrize('key_type,key_size', [
+        ('rsa', 1024), ('ecdsa', 521), ('ed25519', 256), ('dsa', None)])
+    def test_invalid_key_spec(self, key_type, key_size):
+        with TemporaryDirectory() as test_dir:
+            with pytest.raises(ValueError):
+                CertificateGenerator(artifact_dir=test_dir,
+                                     key_type=key_type,
+                                     key_size=key_size)
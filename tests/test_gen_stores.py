@@ -1,6 +1,9 @@
+import pytest
 import re
 
-from exhibitor_tls_artifacts.gen_artifacts import CertificateGenerator
+from cryptography.hazmat.primitives import serialization
+from exhibitor_tls_artifacts import jks
+from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
 from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
 from subprocess import Popen, PIPE
 from tempfile import TemporaryDirectory
@@ -11,14 +14,15 @@ class TestGenStores:
     Test that certificates are imported correctly in the `.jks` keystores.
     """
 
-    def test_create_truststore(self):
+    @pytest.mark.parametrize('backend', ['native', 'keytool'])
+    def test_create_truststore(self, backend):
         with TemporaryDirectory() as test_dir:
             cert_gen = CertificateGenerator(artifact_dir=test_dir)
 
             cert_name = 'testcert'
             cert_path, _ = cert_gen.get_cert(cert_name=cert_name)
 
-            store_gen = KeystoreGenerator(test_dir)
+            store_gen = KeystoreGenerator(test_dir, backend)
 
             store_name = 'teststore'
             store_pass = 'testpass'
@@ -44,14 +48,15 @@ class TestGenStores:
             assert re.search(cert_name + '-cert', stdout.decode())
             assert re.search('trustedCertEntry', stdout.decode())
 
-    def test_create_entitystore(self):
+    @pytest.mark.parametrize('backend', ['native', 'keytool'])
+    def test_create_entitystore(self, backend):
         with TemporaryDirectory() as test_dir:
             cert_gen = CertificateGenerator(artifact_dir=test_dir)
 
             cert_name = 'test'
             cert_path, key_path = cert_gen.get_cert(cert_name=cert_name)
 
-            store_gen = KeystoreGenerator(test_dir)
+            store_gen = KeystoreGenerator(test_dir, backend)
 
             store_name = 'teststore'
             store_pass = 'testpass'
@@ -78,3 +83,53 @@ class TestGenStores:
             assert proc.wait() == 0
             assert re.search(cert_name + '-cert', stdout.decode())
             assert re.search('PrivateKeyEntry', stdout.decode())
+
+    def test_native_entitystore_content(self):
+        with TemporaryDirectory() as test_dir:
+            cert_gen = CertificateGenerator(artifact_dir=test_dir)
+            cert_path, key_path = cert_gen.get_cert(cert_name='test')
+
+            store_path = KeystoreGenerator(test_dir).create_entitystore(
+                cert_path,
+                key_path,
+                store_name='teststore',
+                store_password='testpass'
+            )
+
+            entries = jks.loads(store_path.read_bytes(), 'testpass')
+            assert len(entries) == 1
+            entry = entries[0]
+            assert isinstance(entry, jks.PrivateKeyEntry)
+            assert entry.alias == 'test-cert'
+
+            cert = cert_gen.load_cert(cert_path)
+            key = cert_gen.load_key(key_path)
+            assert entry.cert_chain == [
+                cert.public_bytes(serialization.Encoding.DER)]
+            assert entry.key == key.private_bytes(
+                encoding=serialization.Encoding.DER,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption())
+
+    @pytest.mark.parametrize('backend', ['native', 'keytool'])
+    def test_build_stores_in_memory(self, backend):
+        cert_gen = CertificateGenerator()
+        root = cert_gen.issue(cert_name='root')
+        entity = cert_gen.issue(cert_name='entity', issuer=root)
+        store_gen = KeystoreGenerator(backend=backend)
+
+        truststore = jks.loads(
+            store_gen.build_truststore([('root-cert', root.cert)]),
+            'not-relevant-for-security')
+        assert [entry.alias for entry in truststore] == ['root-cert']
+        assert truststore[0].cert == root.cert.public_bytes(
+            serialization.Encoding.DER)
+
+        entitystore = jks.loads(
+            store_gen.build_entitystore('entity-cert', entity.key,
+                                        [entity.cert, root.cert]),
+            'not-relevant-for-security')
+        assert [entry.alias for entry in entitystore] == ['entity-cert']
+        assert entitystore[0].cert_chain == [
+            cert.public_bytes(serialization.Encoding.DER)
+            for cert in (entity.cert, root.cert)]
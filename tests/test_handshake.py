@@ -0,0 +1,78 @@
+import json
+import ssl
+
+import pytest
+
+from click.testing import CliRunner
+
+from exhibitor_tls_artifacts.gen_artifacts import cli
+from exhibitor_tls_artifacts.handshake import bench_node, format_reports
+
+NODE = '10.0.0.1'
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    result = CliRunner().invoke(
+        cli, ['-d', str(tmp_path / 'artifacts'), '--key-type', 'ecdsa', NODE])
+    assert result.exit_code == 0, result.output
+    return tmp_path / 'artifacts'
+
+
+class TestHandshake:
+    """
+    Test benchmarking TLS handshakes with the artifacts of a node.
+    """
+
+    @pytest.mark.parametrize('resume', [False, True])
+    def test_bench_node(self, artifacts, resume):
+        report = bench_node(artifacts / NODE, 5, 2, resume)
+        assert report[:3] == (NODE, 'ecdsa', 256)
+        assert (report.handshakes, report.errors) == (5, 0)
+        assert report.resumed == (5 if resume else 0)
+        assert 0 < report.latency['p50'] <= report.latency['max']
+
+        table = format_reports([report]).splitlines()
+        assert table[1].split()[:4] == [NODE, 'ecdsa-256', report.protocol,
+                                        '5']
+
+    def test_foreign_root(self, artifacts, tmp_path):
+        other = tmp_path / 'other'
+        CliRunner().invoke(cli,
+                           ['-d', str(other), '--key-type', 'ecdsa', NODE])
+        # The client does not trust the server certificate.
+        (artifacts / NODE / 'root-cert.pem').write_bytes(
+            (other / 'root-cert.pem').read_bytes())
+
+        with pytest.raises(ssl.SSLError):
+            bench_node(artifacts / NODE, 1)
+
+    def test_command(self, artifacts):
+        runner = CliRunner(mix_stderr=False)
+        result = runner.invoke(cli, [
+            'bench-handshake', '-n', '3', '--key-spec', 'ed25519',
+            '--report-format', 'json',
+            str(artifacts)
+        ])
+        assert result.exit_code == 0, result.output
+        reports = json.loads(result.stdout)
+        assert [(report['name'], report['key_type'], report['handshakes'])
+                for report in reports] == [(str(artifacts), 'ecdsa', 3),
+                                           ('generated ed25519', 'ed25519',
+                                            3)]
+        assert reports[0]['handshakes_per_second'] > 0
+
+        result = runner.invoke(cli, ['bench-handshake'])
+        assert result.exit_code == 2
+        assert 'No DIRECTORY or --key-spec' in result.stderr
+
+        result = runner.invoke(cli,
+                               ['bench-handshake', '--key-spec', 'rsa:1024'])
+        assert result.exit_code == 2
+        assert 'at least 2048 bits' in result.stderr
+
+        result = runner.invoke(
+            cli, ['bench-handshake', '--node', '10.0.0.9',
+                  str(artifacts)])
+        assert result.exit_code == 2
+        assert 'does not exist' in result.stderr
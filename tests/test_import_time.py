@@ -0,0 +1,67 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time of the command line interface in milliseconds. It
+# is about 130ms on a laptop, loading `cryptography` eagerly more than
+# doubles it. Slow machines can raise the budget.
+IMPORT_BUDGET_MS = int(os.environ.get('IMPORT_TIME_BUDGET_MS', '300'))
+
+# Modules only needed to generate artifacts.
+HEAVY_MODULES = ('cryptography', 'asyncio', 'concurrent.futures',
+                 'http.server')
+
+IMPORTTIME = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_times(code):
+    """
+    Runs `code` with `-X importtime`.
+
+    Returns:
+        Dictionary mapping the imported top level modules to their
+        cumulative import time in microseconds.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            check=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+    return times
+
+
+class TestImportTime:
+    """
+    Test that `--help` and usage errors do not load the modules generating
+    artifacts.
+    """
+
+    @pytest.mark.parametrize('args', [
+        ['--help'],
+        ['verify', '--help'],
+        ['--key-size', '1', '10.10.10.10'],
+        ['-d', '-', '10.10.10.10'],
+    ])
+    def test_fast_paths(self, args):
+        code = ('import sys\n'
+                'from exhibitor_tls_artifacts.gen_artifacts import cli\n'
+                'try:\n'
+                '    cli.main({!r}, prog_name="exhibitor-tls-artifacts")\n'
+                'except SystemExit:\n'
+                '    pass\n'.format(args))
+        loaded = import_times(code)
+        heavy = sorted(module for module in loaded
+                       if module.startswith(HEAVY_MODULES))
+        assert heavy == []
+
+    def test_budget(self):
+        loaded = import_times('import exhibitor_tls_artifacts.gen_artifacts')
+        milliseconds = loaded['exhibitor_tls_artifacts.gen_artifacts'] / 1000
+        assert milliseconds < IMPORT_BUDGET_MS
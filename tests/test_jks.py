@@ -0,0 +1,55 @@
+import pytest
+import struct
+
+from exhibitor_tls_artifacts import jks
+
+
+class TestJKS:
+    """
+    Test serialization of `jks` keystores.
+    """
+
+    def test_roundtrip(self):
+        entries = [
+            jks.TrustedCertEntry('root-cert', 1, b'root-der'),
+            jks.PrivateKeyEntry('Client-Cert', 2, b'k' * 100,
+                                [b'client-der', b'root-der']),
+        ]
+
+        data = jks.dumps(entries, 'secret')
+        assert struct.unpack('>III', data[:12]) == (jks.MAGIC, jks.VERSION, 2)
+
+        loaded = jks.loads(data, 'secret')
+        assert loaded == [
+            jks.TrustedCertEntry('root-cert', 1, b'root-der'),
+            jks.PrivateKeyEntry('client-cert', 2, b'k' * 100,
+                                [b'client-der', b'root-der']),
+        ]
+
+    def test_key_is_protected(self):
+        key = b'private key material'
+        data = jks.dumps([jks.PrivateKeyEntry('key', 1, key, [b'cert'])],
+                         'secret')
+        assert key not in data
+
+    def test_wrong_password(self):
+        data = jks.dumps([jks.TrustedCertEntry('root-cert', 1, b'der')],
+                         'secret')
+        with pytest.raises(jks.KeystoreError):
+            jks.loads(data, 'wrong')
+
+    def test_tampered(self):
+        data = bytearray(
+            jks.dumps([jks.TrustedCertEntry('root-cert', 1, b'der')],
+                      'secret'))
+        data[-25] ^= 0xff
+        with pytest.raises(jks.KeystoreError):
+            jks.loads(bytes(data), 'secret')
+
+    def test_duplicate_alias(self):
+        entries = [
+            jks.TrustedCertEntry('root-cert', 1, b'der'),
+            jks.TrustedCertEntry('ROOT-CERT', 1, b'der'),
+        ]
+        with pytest.raises(ValueError):
+            jks.dumps(entries, 'secret')
@@ -0,0 +1,94 @@
+import io
+import json
+
+from cryptography.hazmat.primitives import hashes
+
+from exhibitor_tls_artifacts.ensemble import (build_node_artifacts,
+                                             root_artifacts)
+from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
+from exhibitor_tls_artifacts.manifest import (ManifestWriter, build_manifest,
+                                              load_manifest, manifest_artifact,
+                                              update_manifest)
+from exhibitor_tls_artifacts.artifacts import write_artifacts
+
+
+class TestManifest:
+    """
+    Test the artifact manifest.
+    """
+
+    @staticmethod
+    def _artifacts():
+        cert_gen = CertificateGenerator(key_type='ecdsa')
+        store_gen = KeystoreGenerator()
+        root = cert_gen.issue(cert_name='root')
+        truststore = store_gen.build_truststore([('root-cert', root.cert)])
+        artifacts = root_artifacts(root, truststore) + build_node_artifacts(
+            '10.10.10.10', root, truststore, cert_gen, store_gen)
+        return root, artifacts
+
+    def test_entries(self):
+        root, artifacts = self._artifacts()
+        manifest = build_manifest(artifacts)
+
+        assert sorted(manifest['artifacts']) == sorted(
+            artifact.path for artifact in artifacts)
+
+        root_entry = manifest['artifacts']['root-cert.pem']
+        assert root_entry['mode'] == '0644'
+        assert root_entry['certificate']['serial'] == format(
+            root.cert.serial_number, 'x')
+        assert root_entry['certificate']['fingerprint_sha256'] == \
+            root.cert.fingerprint(hashes.SHA256()).hex()
+
+        client_entry = manifest['artifacts']['10.10.10.10/client-cert.pem']
+        assert client_entry['certificate']['sans'] == [
+            'localhost', 'exhibitor', '127.0.0.1', '10.10.10.10']
+        assert client_entry['certificate']['issuer'] == 'root'
+
+        key_entry = manifest['artifacts']['10.10.10.10/client-key.pem']
+        assert key_entry['mode'] == '0600'
+        assert key_entry['key'] == {'type': 'ecdsa', 'size': 256}
+
+        store_entry = manifest['artifacts']['10.10.10.10/serverstore.jks']
+        entries = store_entry['store']['entries']
+        assert [(e['alias'], e['type']) for e in entries] == [
+            ('server-cert', 'PrivateKeyEntry')]
+        assert entries[0]['certificates'][0]['subject'] == 'server'
+
+        truststore_entry = manifest['artifacts']['truststore.jks']
+        assert truststore_entry['store']['entries'][0]['alias'] == 'root-cert'
+
+    def test_update(self, tmp_path):
+        _, artifacts = self._artifacts()
+        manifest = manifest_artifact(build_manifest(artifacts))
+        write_artifacts(tmp_path, artifacts + [manifest])
+        assert json.loads(manifest.data) == load_manifest(tmp_path)
+
+        update_manifest(tmp_path, removed_nodes=['10.10.10.10'])
+        assert sorted(load_manifest(tmp_path)['artifacts']) == [
+            'root-cert.pem', 'truststore.jks']
+
+    def test_update_without_manifest(self, tmp_path):
+        update_manifest(tmp_path, removed_nodes=['10.10.10.10'])
+        assert load_manifest(tmp_path) is None
+
+    def test_writer(self):
+        _, artifacts = self._artifacts()
+        artifacts.sort(key=lambda artifact: artifact.path)
+        expected = json.loads(
+            manifest_artifact(build_manifest(artifacts)).data)
+
+        f = io.BytesIO()
+        writer = ManifestWriter(f)
+        for artifact in artifacts:
+            writer.add(artifact)
+        writer.close()
+        written = json.loads(f.getvalue())
+        written['updated_at'] = expected['updated_at']
+        assert written == expected
+
+        f = io.BytesIO()
+        ManifestWriter(f).close()
+        assert json.loads(f.getvalue())['artifacts'] == {}
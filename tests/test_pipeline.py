@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+
+from exhibitor_tls_artifacts import pipeline, timings
+from exhibitor_tls_artifacts.artifacts import write_artifacts
+from exhibitor_tls_artifacts.ensemble import (generate_nodes,
+                                             generate_nodes_pipelined,
+                                             root_artifacts)
+from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator, run_command
+from exhibitor_tls_artifacts.pipeline import run_pipeline
+from exhibitor_tls_artifacts.verify import verify_tree
+
+
+def square(value):
+    if value < 0:
+        raise ValueError('negative value')
+    return value * value
+
+
+async def add_one(value):
+    await asyncio.sleep(0)
+    return value + 1
+
+
+class TestPipeline:
+    """
+    Test the pipeline overlapping worker processes with coroutines.
+    """
+
+    def test_order(self):
+        assert run_pipeline(list(range(10)), square, add_one, 3, 2) == [
+            value * value + 1 for value in range(10)]
+
+    def test_bounded(self, monkeypatch):
+        """ The CPU stage does not run ahead of a slow I/O stage """
+        submitted = []
+        outstanding = []
+
+        class CountingExecutor(ProcessPoolExecutor):
+
+            def submit(self, *args, **kwargs):
+                submitted.append(args)
+                return super().submit(*args, **kwargs)
+
+        async def slow(value):
+            outstanding.append(len(submitted) - len(outstanding))
+            await asyncio.sleep(0.01)
+            return value
+
+        monkeypatch.setattr(pipeline, 'ProcessPoolExecutor', CountingExecutor)
+        assert run_pipeline(list(range(20)), square, slow, 2, 1) == [
+            value * value for value in range(20)]
+        assert len(submitted) == 20
+        # Two computed or being computed and one waiting, besides the one
+        # passed to the I/O stage.
+        assert max(outstanding) <= 2 + 1 + 1
+
+    def test_failure(self):
+        with pytest.raises(ValueError):
+            run_pipeline([1, 2, -1, 3], square, add_one, 2, 1)
+
+    def test_failures_fill_slots(self):
+        """ Failed items release their slot, the run fails instead of
+        waiting for them """
+        with pytest.raises(ValueError):
+            run_pipeline([-1, -2, -3, 1, 2, 3], square, add_one, 1, 1)
+
+    def test_run_command(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(run_command(['true']))
+            with pytest.raises(Exception):
+                loop.run_until_complete(run_command(['false']))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_generate_nodes_pipelined(self, tmp_path):
+        """ The pipeline builds the same artifacts as the process pool """
+        nodes = ['10.10.10.10', '10.10.10.11', '10.10.10.12']
+        cert_gen = CertificateGenerator(key_type='ecdsa')
+        root = cert_gen.issue(cert_name='root')
+        truststore = KeystoreGenerator().build_truststore([('root-cert',
+                                                            root.cert)])
+
+        with timings.recording() as recorder:
+            pipelined = generate_nodes_pipelined(nodes, 2, 2, root,
+                                                 truststore, 'native',
+                                                 key_type='ecdsa')
+        pooled = generate_nodes(nodes, 2, root, truststore, 'native',
+                                key_type='ecdsa')
+
+        assert [result.node for result in pipelined] == nodes
+        for pipelined_result, pooled_result in zip(pipelined, pooled):
+            assert [artifact.path for artifact in
+                    pipelined_result.artifacts] == [
+                        artifact.path for artifact in pooled_result.artifacts]
+
+        artifacts = root_artifacts(root, truststore)
+        for result in pipelined:
+            artifacts.extend(result.artifacts)
+        write_artifacts(tmp_path, artifacts)
+        assert verify_tree(tmp_path) == (nodes, [])
+
+        jks_nodes = sorted(span.node for span in recorder.spans
+                           if span.stage == 'jks')
+        assert jks_nodes == sorted(nodes * 2)
+        sign_nodes = sorted(span.node for span in recorder.spans
+                            if span.stage == 'sign')
+        assert sign_nodes == sorted(nodes * 2)
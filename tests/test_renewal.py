@@ -0,0 +1,162 @@
+import datetime
+import pytest
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+
+from exhibitor_tls_artifacts.artifacts import key_artifact, write_artifacts
+from exhibitor_tls_artifacts.ensemble import (build_node_artifacts,
+                                             create_intermediate,
+                                             intermediate_artifacts,
+                                             root_artifacts)
+from exhibitor_tls_artifacts.gen_certificates import (
+    CertificateGenerator, load_pem_chain, not_valid_after,
+    subject_alternative_names, verify_chain)
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
+from exhibitor_tls_artifacts.renewal import (RenewalError, find_expiring,
+                                             load_entity, load_server_cert,
+                                             renew)
+from exhibitor_tls_artifacts.verify import verify_tree
+
+
+class TestRenewal:
+    """
+    Test finding and renewing expiring certificates of an artifact directory.
+    """
+
+    @staticmethod
+    def _generate(directory, keep_root_key=True, intermediate=False,
+                  root_sans=None, root_subject=None):
+        cert_gen = CertificateGenerator(key_type='ecdsa', validity_days=100)
+        store_gen = KeystoreGenerator()
+        root = cert_gen.issue(cert_name='root', sa_names=root_sans,
+                              subject=root_subject)
+        truststore = store_gen.build_truststore([('root-cert', root.cert)])
+
+        artifacts = root_artifacts(root, truststore)
+        if keep_root_key:
+            artifacts.append(key_artifact('root-key.pem', root.key))
+        issuer = root
+        if intermediate:
+            issuer = create_intermediate(root, 'ecdsa', validity_days=100)
+            artifacts.extend(intermediate_artifacts(issuer))
+        for node in ['10.10.10.10', '10.10.10.11']:
+            artifacts.extend(
+                build_node_artifacts(node, issuer, truststore, cert_gen,
+                                     store_gen))
+        write_artifacts(directory, artifacts)
+
+    def test_find_expiring(self, tmp_path):
+        self._generate(tmp_path)
+
+        assert find_expiring(tmp_path, datetime.timedelta(days=99)) == []
+
+        expiring = find_expiring(tmp_path, datetime.timedelta(days=101))
+        assert [(cert.node, cert.name) for cert in expiring] == [
+            (None, 'root'), ('10.10.10.10', 'client'),
+            ('10.10.10.10', 'server'), ('10.10.10.11', 'client'),
+            ('10.10.10.11', 'server')]
+
+    def test_renew_server_only(self, tmp_path):
+        self._generate(tmp_path)
+        before = {p: p.read_bytes() for p in tmp_path.glob('**/*')
+                  if p.is_file()}
+        old_cert = load_server_cert(tmp_path / '10.10.10.11')
+
+        expiring = [
+            cert for cert in find_expiring(tmp_path,
+                                           datetime.timedelta(days=101))
+            if cert.node == '10.10.10.11' and cert.name == 'server'
+        ]
+        artifacts = renew(tmp_path, expiring, validity_days=1000)
+        assert [artifact.path for artifact in artifacts] == [
+            '10.10.10.11/serverstore.jks']
+
+        changed = sorted(str(p.relative_to(tmp_path))
+                         for p, data in before.items()
+                         if p.read_bytes() != data)
+        assert changed == ['10.10.10.11/serverstore.jks']
+
+        new_cert = load_server_cert(tmp_path / '10.10.10.11')
+        assert new_cert.subject == old_cert.subject
+        assert subject_alternative_names(new_cert) == \
+            subject_alternative_names(old_cert)
+        assert not_valid_after(new_cert) > not_valid_after(old_cert) + \
+            datetime.timedelta(days=800)
+
+    def test_renew_without_root_key(self, tmp_path):
+        self._generate(tmp_path, keep_root_key=False)
+        expiring = find_expiring(tmp_path, datetime.timedelta(days=101))
+
+        with pytest.raises(RenewalError):
+            renew(tmp_path, expiring)
+
+    def test_renew_with_intermediate(self, tmp_path):
+        self._generate(tmp_path, keep_root_key=False, intermediate=True)
+        expiring = find_expiring(tmp_path, datetime.timedelta(days=101))
+        assert [(cert.node, cert.name) for cert in expiring][:2] == [
+            (None, 'root'), (None, 'intermediate')]
+
+        # Renewing the intermediate CA needs the root key.
+        with pytest.raises(RenewalError):
+            renew(tmp_path, expiring[1:])
+
+        # The node certificates only need the intermediate key.
+        root_cert = (tmp_path / 'root-cert.pem').read_bytes()
+        renew(tmp_path, expiring[2:], validity_days=1000)
+        assert (tmp_path / 'root-cert.pem').read_bytes() == root_cert
+        assert [(cert.node, cert.name) for cert in find_expiring(
+            tmp_path, datetime.timedelta(days=101))] == [
+                (None, 'root'), (None, 'intermediate')]
+        assert verify_tree(tmp_path, 1) == (['10.10.10.10', '10.10.10.11'],
+                                             [])
+
+    def test_renew_root_with_intermediate(self, tmp_path):
+        # Like external root CAs, the root has no subject alternative names.
+        self._generate(tmp_path, intermediate=True, root_sans=[])
+        expiring = find_expiring(tmp_path, datetime.timedelta(days=101))
+        renew(tmp_path, expiring[:1], validity_days=1000)
+
+        root_cert, = load_pem_chain((tmp_path / 'root-cert.pem').read_bytes())
+        assert subject_alternative_names(root_cert) == []
+        assert [(cert.node, cert.name) for cert in find_expiring(
+            tmp_path, datetime.timedelta(days=101))][:1] == [
+                (None, 'intermediate')]
+
+        # The unchanged node certificates are stored with the new root.
+        for node in ['10.10.10.10', '10.10.10.11']:
+            for name in ['client', 'server']:
+                entity = load_entity(tmp_path / node, name)
+                assert entity.chain[-1] == root_cert
+                verify_chain([entity.cert] + list(entity.chain[:-1]),
+                             root_cert)
+        assert verify_tree(tmp_path, 1) == (['10.10.10.10', '10.10.10.11'],
+                                             [])
+
+    def test_renew_keeps_ca_subjects(self, tmp_path):
+        # External root CAs have their own common name and other fields.
+        root_subject = x509.Name([
+            x509.NameAttribute(NameOID.COUNTRY_NAME, 'DE'),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'Example'),
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'PKI'),
+            x509.NameAttribute(NameOID.COMMON_NAME, 'Example Root CA'),
+            x509.NameAttribute(NameOID.EMAIL_ADDRESS, 'pki@example.com'),
+        ])
+        self._generate(tmp_path, intermediate=True, root_sans=[],
+                       root_subject=root_subject)
+        intermediate_cert, _ = load_pem_chain(
+            (tmp_path / 'intermediate-cert.pem').read_bytes())
+
+        expiring = find_expiring(tmp_path, datetime.timedelta(days=101))
+        renew(tmp_path, expiring[:2], validity_days=1000)
+
+        root_cert, = load_pem_chain((tmp_path / 'root-cert.pem').read_bytes())
+        assert root_cert.subject == root_subject
+        assert root_cert.issuer == root_subject
+        renewed, _ = load_pem_chain(
+            (tmp_path / 'intermediate-cert.pem').read_bytes())
+        assert renewed.subject == intermediate_cert.subject
+        assert renewed.issuer == root_subject
+        assert renewed != intermediate_cert
+        assert verify_tree(tmp_path, 1) == (['10.10.10.10', '10.10.10.11'],
+                                             [])
@@ -0,0 +1,158 @@
+import datetime
+
+import pytest
+
+from click.testing import CliRunner
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from exhibitor_tls_artifacts.artifacts import write_artifacts
+from exhibitor_tls_artifacts.ensemble import create_root, generate_nodes
+from exhibitor_tls_artifacts.gen_artifacts import cli
+from exhibitor_tls_artifacts.revocation import (ISSUED_DB_FILE, IssuanceDB,
+                                                RevocationError,
+                                                issued_certs, open_database,
+                                                revoke)
+from exhibitor_tls_artifacts.verify import verify_tree
+
+NODES = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+
+
+def load_crl(artifact):
+    return x509.load_pem_x509_crl(artifact.data, default_backend())
+
+
+def crl_serials(crl):
+    return sorted(format(revoked.serial_number, 'x') for revoked in crl)
+
+
+class TestRevocation:
+    """
+    Test recording issued certificates and revoking them with CRLs.
+    """
+
+    @staticmethod
+    def _generate(directory):
+        root, truststore = create_root('ecdsa')
+        results = generate_nodes(NODES, 1, root, truststore, 'native',
+                                 key_type='ecdsa')
+        artifacts = [
+            artifact for result in results for artifact in result.artifacts
+        ]
+        write_artifacts(directory, artifacts)
+        (directory / 'root-cert.pem').write_bytes(
+            (directory / NODES[0] / 'root-cert.pem').read_bytes())
+        return root, artifacts
+
+    def test_issued_certs(self, tmp_path):
+        _, artifacts = self._generate(tmp_path)
+        certs = issued_certs(artifacts)
+        assert sorted((cert.node, cert.name) for cert in certs) == [
+            (node, name) for node in NODES for name in ('client', 'server')
+        ]
+
+        # A missing database is created from the node directories.
+        with open_database(tmp_path) as database:
+            assert sorted(database.find(node=NODES[0])) == sorted(
+                cert for cert in certs if cert.node == NODES[0])
+            assert database.find(serial=certs[0].serial.upper()) == [
+                certs[0]
+            ]
+            assert database.find(node='10.0.0.9') == []
+
+    def test_indexed_lookups(self, tmp_path):
+        with IssuanceDB(tmp_path / ISSUED_DB_FILE) as database:
+            for query, index in (
+                    ('node = ?', 'certificates_node'),
+                    ('serial = ?', 'sqlite_autoindex_certificates_1')):
+                plan = ' '.join(
+                    str(row[-1]) for row in database.connection.execute(
+                        'EXPLAIN QUERY PLAN SELECT * FROM certificates '
+                        'WHERE ' + query, ('x', )))
+                assert index in plan
+
+    def test_full_and_delta_crls(self, tmp_path):
+        root, artifacts = self._generate(tmp_path)
+        certs = {(cert.node, cert.name): cert
+                 for cert in issued_certs(artifacts)}
+
+        revoked, crls = revoke(tmp_path, root, [NODES[0]],
+                               reason='key-compromise')
+        assert sorted(cert.name for cert in revoked) == ['client', 'server']
+        full, delta = [load_crl(crl) for crl in crls]
+        assert crl_serials(full) == sorted(
+            cert.serial for cert in revoked)
+        assert full.is_signature_valid(root.cert.public_key())
+        assert full.extensions.get_extension_for_class(
+            x509.CRLNumber).value.crl_number == 1
+        assert full[0].extensions.get_extension_for_class(
+            x509.CRLReason).value.reason == x509.ReasonFlags.key_compromise
+        assert list(delta) == []
+        assert delta.extensions.get_extension_for_class(
+            x509.DeltaCRLIndicator).value.crl_number == 1
+
+        # Later revocations only go into delta CRLs on top of the full CRL.
+        revoke(tmp_path, root, [NODES[1]])
+        _, crls = revoke(tmp_path, root,
+                         serials=[certs[NODES[2], 'client'].serial])
+        delta, = [load_crl(crl) for crl in crls]
+        assert crls[0].path == 'delta-crl.pem'
+        assert crl_serials(delta) == sorted(
+            [certs[NODES[1], 'client'].serial,
+             certs[NODES[1], 'server'].serial,
+             certs[NODES[2], 'client'].serial])
+        assert delta.extensions.get_extension_for_class(
+            x509.CRLNumber).value.crl_number == 4
+        assert delta.extensions.get_extension_for_class(
+            x509.DeltaCRLIndicator).value.crl_number == 1
+
+        # A new full CRL lists everything, expired certificates are left out.
+        later = datetime.datetime.utcnow() + datetime.timedelta(days=365 * 11)
+        _, crls = revoke(tmp_path, root, full=True)
+        assert len(crl_serials(load_crl(crls[0]))) == 5
+        _, crls = revoke(tmp_path, root, full=True, now=later)
+        assert crl_serials(load_crl(crls[0])) == []
+
+    def test_unknown_node(self, tmp_path):
+        root, _ = self._generate(tmp_path)
+        with pytest.raises(RevocationError) as e:
+            revoke(tmp_path, root, ['10.0.0.9'])
+        assert '10.0.0.9' in str(e.value)
+
+    def test_revoke_command(self, tmp_path):
+        runner = CliRunner(mix_stderr=False)
+        output_dir = tmp_path / 'artifacts'
+        result = runner.invoke(cli, [
+            '-d', str(output_dir), '--intermediate', '--key-type', 'ecdsa'
+        ] + NODES[:2])
+        assert result.exit_code == 0, result.output
+        assert (output_dir / ISSUED_DB_FILE).is_file()
+
+        result = runner.invoke(cli, ['add-nodes', '-d', str(output_dir),
+                                     '--key-type', 'ecdsa', NODES[2]])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(cli, ['remove-nodes', '-d', str(output_dir),
+                                     NODES[2]])
+        assert result.exit_code == 0, result.output
+
+        # Removed nodes can still be revoked.
+        result = runner.invoke(cli, ['revoke', '-d', str(output_dir),
+                                     NODES[2]])
+        assert result.exit_code == 0, result.output
+        assert 'Issued crl.pem and delta-crl.pem.' in result.stdout
+        assert runner.invoke(cli, ['verify', str(output_dir)]).exit_code == 0
+
+        result = runner.invoke(cli, ['revoke', '-d', str(output_dir),
+                                     NODES[0]])
+        assert result.exit_code == 0, result.output
+        assert 'Issued delta-crl.pem.' in result.stdout
+
+        assert verify_tree(output_dir)[1] == [
+            '10.0.0.1: client certificate is revoked',
+            '10.0.0.1: server certificate is revoked',
+        ]
+
+        result = runner.invoke(cli, ['revoke', '-d', str(output_dir),
+                                     '--serial', 'xyz'])
+        assert result.exit_code == 2
+        assert 'hexadecimal' in result.stderr
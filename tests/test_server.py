@@ -0,0 +1,137 @@
+import base64
+import http.client
+import io
+import json
+import socket
+import tarfile
+import threading
+
+import pytest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from exhibitor_tls_artifacts.ensemble import create_root
+from exhibitor_tls_artifacts.gen_certificates import (
+    subject_alternative_names, verify_signature)
+from exhibitor_tls_artifacts.server import (Busy, IssuingService,
+                                            MemoryKeyPool, make_server)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+@pytest.fixture
+def service():
+    root, truststore = create_root(key_type='ecdsa')
+    pool = MemoryKeyPool(key_type='ecdsa', size=4)
+    pool.start()
+    yield IssuingService(root, truststore, pool, key_type='ecdsa',
+                         max_concurrency=2)
+    pool.stop()
+
+
+@pytest.fixture(params=['tcp', 'unix'])
+def connect(request, service, tmp_path):
+    if request.param == 'unix':
+        socket_path = str(tmp_path / 'serve.sock')
+        server = make_server(service, socket_path=socket_path)
+    else:
+        server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def new_connection():
+        if request.param == 'unix':
+            return UnixHTTPConnection(socket_path)
+        return http.client.HTTPConnection(*server.server_address)
+
+    yield new_connection
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def request(connection, method, path):
+    connection.request(method, path)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+class TestServer:
+    """
+    Test the local issuing service against a local client.
+    """
+
+    def test_issue(self, service, connect):
+        connection = connect()
+        status, body = request(connection, 'POST',
+                               '/nodes/10.10.10.10?san=master1.example.com')
+        assert status == 200
+        files = {
+            name: base64.b64decode(data)
+            for name, data in json.loads(body.decode())['files'].items()
+        }
+        assert sorted(files) == ['client-cert.pem', 'client-key.pem',
+                                 'clientstore.jks', 'root-cert.pem',
+                                 'serverstore.jks', 'truststore.jks']
+        cert = x509.load_pem_x509_certificate(files['client-cert.pem'],
+                                              default_backend())
+        verify_signature(cert, service.root.cert.public_key())
+        assert {'10.10.10.10', 'master1.example.com'} <= set(
+            subject_alternative_names(cert))
+
+        # The connection is kept alive between requests.
+        status, body = request(connection, 'POST',
+                               '/nodes/10.10.10.11?format=tar')
+        assert status == 200
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            assert '10.10.10.11/serverstore.jks' in archive.getnames()
+
+        status, body = request(connection, 'GET', '/root-cert.pem')
+        assert status == 200
+        assert body == files['root-cert.pem']
+
+        status, body = request(connection, 'GET', '/metrics')
+        metrics = json.loads(body.decode())
+        assert metrics['issued'] == 2
+        assert metrics['responses_2xx'] == 3
+        assert metrics['latency']['window'] == 3
+        assert metrics['latency']['p50'] <= metrics['latency']['max']
+        assert metrics['key_pool']['hits'] + \
+            metrics['key_pool']['misses'] == 4
+
+    def test_invalid_requests(self, connect):
+        connection = connect()
+        assert request(connection, 'GET', '/nodes/10.10.10.10')[0] == 405
+        assert request(connection, 'POST', '/nodes/..')[0] == 400
+        assert request(connection, 'POST',
+                       '/nodes/10.10.10.10?format=zip')[0] == 400
+        assert request(connection, 'GET', '/unknown')[0] == 404
+
+    def test_concurrency_limit(self, service):
+        service.queue_timeout = 0
+        for _ in range(service.max_concurrency):
+            service._slots.acquire()
+        with pytest.raises(Busy):
+            service.issue('10.10.10.10')
+
+    def test_key_pool(self):
+        pool = MemoryKeyPool(key_type='ecdsa', size=2)
+        assert pool.get_key() is not None
+        assert (pool.hits, pool.misses) == (0, 1)
+
+        pool.start()
+        try:
+            pool.get_key()
+        finally:
+            pool.stop()
+        assert pool.hits + pool.misses == 2
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from exhibitor_tls_artifacts import staging as staging_module
+from exhibitor_tls_artifacts.staging import (find_stale, remove_staging,
+                                             staged_directory, staged_entries,
+                                             staged_file, staging_path)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class TestStaging:
+    """
+    Test publishing output through staging paths.
+    """
+
+    def test_staged_directory(self, tmp_path):
+        target = tmp_path / 'artifacts'
+        with staged_directory(target) as staging:
+            assert staging.parent == tmp_path
+            (staging / 'node').mkdir()
+            (staging / 'node' / 'key.pem').write_bytes(b'key')
+            assert not target.exists()
+
+        assert (target / 'node' / 'key.pem').read_bytes() == b'key'
+        assert os.listdir(str(tmp_path)) == ['artifacts']
+
+    def test_staged_directory_failure(self, tmp_path):
+        target = tmp_path / 'artifacts'
+        with pytest.raises(RuntimeError):
+            with staged_directory(target) as staging:
+                (staging / 'key.pem').write_bytes(b'key')
+                raise RuntimeError()
+        assert os.listdir(str(tmp_path)) == []
+
+        # An empty directory created in the meantime is not replaced.
+        with pytest.raises(FileExistsError):
+            with staged_directory(target):
+                target.mkdir()
+        assert os.listdir(str(tmp_path)) == ['artifacts']
+
+    def test_staged_entries(self, tmp_path):
+        (tmp_path / 'existing').mkdir()
+        with staged_entries(tmp_path) as staging:
+            (staging / 'node').mkdir()
+            (staging / 'node' / 'key.pem').write_bytes(b'key')
+
+        assert sorted(os.listdir(str(tmp_path))) == ['existing', 'node']
+
+        with pytest.raises(FileExistsError):
+            with staged_entries(tmp_path) as staging:
+                (staging / 'existing').mkdir()
+        assert sorted(os.listdir(str(tmp_path))) == ['existing', 'node']
+
+    def test_staged_entries_rollback(self, tmp_path, monkeypatch):
+        rename = staging_module._rename_directory
+        calls = []
+
+        def fail_second(staging, target):
+            calls.append(target)
+            if len(calls) == 2:
+                raise OSError('disk failure')
+            rename(staging, target)
+
+        monkeypatch.setattr(staging_module, '_rename_directory', fail_second)
+        with pytest.raises(OSError):
+            with staged_entries(tmp_path) as staging:
+                for node in ('node-1', 'node-2', 'node-3'):
+                    (staging / node).mkdir()
+        assert len(calls) == 2
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_staged_entries_crash(self, tmp_path):
+        # The process is killed between two renames.
+        code = (
+            'import os, sys\n'
+            'from exhibitor_tls_artifacts import staging\n'
+            'rename = staging._rename_directory\n'
+            'def crash(source, target):\n'
+            '    if target.endswith("node-2"):\n'
+            '        os._exit(1)\n'
+            '    rename(source, target)\n'
+            'staging._rename_directory = crash\n'
+            'with staging.staged_entries(sys.argv[1]) as path:\n'
+            '    for node in ("node-1", "node-2"):\n'
+            '        (path / node).mkdir()\n')
+        subprocess.run([sys.executable, '-c', code, str(tmp_path)])
+        stale, = find_stale(tmp_path)
+        assert sorted(os.listdir(str(tmp_path))) == [stale.name, 'node-1']
+
+        remove_staging(stale)
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_staged_file(self, tmp_path):
+        target = tmp_path / 'artifacts.tar'
+        with staged_file(target, 0o600) as f:
+            f.write(b'archive')
+        assert target.read_bytes() == b'archive'
+        assert target.stat().st_mode & 0o777 == 0o600
+
+        with pytest.raises(FileExistsError):
+            with staged_file(target, 0o600) as f:
+                f.write(b'other')
+        assert target.read_bytes() == b'archive'
+        assert os.listdir(str(tmp_path)) == ['artifacts.tar']
+
+    def test_find_stale(self, tmp_path):
+        live = staging_path(tmp_path / 'live')
+        live.mkdir()
+        stale = tmp_path / '.artifacts.staging-{}-0123abcd'.format(dead_pid())
+        stale.mkdir()
+        (tmp_path / '.unrelated').mkdir()
+
+        assert find_stale(tmp_path) == [stale]
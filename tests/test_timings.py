@@ -0,0 +1,101 @@
+import json
+
+from exhibitor_tls_artifacts import timings
+from exhibitor_tls_artifacts.ensemble import generate_nodes
+from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
+
+
+class TestTimings:
+    """
+    Test recording and reporting the timings of the generation stages.
+    """
+
+    def test_disabled(self):
+        with timings.span('stage'):
+            pass
+        assert not timings.enabled()
+
+    def test_listener(self):
+        spans = []
+        timings.add_listener(spans.append)
+        try:
+            with timings.node_label('10.10.10.10'):
+                with timings.span('inner', 'client-cert'):
+                    pass
+            with timings.span('outer'):
+                pass
+        finally:
+            timings.remove_listener(spans.append)
+
+        assert [(span.stage, span.node, span.artifact) for span in spans] == [
+            ('inner', '10.10.10.10', 'client-cert'), ('outer', None, None)]
+        assert all(span.duration >= 0 for span in spans)
+        assert not timings.enabled()
+
+    def test_worker_spans(self):
+        cert_gen = CertificateGenerator(key_type='ecdsa')
+        root = cert_gen.issue(cert_name='root')
+        truststore = KeystoreGenerator().build_truststore([('root-cert',
+                                                            root.cert)])
+
+        with timings.recording() as recorder:
+            generate_nodes(['10.10.10.10', '10.10.10.11'], 2, root,
+                           truststore, 'native', key_type='ecdsa')
+
+        node_spans = [span for span in recorder.spans if span.stage == 'node']
+        assert sorted(span.node for span in node_spans) == [
+            '10.10.10.10', '10.10.10.11']
+        signs = [(span.node, span.artifact) for span in recorder.spans
+                 if span.stage == 'sign']
+        assert sorted(signs) == [('10.10.10.10', 'client'),
+                                 ('10.10.10.10', 'server'),
+                                 ('10.10.10.11', 'client'),
+                                 ('10.10.10.11', 'server')]
+
+    def test_reports(self):
+        spans = [
+            timings.Span('keygen', '10.10.10.10', 'client', 0, 2.0),
+            timings.Span('keygen', '10.10.10.10', 'server', 2, 4.0),
+            timings.Span('sign', '10.10.10.10', 'client', 6, 0.5),
+        ]
+        assert timings.summarize(spans) == [
+            {'stage': 'keygen', 'count': 2, 'total': 6.0, 'self': 6.0,
+             'mean': 3.0, 'max': 4.0},
+            {'stage': 'sign', 'count': 1, 'total': 0.5, 'self': 0.5,
+             'mean': 0.5, 'max': 0.5},
+        ]
+
+        table = timings.format_report(spans, 'table').splitlines()
+        assert table[1].split() == ['keygen', '2', '6.000s', '6.000s',
+                                    '3.000s', '4.000s']
+
+        report = json.loads(timings.format_report(spans, 'json'))
+        assert report['spans'][2] == {'stage': 'sign', 'node': '10.10.10.10',
+                                      'artifact': 'client', 'start': 6,
+                                      'duration': 0.5}
+
+    def test_nested_spans(self):
+        spans = [
+            timings.Span('keygen', '10.10.10.10', 'client', 1, 2.0),
+            timings.Span('sign', '10.10.10.10', 'client', 3, 1.0),
+            timings.Span('node', '10.10.10.10', None, 1, 4.0),
+            # Runs in parallel, within the node span of the other node.
+            timings.Span('keygen', '10.10.10.11', 'client', 2, 2.0),
+            timings.Span('write', None, None, 6, 1.0),
+            timings.Span('run', None, None, 0, 10.0),
+        ]
+        assert timings.self_times(spans) == [2.0, 1.0, 1.0, 2.0, 1.0, 5.0]
+
+        summary = {stage['stage']: stage
+                   for stage in timings.summarize(spans[:3] + spans[4:])}
+        assert summary['node']['total'] == 4.0
+        assert summary['node']['self'] == 1.0
+        # Without parallel nodes the self times add up to the whole run.
+        assert sum(stage['self'] for stage in summary.values()) == 10.0
+        assert sum(stage['total'] for stage in summary.values()) == 18.0
+
+        # Spans with the same interval, the inner one is emitted first.
+        same = [timings.Span('sign', None, None, 0, 1.0),
+                timings.Span('root', None, None, 0, 1.0)]
+        assert timings.self_times(same) == [1.0, 0.0]
@@ -0,0 +1,127 @@
+import json
+
+from click.testing import CliRunner
+
+from exhibitor_tls_artifacts.artifacts import (cert_artifact, key_artifact,
+                                               write_artifacts)
+from exhibitor_tls_artifacts.ensemble import (build_node_artifacts,
+                                             root_artifacts)
+from exhibitor_tls_artifacts.gen_artifacts import cli
+from exhibitor_tls_artifacts.gen_certificates import CertificateGenerator
+from exhibitor_tls_artifacts.gen_stores import KeystoreGenerator
+from exhibitor_tls_artifacts.manifest import build_manifest, manifest_artifact
+from exhibitor_tls_artifacts.verify import verify_tree
+
+NODES = ['10.10.10.10', '10.10.10.11']
+
+
+class TestVerify:
+    """
+    Test verifying the artifacts of an artifact directory.
+    """
+
+    @staticmethod
+    def _generate(directory):
+        cert_gen = CertificateGenerator(key_type='ecdsa')
+        store_gen = KeystoreGenerator()
+        root = cert_gen.issue(cert_name='root')
+        truststore = store_gen.build_truststore([('root-cert', root.cert)])
+
+        artifacts = root_artifacts(root, truststore)
+        artifacts.append(key_artifact('root-key.pem', root.key))
+        for node in NODES:
+            artifacts.extend(
+                build_node_artifacts(node, root, truststore, cert_gen,
+                                     store_gen))
+        artifacts.append(manifest_artifact(build_manifest(artifacts)))
+        write_artifacts(directory, artifacts)
+        return cert_gen
+
+    def test_valid(self, tmp_path):
+        self._generate(tmp_path)
+
+        assert verify_tree(tmp_path) == (NODES, [])
+        assert verify_tree(tmp_path, jobs=2) == (NODES, [])
+
+    def test_foreign_certificate(self, tmp_path):
+        cert_gen = self._generate(tmp_path)
+        other_root = cert_gen.issue(cert_name='root')
+        client = cert_gen.issue(cert_name='client',
+                                sa_names=['localhost'],
+                                issuer=other_root)
+        write_artifacts(tmp_path, [
+            cert_artifact('10.10.10.11/client-cert.pem', client.cert),
+            key_artifact('10.10.10.11/client-key.pem', client.key)
+        ], overwrite=True)
+        (tmp_path / 'manifest.json').unlink()
+
+        _, problems = verify_tree(tmp_path, jobs=2)
+        assert problems == [
+            '10.10.10.11: client certificate is not signed by the root key',
+            '10.10.10.11: client certificate is missing the SANs exhibitor, '
+            '127.0.0.1, 10.10.10.11',
+            '10.10.10.11: clientstore.jks does not contain client-cert.pem',
+        ]
+
+    def test_mismatching_key(self, tmp_path):
+        cert_gen = self._generate(tmp_path)
+        write_artifacts(tmp_path, [
+            key_artifact('10.10.10.10/client-key.pem', cert_gen.generate_key())
+        ], overwrite=True)
+
+        _, problems = verify_tree(tmp_path)
+        assert problems == [
+            '10.10.10.10/client-key.pem does not match the manifest',
+            '10.10.10.10: client-key.pem does not match client-cert.pem',
+        ]
+
+    def test_modes_and_stores(self, tmp_path):
+        self._generate(tmp_path)
+        (tmp_path / 'root-key.pem').chmod(0o644)
+        (tmp_path / '10.10.10.10' / 'truststore.jks').write_bytes(
+            (tmp_path / '10.10.10.10' / 'clientstore.jks').read_bytes())
+        manifest = json.loads((tmp_path / 'manifest.json').read_text())
+        del manifest['artifacts']['10.10.10.10/truststore.jks']
+        (tmp_path / 'manifest.json').write_text(json.dumps(manifest))
+
+        _, problems = verify_tree(tmp_path)
+        assert problems == [
+            'root-key.pem has mode 0644, expected 0600',
+            '10.10.10.10/truststore.jks must only contain the root '
+            'certificate as root-cert',
+        ]
+
+    def test_damaged_files(self, tmp_path):
+        self._generate(tmp_path)
+        (tmp_path / 'manifest.json').unlink()
+        for path in ('10.10.10.10/client-cert.pem',
+                     '10.10.10.11/client-key.pem', 'root-key.pem'):
+            data = (tmp_path / path).read_bytes()
+            (tmp_path / path).write_bytes(data[:len(data) // 2])
+
+        _, problems = verify_tree(tmp_path)
+        assert [problem.split(':')[0] for problem in problems] == [
+            'root-key.pem cannot be parsed',
+            '10.10.10.10',
+            '10.10.10.11',
+        ]
+        assert problems[1].startswith(
+            '10.10.10.10: client-cert.pem cannot be parsed')
+        assert problems[2].startswith(
+            '10.10.10.11: client-key.pem cannot be parsed')
+
+        result = CliRunner().invoke(cli, ['verify', str(tmp_path)])
+        assert result.exit_code == 1
+        assert 'Found 3 problems' in result.output
+
+    def test_missing_files(self, tmp_path):
+        self._generate(tmp_path)
+        (tmp_path / '10.10.10.11' / 'client-cert.pem').unlink()
+
+        nodes, problems = verify_tree(tmp_path)
+        assert nodes == NODES
+        assert problems == [
+            '10.10.10.11/client-cert.pem is listed in the manifest but '
+            'missing',
+            '10.10.10.11/client-cert.pem is missing',
+        ]